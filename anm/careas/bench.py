@@ -0,0 +1,275 @@
+"""
+Benchmark suite of careas hot paths on fixture data under version control
+(`bench_data` folder and `scm/test_pages`) - no network, no user database.
+Median time per call of each case is compared with a baseline saved on this
+machine and changes slower than `threshold` are flagged as regressions.
+
+run with
+python -m aidbag.anm.careas.bench --save      # measure and save the baseline
+python -m aidbag.anm.careas.bench             # compare with the baseline (exit code 1 on regressions)
+python -m aidbag.anm.careas.bench -k pud -k memo --threshold 0.3
+"""
+import sys
+import json
+import timeit
+import random
+import argparse
+import pathlib
+import tempfile
+import statistics
+from datetime import datetime
+from contextlib import contextmanager
+from unittest import mock
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from ...web import htmlscrap
+from .config import config
+from .scm import pud, sortPud, scanUnumbers
+from .scm import parsing
+from .scm.bench_parsing import golden_pages
+from .poligonal.util import (
+    parse_coordinates,
+    formatMemorial
+    )
+from .poligonal.memorial import Poligon
+
+bench_data = pathlib.Path(__file__).parent / 'bench_data'
+baseline_file = bench_data / 'baseline.json'
+
+cases = {} # name : context manager yielding the function to time
+
+def case(function):
+    """register a benchmark case - a generator yielding a function without arguments"""
+    cases[function.__name__] = contextmanager(function)
+    return function
+
+
+def process_names(n=1000, seed=0):
+    """process names on the many formats `pud` accepts"""
+    rng = random.Random(seed)
+    formats = ['{g}.{n}/{y}', '{g}{n}-{y}', '48403.{g}.{n}/{y}-09', '{n}/{y}', 'processo {g}.{n}/{y}-12']
+    return [ rng.choice(formats).format(g=rng.randint(800, 899), n=f'{rng.randint(0, 999):03d}',
+        y=rng.randint(1930, 2024)) for _ in range(n) ]
+
+@case
+def pud_construct():
+    names = process_names()
+    yield lambda: [ pud(name) for name in names ]
+
+@case
+def pud_sort():
+    puds = [ pud(name) for name in process_names() ]
+    yield lambda: sorted(puds)
+
+@case
+def pud_sortnames():
+    """names ordered older to younger like a component `G.nodes`"""
+    names = process_names()
+    yield lambda: sortPud(names)
+
+@case
+def pud_scan():
+    """all process numbers of a ~1 MB text dump"""
+    text = '\n'.join( f'despacho do processo {name} e outros' for name in process_names(20000) )
+    yield lambda: scanUnumbers(text)
+
+@case
+def parse_basic():
+    pages = [ (name, basic) for name, basic, _ in golden_pages() ]
+    yield lambda: [ parsing.parseDadosBasicos(html, name, False, None) for name, html in pages ]
+
+@case
+def parse_polygon():
+    pages = [ polygon for _, _, polygon in golden_pages() if polygon ]
+    yield lambda: [ parsing.parseDadosPoligonal(html, False) for html in pages ]
+
+@case
+def processo_roundtrip():
+    """write dados on one manager and read them back on another (same database)"""
+    from .scm.manager import ProcessManagerClass
+    from .scm.processo import Processo
+    from .scm import sqlalchemy as sql
+    name, basic, _ = golden_pages()[0]
+    storage = config['scm']['process_storage_file']
+    with tempfile.TemporaryDirectory() as path:
+        config['scm']['process_storage_file'] = str(pathlib.Path(path) / 'ProcessesStored')
+        try:
+            writer, reader = ProcessManagerClass(), ProcessManagerClass()
+        finally:
+            config['scm']['process_storage_file'] = storage
+        sql.Base.metadata.create_all(writer._engine)
+        processo = Processo(name, manager=writer)
+        dados = processo.dados
+        dados.update(parsing.parseDadosBasicos(basic, name, False, None))
+        processo.update(dados)
+        counter = iter(range(sys.maxsize))
+        def roundtrip():
+            dados = processo.dados
+            dados['bench'] = next(counter)
+            processo.update(dados)
+            return reader[name].view
+        yield roundtrip
+        writer._engine.dispose()
+        reader._engine.dispose()
+
+def memorial():
+    return (bench_data / 'memorial.txt').read_text()
+
+@case
+def parse_coordinates_scm():
+    text = memorial()
+    yield lambda: parse_coordinates(text, decimal=True)
+
+@case
+def format_memorial():
+    latlon = parse_coordinates(memorial())
+    yield lambda: (formatMemorial(latlon, fmt='sigareas'), formatMemorial(latlon, fmt='gtmpro'))
+
+@case
+def memo_from_points():
+    points = parse_coordinates(memorial(), decimal=True)
+    yield lambda: Poligon().memo_from_points(points)
+
+@case
+def points_from_memo():
+    poligon = Poligon()
+    poligon.memo_from_points(parse_coordinates(memorial(), decimal=True))
+    yield poligon.points_from_memo
+
+class CannedProcesso:
+    """read-only `Processo` stand-in of canned dados"""
+    def __init__(self, dados):
+        self.view = self.dados = dados
+
+    def __getitem__(self, key):
+        return self.view[key]
+
+@case
+def interferencia_master():
+    """`Interferencia.createTableMaster` on a canned interference table (25 processes)"""
+    from .estudos import interferencia
+    canned = json.loads((bench_data / 'interferencia.json').read_text(encoding='utf-8'))
+    processos = { name : CannedProcesso({'ativo' : dados['ativo'], 'tipo' : dados['tipo'],
+        'fase' : dados['fase'], 'eventos' : dados['eventos'], 'polygon' : [{}]*dados['polygon'],
+        'prioridade' : datetime.fromisoformat(dados['prioridade'])})
+        for name, dados in canned['processos'].items() }
+    eventos = { name : dados['eventos_simples'] for name, dados in canned['processos'].items() }
+    estudo = interferencia.Interferencia.__new__(interferencia.Interferencia)
+    estudo.name, estudo.wpage = canned['name'], None
+    estudo.tabela_interf = pd.DataFrame([ {'Processo' : name, 'Dads' : dados['dads'],
+        'Sons' : dados['sons'], 'Ativo' : 'S' in dados['ativo']} for name, dados in canned['processos'].items() ])
+    def getEventosSimples(wpage, name): # typed like the real one
+        return htmlscrap.columnsFrame(dict(zip(eventos[name][0], map(list, zip(*eventos[name][1:])))),
+            dates=['Data'], ints=['Evento'])
+    def read_excel(path, **kwargs): # eventos_scm fixture is csv - no excel reader needed
+        return pd.read_csv(path, **kwargs)
+    with mock.patch.multiple(interferencia, ProcessManager=processos,
+            getEventosSimples=getEventosSimples), \
+         mock.patch.object(interferencia.pd, 'read_excel', read_excel), \
+         mock.patch.dict(config, {'eventos_scm' : str(bench_data / 'eventos_scm.csv')}):
+        yield estudo.createTableMaster
+
+
+def eventos_html():
+    """SIGAREAS like eventos simples page of all canned eventos (~900 rows)"""
+    canned = json.loads((bench_data / 'interferencia.json').read_text(encoding='utf-8'))
+    rows = [ row for dados in canned['processos'].values() for row in dados['eventos_simples'][1:] ]
+    header = ''.join( f'<th>{name}</th>' for name in ['Processo', 'Evento', 'Descrição', 'Data'] )
+    body = ''.join( '<tr>' + ''.join( f'<td> {value} </td>' for value in row ) + '</tr>' for row in rows )
+    return f'<html><body><table class="BordaTabela"><tr>{header}</tr>{body}</table></body></html>'
+
+@case
+def table_rows():
+    """eventos table as rows (`tableDataText`) then DataFrame and per row conversions"""
+    html = eventos_html()
+    def rows():
+        soup = BeautifulSoup(html, features="lxml")
+        rows = htmlscrap.tableDataText(soup.find("table", {'class': "BordaTabela"}))
+        frame = pd.DataFrame(rows[1:], columns=rows[0])
+        frame['Data'] = frame.Data.apply(lambda strdate: datetime.strptime(strdate, "%d/%m/%Y %H:%M:%S"))
+        frame['Evento'] = frame['Evento'].astype(int)
+        return frame
+    yield rows
+
+@case
+def table_columns():
+    """eventos table as typed columns (`tableFrame`)"""
+    html = eventos_html()
+    def columns():
+        root = htmlscrap.lxmlDocument(html)
+        table = root.xpath("//table[contains(concat(' ', normalize-space(@class), ' '), ' BordaTabela ')]")[0]
+        return htmlscrap.tableFrame(table, dates=['Data'], ints=['Evento'])
+    yield columns
+
+
+def measure(function, repeat=5):
+    """median seconds per call of `function` - calls per sample chosen to take at least 0.2 s"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return statistics.median( time/number for time in timer.repeat(repeat, number) )
+
+def run(selected=None, repeat=5, verbose=True):
+    """
+    measure `cases` - all or the ones whose name contains any of `selected`
+    returns: {case : seconds per call}
+    """
+    results = {}
+    for name, setup in cases.items():
+        if selected and not any( key in name for key in selected ):
+            continue
+        with setup() as function:
+            results[name] = measure(function, repeat)
+        if verbose:
+            print(f"{name:<24} {results[name]*1e3:>12.3f} ms", file=sys.stderr)
+    return results
+
+def compare(results, baseline, threshold=0.2):
+    """
+    relative change of `results` against `baseline`
+    returns: {case : (seconds, baseline seconds, change)} and list of regressions (change > threshold)
+    """
+    report, regressions = {}, []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        change = seconds/base - 1 if base else None
+        report[name] = (seconds, base, change)
+        if change is not None and change > threshold:
+            regressions.append(name)
+    return report, regressions
+
+def load_baseline(path=baseline_file):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def save_baseline(results, path=baseline_file):
+    """update the baseline of the cases measured"""
+    baseline = load_baseline(path)
+    baseline.update(results)
+    with open(path, 'w') as file:
+        json.dump(baseline, file, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="careas hot paths benchmark")
+    parser.add_argument('-k', dest='selected', action='append', help="only cases containing this")
+    parser.add_argument('--save', action='store_true', help="save the results as baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="slowdown flagged as regression")
+    parser.add_argument('--repeat', type=int, default=5, help="samples per case")
+    parser.add_argument('--baseline', default=str(baseline_file))
+    args = parser.parse_args()
+    results = run(args.selected, args.repeat, verbose=False)
+    report, regressions = compare(results, load_baseline(args.baseline), args.threshold)
+    print(f"{'case':<24} {'ms/call':>12} {'baseline':>12} {'change':>8}")
+    for name, (seconds, base, change) in report.items():
+        flag = ' REGRESSION' if name in regressions else ''
+        base = f"{base*1e3:>12.3f}" if base else f"{'-':>12}"
+        change = f"{change:>+8.1%}" if change is not None else f"{'-':>8}"
+        print(f"{name:<24} {seconds*1e3:>12.3f} {base} {change}{flag}")
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f"baseline saved on {args.baseline}")
+    sys.exit(1 if regressions and not args.save else 0)
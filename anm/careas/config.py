@@ -8,12 +8,45 @@ config = {}
 config['sigareas'] = {}
 config['sigareas']['timeout'] = 3*60 # sometimes sigareas server/r. interferncia takes a long long time to answer 
 config['sigareas']['doc_prefix'] = 'rltrx' # can't use special characters issues with selenium
+# retries with backoff, retry budget and circuit breaker (web.resilience.Resilience)
+config['sigareas']['resilience'] = {'retries' : 3, 'backoff' : 2., 'max_backoff' : 60., 
+    'budget' : 0.2, 'min_retries' : 10, 'window' : 10, 'error_rate' : 0.5, 'cooldown' : 2*60.}
 
 #configs are per module
 config['scm'] = {} 
-# when to replace the process stored on the ProcessManager after this amount of time 
-config['scm']['process_expire'] = datetime.timedelta(weeks=1)
+# conditional refresh of stored processes by ProcessManager.GetorCreate (Processo.refresh)
+# ttl: time to live of each data group - once expired only the basic page is downloaded again,
+# polygon and associados are refreshed only if the basic page fingerprint changed
+# background: refresh on `workers` background threads - GetorCreate returns the stored data 
+config['scm']['refresh'] = { 'ttl' : {'basic' : datetime.timedelta(weeks=1), 
+    'polygon' : datetime.timedelta(weeks=4), 'associados' : datetime.timedelta(weeks=1)},
+    'background' : False, 'workers' : 2 }
 config['scm']['timeout']= 40
+# retries with backoff, retry budget and circuit breaker shared by all SCM requests (web.resilience.Resilience)
+config['scm']['resilience'] = {'retries' : 2, 'backoff' : 1., 'max_backoff' : 30., 
+    'budget' : 0.2, 'min_retries' : 10, 'window' : 20, 'error_rate' : 0.5, 'cooldown' : 60.}
+# maximum number of concurrent SCM requests when expanding associados graph
+config['scm']['associados_workers'] = 4
+# pool of authenticated SCM sessions (wPageNtlmPool) shared by ProcessManager
+# maxsize idle sessions kept per credential, evicted after idle_timeout seconds
+config['scm']['session_pool'] = {'maxsize' : 8, 'idle_timeout' : 5*60}
+# bulk refresh of every stored process (ProcessManager.runTask)
+# threads for SCM requests and processes for html parsing (None = number of cpus)
+config['scm']['bulk'] = {'threads' : 8, 'processes' : None}
+# sqlite PRAGMA's of the storage database - WAL readers don't block the writer 
+config['scm']['sqlite'] = {'journal_mode' : 'WAL', 'synchronous' : 'NORMAL', 'busy_timeout' : 30*1000}
+# ProcessManager.writebehind flushes after this number of processes changed
+config['scm']['writebehind'] = {'batch' : 200}
+# html parser of SCM pages 'lxml' (fast only id'd elements) or 'bs4' (BeautifulSoup html.parser reference)
+config['scm']['parser'] = 'lxml'
+# reuse the form state (__VIEWSTATE etc.) of the last SCM response of the same session
+# skips a GET before each process lookup - falls back to a GET if the server refuses it
+config['scm']['reuse_viewstate'] = False
+# SCM lookups as AJAX partial postbacks - only the page update panels are transferred and stored
+config['scm']['ajax_delta'] = False
+# polygon page images: store - kept once on table IMAGES and referenced by hash (False embeds base64 on every page)
+# workers - threads downloading the distinct images of a page
+config['scm']['images'] = {'store' : True, 'workers' : 4}
 config['scm'].update({'html_prefix' : {'basic': 'scm_basicos_', 'polygon': 'scm_poligonal_'} })
 
 # sei module configurations
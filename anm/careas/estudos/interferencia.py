@@ -22,6 +22,7 @@ from ..scm import (
 from ..util import processPath
 
 from ....web import htmlscrap 
+from ....web import tracing
 from .scraping import (
     fetch_save_Html,
     cancelaUltimo,
@@ -100,10 +101,11 @@ class Interferencia:
         
     def getPrioridade(self):
         """get best prioridade data available"""
-        dados = ProcessManager[self.name].dados
+        dados = ProcessManager[self.name].view
         return dados['prioridadec'] if 'prioridadec' in dados else dados['prioridade']
     
     @staticmethod
+    @tracing.traced('Interferencia.make', process=lambda wpage, processostr, *args, **kwargs: pud(processostr).str)
     def make(wpage, processostr, verbose=False, overwrite=False):
         """
         make folders and spreadsheets for specified process
@@ -139,12 +141,14 @@ class Interferencia:
             estudo.cancelLast()                
         return estudo
     
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def cancelLast(self):
         """
         Cancela ultimo estudo em aberto. ('opção', 'interferencia' etc..)
         """
         return cancelaUltimo(self.wpage, self.number, self.year)        
 
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def createTable(self):
         """Parse the .html previous downloaded containing interferentes data. 
         
@@ -159,14 +163,13 @@ class Interferencia:
 
         with open(self.sigareas_html, "r", encoding="utf-8") as f:
             htmltxt = f.read()
-        soup = BeautifulSoup(htmltxt, features="lxml")
-        interf_table = soup.find("table", {"id" : "ctl00_cphConteudo_gvLowerRight"})
-        if interf_table is None: # possible! no interferencia at all
+        root = htmlscrap.lxmlDocument(htmltxt)
+        interf_table = root.xpath("//table[@id='ctl00_cphConteudo_gvLowerRight']")
+        if not interf_table: # possible! no interferencia at all
             ## empty data frame, not yet possible 
             # self.tabela_interf = pd.DataFrame(columns=['Incluir', 'Processo', 'Evento', 'Descrição', 'Data'])
             return False # nenhuma interferencia SHOW!!
-        rows = htmlscrap.tableDataText(interf_table)
-        self.tabela_interf = pd.DataFrame(rows[1:], columns=rows[0])
+        self.tabela_interf = htmlscrap.tableFrame(interf_table[0])
         # columns to fill in 
         self.tabela_interf['Dads'] = 0
         self.tabela_interf['Sons'] = 0
@@ -200,6 +203,7 @@ class Interferencia:
 
 
 
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def createTableMaster(self):
         """
         Create `tabela_interf_eventos` from `self.tabela_interf` previouly parsed,        
@@ -214,20 +218,16 @@ class Interferencia:
         for _,row in self.tabela_interf.iterrows(): # for each possible prioritário
             # table from eventos simples is more complete ['Processo', 'Evento', 'Descrição', 'Data']
             # and also contains Data with time precison we will use it 
+            # 'Data' already datetime for comparison bellow and 'Evento' int
             events = getEventosSimples(self.wpage, row['Processo']) 
-            # strdate to datetime use bellow for comparison
-            events['Data'] = events.Data.apply(
-                lambda strdate: datetime.strptime(strdate, "%d/%m/%Y %H:%M:%S"))     
             # we will add ['Observação','Publicação D.O.U'] from SCM Basicos    
-            pdados = ProcessManager[row['Processo']].dados
-            eventos_scm = pdados['eventos']
+            pdados = ProcessManager[row['Processo']].view # read-only no copy
+            eventos_scm = pdados['eventos'].copy()
             eventos_scm = pd.DataFrame(eventos_scm[1:], columns=eventos_scm[0])
             events['Obs'] = eventos_scm['Observação']
             events['DOU'] = eventos_scm['Publicação D.O.U']
             # index number for each event
             events['EvSeq'] = len(events)-events.index.values.astype(int) # set correct order of events
-            # cast to int Event number will be used to join eventos que inativam bellow
-            events['Evento'] = events['Evento'].astype(int)
             # put count of associados father and sons
             events['Dads'] = row['Dads']
             events['Sons'] = row['Sons']
@@ -306,6 +306,7 @@ class Interferencia:
         return True    
 
 
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def getcLayers(self):
         """from page get checked layers (camadas) by checkboxes"""  
         with open(self.sigareas_html) as f:
@@ -316,6 +317,7 @@ class Interferencia:
         self.clayers = trs
 
 
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def to_database(self):
         """
         update database with ['estudo']['table'] 
@@ -336,6 +338,7 @@ class Interferencia:
         ProcessManager[self.name].update({'estudo' : estudo})
   
 
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def to_excel(self):
         """pretty print to excel file tabela interferencia master"""
         if self.tabela_interf_master is None:
@@ -452,6 +455,7 @@ class Interferencia:
         estudo.tabela_interf_master = pd.read_excel(file_path[0])          
         return estudo        
     
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def fetchnsaveHTML(self, overwrite=False):
         """fetch and save html interferencia raises DownloadInterferenciaFailed on fail"""
         html_file = (config['interferencia']['html_prefix']['this']+'_'+
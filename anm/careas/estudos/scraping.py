@@ -3,6 +3,7 @@ from bs4 import BeautifulSoup
 import pandas as pd 
 from ..config import config 
 from ....web import htmlscrap
+from ....web.resilience import Resilience
 from ..scm import pud 
 
 class CancelaUltimoEstudoFailed(Exception):
@@ -13,19 +14,25 @@ class DownloadInterferenciaFailed(Exception):
     """could not download retirada de interferencia"""
     pass 
 
-def cancelaUltimo(wpage, number, year, retry_on_error=3):
-    """Danger Zone - cancela ultimo estudo em aberto sem perguntar mais nada:
-    - estudo de retirada de Interferencia
-    - estudo de opcao de area        
-    """
-    wpage.get('http://sigareas.dnpm.gov.br/Paginas/Usuario/CancelarEstudo.aspx')
+class UnexpectedErrorSigareas(DownloadInterferenciaFailed):
+    """'O sistema se comportou de forma inesperada.' - worth trying again"""
+    pass 
+
+resilience = Resilience(**config['sigareas']['resilience'], policies={
+    CancelaUltimoEstudoFailed : {'retry' : True},
+    UnexpectedErrorSigareas : {'retry' : True}})
+"""retries, backoff and circuit breaker shared by all SIGAREAS requests - see `resilience.stats`"""
+
+def _cancelaUltimo(wpage, number, year, timeout=None, attempt=0):
+    """one attempt of `cancelaUltimo`"""
+    wpage.get('http://sigareas.dnpm.gov.br/Paginas/Usuario/CancelarEstudo.aspx', timeout=timeout)
     formcontrols = {
         'ctl00$cphConteudo$txtNumero': number,
         'ctl00$cphConteudo$txtAno': year,
         'ctl00$cphConteudo$btnConsultar': 'Consultar'
     }
     formdata = htmlscrap.formdataPostAspNet(wpage.response.text, formcontrols)    
-    wpage.post('http://sigareas.dnpm.gov.br/Paginas/Usuario/CancelarEstudo.aspx', data=formdata) # Consulta
+    wpage.post('http://sigareas.dnpm.gov.br/Paginas/Usuario/CancelarEstudo.aspx', data=formdata, timeout=timeout) # Consulta
     formcontrols = { # Cancela
         'ctl00$cphConteudo$txtNumero': number,
         'ctl00$cphConteudo$txtAno': year,
@@ -33,17 +40,26 @@ def cancelaUltimo(wpage, number, year, retry_on_error=3):
         'ctl00$cphConteudo$rptEstudo$ctl00$btnCancelar.y': '12'
     }
     formdata = htmlscrap.formdataPostAspNet(wpage.response.text, formcontrols)
-    wpage.post('http://sigareas.dnpm.gov.br/Paginas/Usuario/CancelarEstudo.aspx', data=formdata)
+    wpage.post('http://sigareas.dnpm.gov.br/Paginas/Usuario/CancelarEstudo.aspx', data=formdata, timeout=timeout)
     if not 'Estudo excluído com sucesso.' in wpage.response.text:   
-        if retry_on_error:
-            return cancelaUltimo(wpage, number, year, retry_on_error-1)
-        else:
-            raise CancelaUltimoEstudoFailed()
+        raise CancelaUltimoEstudoFailed()
     return True
+
+def cancelaUltimo(wpage, number, year, retry_on_error=3):
+    """Danger Zone - cancela ultimo estudo em aberto sem perguntar mais nada:
+    - estudo de retirada de Interferencia
+    - estudo de opcao de area        
+    Retries with backoff see `resilience`.
+    """
+    if getattr(wpage, 'nretries', 0): # `resilience` retries - not urllib3
+        wpage.setRetries(0)
+    return resilience.call(_cancelaUltimo, wpage, number, year, 
+        timeout=config['sigareas']['timeout'], retries=retry_on_error)
             
 
-def fetch_save_Html(wpage, number, year, html_file, retry_on_error=3):
-    wpage.get('http://sigareas.dnpm.gov.br/Paginas/Usuario/ConsultaProcesso.aspx?estudo=1')
+def _fetch_save_Html(wpage, number, year, html_file, timeout=None, attempt=0):
+    """one attempt of `fetch_save_Html`"""
+    wpage.get('http://sigareas.dnpm.gov.br/Paginas/Usuario/ConsultaProcesso.aspx?estudo=1', timeout=timeout)
     formcontrols = {
         'ctl00$cphConteudo$txtNumProc': number,
         'ctl00$cphConteudo$txtAnoProc': year,
@@ -51,23 +67,27 @@ def fetch_save_Html(wpage, number, year, html_file, retry_on_error=3):
     }
     formdata = htmlscrap.formdataPostAspNet(wpage.response.text, formcontrols)
     wpage.post('http://sigareas.dnpm.gov.br/Paginas/Usuario/ConsultaProcesso.aspx?estudo=1',
-            data=formdata, timeout=config['sigareas']['timeout'])
+            data=formdata, timeout=timeout)
     if not ( wpage.response.url == r'http://sigareas.dnpm.gov.br/Paginas/Usuario/Mapa.aspx?estudo=1'):
         soup = BeautifulSoup(wpage.response.text, 'html.parser')                        
         # falhou salvar Retirada de Interferencia return error message                        
         error_status = soup.find('span', { 'class' : 'MensagemErro' }).text.strip()                     
         if ('O sistema se comportou de forma inesperada.' in error_status):
-            if retry_on_error: 
-                fetch_save_Html(wpage, number, year, html_file, retry_on_error-1)                          
-            else:
-                raise DownloadInterferenciaFailed(error_status)     
+            raise UnexpectedErrorSigareas(error_status)     
         elif ('Cancele o estudo existente para realizar novo estudo.' in error_status):
-            cancelaUltimo(wpage, number, year)
-            fetch_save_Html(wpage, number, year, html_file, retry_on_error)
+            _cancelaUltimo(wpage, number, year, timeout) # same attempt - no nested `resilience.call`
+            return _fetch_save_Html(wpage, number, year, html_file, timeout, attempt)
         else:
             raise DownloadInterferenciaFailed(error_status)
     else:
         wpage.saveSimpleHTML(html_file)    
+
+def fetch_save_Html(wpage, number, year, html_file, retry_on_error=3):
+    """download and save retirada de interferencia html - retries with backoff see `resilience`"""
+    if getattr(wpage, 'nretries', 0): # `resilience` retries - not urllib3
+        wpage.setRetries(0)
+    resilience.call(_fetch_save_Html, wpage, number, year, html_file, 
+        timeout=config['sigareas']['timeout'], retries=retry_on_error)
  
 
 
@@ -76,13 +96,13 @@ def getEventosSimples(wpage, processostr):
     """ Retorna tabela de eventos simples para processo especificado
     wpage : class wPage
     processostr : str
-    return : (Pandas DataFrame)"""
+    return : (Pandas DataFrame) 'Data' as datetime and 'Evento' as int"""
     processo_number, processo_year = pud(processostr).numberyear
     wpage.get(('http://sigareas.dnpm.gov.br/Paginas/Usuario/ListaEvento.aspx?processo='+
           processo_number+'_'+processo_year))
-    htmltxt = wpage.response.content
-    soup = BeautifulSoup(htmltxt, features="lxml")
-    eventstable = soup.find("table", {'class': "BordaTabela"})
-    rows = htmlscrap.tableDataText(eventstable)
-    df = pd.DataFrame(rows[1:], columns=rows[0])
-    return df
\ No newline at end of file
+    response = wpage.response
+    if 'charset' not in response.headers.get('content-type', '').lower(): 
+        response.encoding = response.apparent_encoding # not requests ISO-8859-1 default - accents
+    root = htmlscrap.lxmlDocument(response.text)
+    eventstable = root.xpath("//table[contains(concat(' ', normalize-space(@class), ' '), ' BordaTabela ')]")[0]
+    return htmlscrap.tableFrame(eventstable, dates=['Data'], ints=['Evento'])
\ No newline at end of file
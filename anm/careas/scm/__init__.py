@@ -1,6 +1,12 @@
 from .pud import (
     pud,
     cmpPud,
+    keyPud,
+    sortPud,
+    rankPud,
+    oldestPud,
+    scanPud,
+    scanUnumbers,
     NotProcessNumber
 )
 
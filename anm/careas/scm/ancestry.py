@@ -1,10 +1,9 @@
 import io 
 import numpy as np 
 import random 
-from functools import cmp_to_key
 import networkx as nx
 import matplotlib.pyplot as plt
-from .pud import cmpPud, pud
+from .pud import pud, sortPud
 from networkx import is_tree
 
 class pGraph(nx.DiGraph):
@@ -63,7 +62,7 @@ def plotGraph(G, layout=nx.spring_layout, figsize=(9,9)):
     Node sizes are giving from older to younger
     Labels are 'tipo' e 'data' da associação"""
     # compare process to get older to create node sizes?    
-    sortedNodes = sorted(list(G.nodes), key=cmp_to_key(cmpPud), reverse=False)
+    sortedNodes = sortPud(G.nodes)
     sizes = np.geomspace(100, 600,num=len(sortedNodes), dtype=int) # better sizes than limspace
     node_sizes = { k:v for k,v in zip(sortedNodes, sizes) }
     pos = layout(G)
@@ -89,7 +88,7 @@ def plotDirectGraphAssociados(Gd, root=None, show=False):
         if False returns a io.BytesIO of the image in png
     """
     # compare process to get older to create node sizes?    
-    sortedNodes = sorted(list(Gd.nodes), key=cmp_to_key(cmpPud))    
+    sortedNodes = sortPud(Gd.nodes)    
     sizes = np.geomspace(100, 600,num=len(sortedNodes), dtype=int) # better sizes than limspace
     node_sizes = { k:v for k,v in zip(sortedNodes, sizes) }
     # uses custom plotting layout bellow 
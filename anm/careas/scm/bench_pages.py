@@ -0,0 +1,74 @@
+"""
+Benchmark of `Processodb` row refresh latency and database size
+legacy html pages inline on STORAGE vs compressed deferred PAGES table.
+
+run with
+python -m aidbag.anm.careas.scm.bench_pages (Projects folder)
+"""
+import os
+import time
+import base64
+import random
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import (
+    Session,
+    mapped_column,
+    declarative_base
+    )
+from sqlalchemy import Integer, String, Text
+
+from . import sqlalchemy as sql
+
+LegacyBase = declarative_base()
+
+class LegacyProcessodb(LegacyBase):
+    """STORAGE layout before PAGES table - html pages on the same row"""
+    __tablename__ = 'STORAGE'
+    id = mapped_column('id', Integer, primary_key=True, autoincrement=True)
+    name = mapped_column('NAME', String(12), unique=True)
+    dados = mapped_column('DADOS', sql.JSONDT)
+    basic_html = mapped_column('PAGE_BASIC', Text)
+    polygon_html = mapped_column('PAGE_POLYGON', Text)
+
+
+def fake_pages(rng):
+    """basic page with a big __VIEWSTATE and polygon page with base64 embedded images"""
+    viewstate = base64.b64encode(rng.randbytes(60_000)).decode()
+    rows = ''.join(f'<tr><td>{i}</td><td>EVENTO {i}</td><td>01/01/2000</td></tr>' for i in range(300))
+    basic = (f'<input name="__VIEWSTATE" value="{viewstate}"/>'
+             f'<table id="ctl00_conteudo_gridEventos">{rows}</table>')
+    icon = base64.b64encode(bytes(range(256))*20).decode() # same icons on every page
+    polygon = basic + f'<img src="data:image;base64,{icon}">'*10
+    return basic, polygon
+
+
+def bench(model, path, nrows=200, nrefresh=2000, seed=0):
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{path}")
+    model.metadata.create_all(engine)
+    with Session(engine) as session:
+        for i in range(nrows):
+            p = model(name=f'{i:06d}/2000') if model is LegacyProcessodb else model(f'{i:06d}/2000')
+            p.dados = {'tipo' : 'Requerimento de Pesquisa', 'run' : {'basic' : True}}
+            p.basic_html, p.polygon_html = fake_pages(rng)
+            session.add(p)
+        session.commit()
+        objs = session.query(model).all()
+        start = time.perf_counter()
+        for i in range(nrefresh): # like `readdb` reading only dados['tipo']
+            obj = objs[i % nrows]
+            session.refresh(obj)
+            obj.dados['tipo']
+        elapsed = time.perf_counter() - start
+    engine.dispose()
+    return elapsed/nrefresh, os.path.getsize(path)
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = bench(LegacyProcessodb, os.path.join(tmp, 'legacy.db'))
+        pages = bench(sql.Processodb, os.path.join(tmp, 'pages.db'))
+    print(f"{'layout':<10} {'refresh (ms)':>14} {'db size (MB)':>14}")
+    for name, (latency, size) in [('legacy', legacy), ('pages', pages)]:
+        print(f"{name:<10} {latency*1e3:>14.3f} {size/2**20:>14.2f}")
@@ -0,0 +1,65 @@
+"""
+Benchmark of SCM pages parsing (pages per second) 
+BeautifulSoup "html.parser" vs lxml fast path (`config['scm']['parser']`)
+on the golden test pages or on pages stored on a database.
+
+run with
+python -m aidbag.anm.careas.scm.bench_parsing [path-to-ProcessesStored.db] (Projects folder)
+"""
+import sys
+import time
+import pathlib
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from ..config import config
+from . import parsing
+from . import sqlalchemy as sql
+from .pud import pud
+
+
+def golden_pages():
+    """(name, basic, polygon) of test_pages folder"""
+    path = pathlib.Path(__file__).parent / 'test_pages'
+    read = lambda file: file.read_text(encoding='utf-8') if file.exists() else ''
+    return [ (pud(file.name).str, read(file), read(path / file.name.replace('basicos', 'poligonal')))
+        for file in sorted(path.glob('scm_basicos_*.html')) ]
+
+def stored_pages(path, limit=500):
+    """(name, basic, polygon) stored on database `path`"""
+    engine = create_engine(f"sqlite:///{path}")
+    with Session(engine) as session:
+        rows = session.query(sql.Processodb.name, sql.Pagesdb.basic_html, sql.Pagesdb.polygon_html
+            ).join(sql.Processodb.pages).filter(sql.Pagesdb.basic_html != None).limit(limit).all()
+    engine.dispose()
+    return [ tuple(row) for row in rows ]
+
+def bench(pages, parser, mintime=2.):
+    """pages per second of basic and polygon pages parsing with `parser`"""
+    config['scm']['parser'] = parser
+    result = {}
+    for i, page_name in enumerate(['basic', 'polygon']):
+        htmls = [ (page[0], page[1+i]) for page in pages if page[1+i] ]
+        if not htmls:
+            continue
+        count, start = 0, time.perf_counter()
+        while time.perf_counter() - start < mintime:
+            for name, html in htmls:
+                if page_name == 'basic':
+                    parsing.parseDadosBasicos(html, name, False, None)
+                else:
+                    parsing.parseDadosPoligonal(html, False)
+                count += 1
+        result[page_name] = count/(time.perf_counter() - start)
+    return result
+
+
+if __name__ == "__main__":
+    pages = stored_pages(sys.argv[1]) if len(sys.argv) > 1 else golden_pages()
+    default = config['scm']['parser']
+    results = { parser : bench(pages, parser) for parser in ['bs4', 'lxml'] }
+    config['scm']['parser'] = default
+    print(f"{len(pages)} processes")
+    print(f"{'parser':<8} {'basic (pages/s)':>16} {'polygon (pages/s)':>18}")
+    for parser, result in results.items():
+        print(f"{parser:<8} {result.get('basic', 0):>16.1f} {result.get('polygon', 0):>18.1f}")
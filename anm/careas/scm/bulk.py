@@ -0,0 +1,342 @@
+import sys
+import json
+import time
+import traceback
+from datetime import datetime
+from collections import Counter
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    as_completed,
+    FIRST_COMPLETED
+    )
+import tqdm
+import numpy as np
+from sqlalchemy import text
+
+from ..config import config
+from .processo import SCM_SEARCH
+from .pud import unumbersPud
+from .parsing import (
+    parseDadosBasicos,
+    parseDadosPoligonal,
+    parser_version
+    )
+from .sqlalchemy import (
+    Processodb,
+    Pagesdb,
+    Checkpointdb
+    )
+
+
+def _fetch(manager, name, wpage, pages):
+    """
+    Thread pool stage: html of `pages` not parsed yet for process `name`.
+    Downloads (SCM) only the ones not stored on the database.
+    """
+    processo = manager[name]
+    processo._wpage = wpage
+    run = processo['run']
+    htmls = {}
+    for page in pages:
+        if run[page]:
+            continue
+        if not processo._get_html(page):
+            processo._pageRequest(page)
+        html = processo._get_html(page)
+        if html:
+            htmls[page] = html
+    return htmls
+
+
+def _parse(name, htmls):
+    """Process pool stage: CPU bound BeautifulSoup parsing of html pages"""
+    newdados = {'run' : list(htmls)} # pages parsed
+    if 'basic' in htmls:
+        newdados.update(parseDadosBasicos(htmls['basic'], name, False, None))
+    if 'polygon' in htmls:
+        newdados.update(parseDadosPoligonal(htmls['polygon'], False))
+    return newdados
+
+
+def _merge(processo, result, fetched=True):
+    """update `processo` dados with a `_parse` result and the parser version of its pages
+    * fetched : wether pages were just fetched (renew their time see `Processo.expired`)
+    """
+    dados = processo.dados
+    parsed = result.pop('run')
+    processo._mergeParsed(dados, result)
+    for page in parsed:
+        dados['run'][page] = True
+        dados.setdefault('parser', {})[page] = parser_version[page]
+        if fetched:
+            dados.setdefault('fetched', {})[page] = datetime.utcnow()
+    processo.update(dados)
+
+
+def _stats(stats, start):
+    """update elapsed time and processes/min of `stats`"""
+    stats['elapsed'] = time.perf_counter() - start
+    stats['per_min'] = (stats['done'] + stats['errors'].total())/stats['elapsed']*60
+
+
+def refresh(manager, wpage, task=SCM_SEARCH.BASICOS, run='runTask',
+        threads=None, processes=None, retry_errors=True, verbose=False):
+    """
+    Run `task` on every process stored on the database.
+    SCM requests run on a thread pool, html parsing on a process pool and
+    graph tasks (associados, prioridade) back on the thread pool.
+    Writes are batched by `ProcessManager.writebehind`.
+    Progress is saved on table CHECKPOINT under `run` name so an interrupted
+    run started again with the same `run` skips what was already done.
+
+    * manager : ProcessManagerClass
+    * wpage : wPageNtlm
+        credentials for SCM requests
+    * task : SCM_SEARCH
+    * run : str
+        checkpoint name of this run
+    * threads, processes : int
+        pool sizes default from `config['scm']['bulk']`
+    * retry_errors : bool
+        wether to run again processes that failed on a previous run
+
+    returns: dict of stats like
+        {'done' : 10, 'errors' : {'NotFoundErrorSCM' : 2}, 'elapsed' : 60., 'per_min' : 12.}
+    """
+    threads = threads or config['scm']['bulk']['threads']
+    processes = processes or config['scm']['bulk']['processes']
+    pages = [ page for flag, page in [(SCM_SEARCH.BASICOS, 'basic'), (SCM_SEARCH.POLIGONAL, 'polygon')]
+        if flag in task ]
+    graph_task = task & (SCM_SEARCH.ASSOCIADOS | SCM_SEARCH.PRIORIDADE)
+    with manager.session() as session: # only names no html or dados
+        names = [ name for name, in session.query(Processodb.name).all() ]
+        query = session.query(Checkpointdb.name).filter(Checkpointdb.run == run)
+        if retry_errors:
+            query = query.filter(Checkpointdb.status == 'ok')
+        done = { name for name, in query.all() }
+    todo = [ name for name in names if name not in done ]
+    stats = {'done' : 0, 'errors' : Counter(), 'elapsed' : 0., 'per_min' : 0.}
+    start = time.perf_counter()
+    checkpoints = [] # only saved after processes writes are flushed
+
+    def save_checkpoints():
+        manager.flush()
+        with manager.session() as session:
+            for name, status in checkpoints:
+                session.merge(Checkpointdb(run, name, status))
+            session.commit()
+        checkpoints.clear()
+
+    def checkpoint(name, status):
+        checkpoints.append((name, status))
+        if len(checkpoints) >= config['scm']['writebehind']['batch']:
+            save_checkpoints()
+        if status == 'ok':
+            stats['done'] += 1
+        else:
+            stats['errors'][status] += 1
+        _stats(stats, start)
+        bar.update(1)
+        bar.set_postfix(per_min=f"{stats['per_min']:.1f}", errors=stats['errors'].total())
+
+    with (manager.writebehind(), ThreadPoolExecutor(threads) as tpool, 
+          ProcessPoolExecutor(processes) as ppool, tqdm.tqdm(total=len(todo)) as bar):
+        pending = { tpool.submit(_fetch, manager, name, wpage, pages) : ('fetch', name) for name in todo }
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, name = pending.pop(future)
+                try:
+                    result = future.result()
+                    if stage == 'parse': # a bad parse result doesn't stop the run
+                        _merge(manager[name], result)
+                except Exception as e: # RequestsSCMException subclasses and any other
+                    if verbose:
+                        print(f"bulk refresh {stage} failed for {name}\n{traceback.format_exc()}", file=sys.stderr)
+                    checkpoint(name, type(e).__name__)
+                    continue
+                if stage == 'fetch' and result:
+                    pending[ppool.submit(_parse, name, result)] = ('parse', name)
+                    continue
+                if stage != 'task' and graph_task:
+                    pending[tpool.submit(manager[name].runTask, graph_task, wpage)] = ('task', name)
+                    continue
+                checkpoint(name, 'ok')
+        save_checkpoints()
+    stats['errors'] = dict(stats['errors'])
+    return stats
+
+
+def reparse(manager, pages=('basic', 'polygon'), processes=None, force=False, verbose=False):
+    """
+    Re-parse html pages already stored on the database (no SCM requests) of 
+    processes parsed by an older `parser_version` (dados['parser']) or never parsed. 
+    Use after changing `scm_data_tags` or the parsers and bumping `parser_version`.
+    Pages are read in chunks of `config['scm']['writebehind']['batch']` processes,
+    parsed on a process pool and written batched by `ProcessManager.writebehind`.
+
+    * pages : 'basic' and/or 'polygon'
+    * processes : int
+        pool size default from `config['scm']['bulk']`
+    * force : bool
+        re-parse every stored page no matter its version
+
+    returns: dict of stats like `refresh`
+    """
+    processes = processes or config['scm']['bulk']['processes']
+    columns = {'basic' : 'PAGE_BASIC', 'polygon' : 'PAGE_POLYGON'}
+    manager.flush() # versions of not flushed writes
+    if manager._legacypages: # only the PAGES table is read 
+        raise RuntimeError("html pages on legacy STORAGE columns - run `ProcessManager.migrate_pages` first")
+    stale = {} # name : [pages]
+    with manager.session() as session:
+        for page in pages:
+            query = (f"SELECT STORAGE.NAME FROM STORAGE JOIN PAGES ON PAGES.id = STORAGE.id "
+                     f"WHERE PAGES.{columns[page]} IS NOT NULL")
+            if not force:
+                query += f" AND coalesce(json_extract(STORAGE.DADOS, '$.parser.{page}'), 0) < :version"
+            for name, in session.execute(text(query), {'version' : parser_version[page]}):
+                stale.setdefault(name, []).append(page)
+    names = list(stale)
+    stats = {'done' : 0, 'errors' : Counter(), 'elapsed' : 0., 'per_min' : 0.}
+    start = time.perf_counter()
+    chunk = config['scm']['writebehind']['batch']
+    with (manager.writebehind(), ProcessPoolExecutor(processes) as ppool, 
+          tqdm.tqdm(total=len(names)) as bar):
+        for i in range(0, len(names), chunk): # don't load all pages in memory
+            with manager.session() as session:
+                rows = session.query(Processodb.name, Pagesdb.basic_html, Pagesdb.polygon_html
+                    ).join(Processodb.pages).filter(Processodb.name.in_(names[i:i+chunk])).all()
+            futures = {}
+            for name, basic, polygon in rows:
+                htmls = { page : html for page, html in [('basic', basic), ('polygon', polygon)]
+                    if page in stale[name] and html } # empty pages were never downloaded
+                if htmls:
+                    futures[ppool.submit(_parse, name, htmls)] = name
+                else:
+                    bar.update(1)
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    _merge(manager[name], future.result(), fetched=False)
+                except Exception as e: 
+                    if verbose:
+                        print(f"bulk reparse failed for {name}\n{traceback.format_exc()}", file=sys.stderr)
+                    stats['errors'][type(e).__name__] += 1
+                else:
+                    stats['done'] += 1
+                _stats(stats, start)
+                bar.update(1)
+    stats['errors'] = dict(stats['errors'])
+    return stats
+
+
+def components(names, sources, targets):
+    """
+    connected components of the undirected graph of edges `sources` -> `targets` 
+    (np arrays of indexes on `names`) - min label propagation with pointer jumping.
+    returns: np array with the label (smallest index) of each name
+    """
+    labels = np.arange(len(names))
+    while True:
+        previous = labels
+        edge = np.minimum(labels[sources], labels[targets])
+        labels = labels.copy()
+        np.minimum.at(labels, sources, edge)
+        np.minimum.at(labels, targets, edge)
+        while True: # pointer jumping
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def prioridades(manager, verbose=False):
+    """
+    'prioridadec' (prioridade of the oldest process of its associations component) of every 
+    stored process with associations - no SCM requests, only dados['associados']['dict'].
+    Components are built once for all on the undirected associations and the oldest
+    of each is found by `pud` order (vectorized) - like `toChronology` and `oldestPud`. 
+    Components that are not trees are only reported (like `Processo._expandAssociados`).
+    So are components with an association listed by only one of two stored processes:
+    the graph `Processo._expandAssociados` walks would depend on where it starts.
+    All processes are written on one transaction.
+    
+    returns: dict of stats like 
+        {'components' : 10, 'trees' : 9, 'not_trees' : [[names], ...], 'one_sided' : [[names], ...], 
+         'missing' : [names], 'updated' : 40, 'elapsed' : 1.}
+    """
+    start = time.perf_counter()
+    manager.flush() # not flushed writes are not on the database
+    with manager.session() as session:
+        rows = session.execute(text("SELECT NAME, json_extract(DADOS, '$.associados.dict'), "
+            "json_extract(DADOS, '$.prioridade'), json_type(DADOS, '$.prioridade') FROM STORAGE")).all()
+    stored = { name for name, *_ in rows }
+    prioridade = {} # name : JSON text of its prioridade
+    edges = []
+    for name, associados, value, jtype in rows:
+        if jtype is not None and jtype != 'null':
+            prioridade[name] = value if jtype == 'object' else json.dumps(value)
+        for associado in (json.loads(associados) if associados else {}):
+            edges.append((name, associado))
+    names = list(dict.fromkeys( name for edge in edges for name in edge ))
+    index = { name : i for i, name in enumerate(names) }
+    pairs = np.array([ (index[u], index[v]) for u, v in edges ], dtype=np.int64).reshape(-1, 2)
+    pairs = np.unique(pairs, axis=0) # directed without repetitions 
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    # undirected - listed by one side only if it appears once
+    pairs, sides = np.unique(np.sort(pairs, axis=1), axis=0, return_counts=True) 
+    isstored = np.array([ name in stored for name in names ], dtype=bool)
+    onesided = pairs[(sides == 1) & isstored[pairs[:, 0]] & isstored[pairs[:, 1]]]
+    keys = unumbersPud(names)
+    labels = components(names, pairs[:, 0], pairs[:, 1])
+    # tree: edges = nodes - 1 
+    nodes = np.bincount(labels, minlength=len(names))
+    links = np.bincount(labels[pairs[:, 0]], minlength=len(names))
+    roots = np.flatnonzero(nodes)
+    trees = roots[links[roots] == nodes[roots] - 1]
+    # oldest of each component - first by (component, key) order 
+    order = np.lexsort((keys, labels))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = labels[order][1:] != labels[order][:-1]
+    oldest = dict(zip(labels[order][first].tolist(), order[first].tolist()))
+    stats = {'components' : len(roots), 'trees' : len(trees), 'not_trees' : [], 'one_sided' : [], 
+        'missing' : [], 'updated' : 0, 'elapsed' : 0.}
+    istree = np.zeros(len(names), dtype=bool)
+    istree[trees] = True
+    isonesided = np.zeros(len(names), dtype=bool)
+    isonesided[labels[onesided[:, 0]]] = True
+    members = {}
+    for i, label in enumerate(labels.tolist()):
+        members.setdefault(label, []).append(names[i])
+    updates = []
+    for label, group in members.items():
+        if not istree[label]:
+            stats['not_trees'].append(group)
+            if verbose:
+                print(f"Not a tree can't infer prioridade from oldest {group}", file=sys.stderr)
+            continue
+        if isonesided[label]:
+            stats['one_sided'].append(group)
+            if verbose:
+                print(f"Association listed by one side only can't infer prioridade {group}", file=sys.stderr)
+            continue
+        value = prioridade.get(names[oldest[label]])
+        if value is None: # oldest not stored (or without prioridade)
+            stats['missing'].append(names[oldest[label]])
+            continue
+        # associados never stored have no rows
+        updates.extend( {'name' : name, 'value' : value} for name in group if name in stored )
+    if updates:
+        with manager.session() as session:
+            # VERSION so in memory `Processo`s read their rows again (see `sqlalchemy.isfresh`)
+            session.execute(text("UPDATE STORAGE SET DADOS = json_set(DADOS, '$.prioridadec', json(:value)), "
+                "VERSION = VERSION + 1 WHERE NAME = :name"), updates)
+            session.commit()
+    stats['updated'] = len(updates)
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
@@ -4,7 +4,8 @@ import datetime
 import threading
 from functools import wraps
 from threading import local
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import (
     create_engine,
     text,
@@ -17,8 +18,7 @@ from sqlalchemy.orm import (
     object_session
     )
 
-from ....general import progressbar
-from ....web.htmlscrap import wPageNtlm
+from ....web.htmlscrap import wPageNtlmPool
 from ....web.io import try_read_html
 from ..config import config
 from .processo import (
@@ -28,6 +28,19 @@ from .processo import (
     default_run_state
     )
 from .pud import pud 
+from .sqlalchemy import (
+    Base,
+    migrate_pages,
+    legacy_pages,
+    sqlite_pragmas,
+    create_indexes,
+    project,
+    ImageStoredb,
+    GraphStoredb,
+    ComponentIndex,
+    migrate_images
+    )
+from . import bulk
 
 
 class ProcessManagerClass():
@@ -43,10 +56,29 @@ class ProcessManagerClass():
     def __init__(self, debug=False): 
         super().__init__()      
         self._engine = create_engine(f"sqlite:///{config['scm']['process_storage_file']+'.db'}")                    
+        sqlite_pragmas(self._engine, config['scm']['sqlite'])
         self.__session = scoped_session(sessionmaker(bind=self._engine))
+        self._dbready = False # tables created on first use
+        self._legacypages = False # html pages still on legacy STORAGE columns
         self.debug = debug           
         self.lock = threading.RLock()        
         self._local = {}  # _local_storage dict
+        # authenticated sessions shared by all processes (keyed by credentials)
+        self.pool = wPageNtlmPool(**config['scm']['session_pool'])
+        # images of polygon pages stored once on table IMAGES (see `web.io.fetchSimpleHTMLStr`)
+        self.images = ImageStoredb(self._engine)
+        # associations graphs stored once per connected component (see `Processo.associadosGraph`)
+        self.graphs = GraphStoredb(self._engine)
+        # union-find of associations of parsed pages - skips walking unchanged components
+        self.components = ComponentIndex(self._engine)
+        # write-behind state see `writebehind`
+        self._writebehind = 0 
+        self._writes = set() # processes with not flushed writes
+        self._writeslock = threading.Lock()
+        self._flushlock = threading.Lock()
+        # background refresh see `_refresh`
+        self._refresher = None
+        self._refreshing = set()
     
     @property
     def session(self):
@@ -63,8 +95,103 @@ class ProcessManagerClass():
         session. But `updatedb` reataches the object to a 
         session no matter what happened before
         """        
+        if not self._dbready:
+            self._setupdb()
         return self.__session
 
+    def _setupdb(self):
+        """create missing tables and indexes (only once) - nothing is changed on existing tables"""
+        with self.lock:
+            if not self._dbready:
+                Base.metadata.create_all(self._engine)
+                create_indexes(self._engine)
+                self._legacypages = legacy_pages(self._engine)
+                if self._legacypages and self.debug:
+                    print("html pages on legacy STORAGE columns - see `migrate_pages`", file=sys.stderr)
+                self._dbready = True
+
+    def migrate_pages(self, vacuum=False):
+        """
+        move html pages from legacy STORAGE columns to table PAGES (see `sqlalchemy.migrate_pages`).
+        Drops the legacy columns - make a copy of the database file before.
+        Until then pages are read from the legacy columns.
+        """
+        if not self._dbready:
+            self._setupdb()
+        self.flush()
+        migrated = migrate_pages(self._engine, vacuum=vacuum)
+        self._legacypages = False
+        return migrated
+
+    def migrate_images(self, vacuum=False):
+        """move base64 images embedded on stored polygon pages to table IMAGES (see `sqlalchemy.migrate_images`)"""
+        if not self._dbready:
+            self._setupdb()
+        self.flush()
+        return migrate_images(self._engine, vacuum=vacuum)
+
+    @contextmanager
+    def writebehind(self):
+        """
+        Unit of work for `Processo` writes. Inside it `Processo.update` and html writes
+        are merged in memory per process and written on batched transactions  
+        every `config['scm']['writebehind']['batch']` processes and when the 
+        outermost context exits. Readers (any thread) see the not flushed writes.
+        Usage:
+        with ProcessManager.writebehind():
+            processo.update(dados) # no commit here
+        """
+        with self._writeslock:
+            self._writebehind += 1
+        try:
+            yield self
+        finally:
+            with self._writeslock:
+                self._writebehind -= 1
+                last = self._writebehind == 0
+            if last:
+                self.flush()
+
+    @property
+    def writingbehind(self):
+        return self._writebehind > 0
+
+    def _dirty(self, processo):
+        """register a process with not flushed writes"""
+        with self._writeslock:
+            self._writes.add(processo)
+            full = len(self._writes) >= config['scm']['writebehind']['batch']
+        if full:
+            self.flush()
+
+    def _discard(self, processo):
+        with self._writeslock:
+            self._writes.discard(processo)
+        processo._pending.clear()
+        processo._pending_html.clear()
+
+    def flush(self):
+        """write all not flushed `Processo` writes in one transaction"""
+        with self._flushlock:
+            with self._writeslock:
+                writes, self._writes = self._writes, set()
+            if not writes:
+                return
+            with ExitStack() as stack, self.session() as session:
+                try:
+                    for processo in writes: # no writes while flushing 
+                        stack.enter_context(processo._dblock)
+                        processo._flushpending(session)
+                    session.commit()
+                except:
+                    session.rollback()
+                    with self._writeslock: # try again next time
+                        self._writes.update(writes)
+                    raise
+                for processo in writes:
+                    processo._pending.clear()
+                    processo._pending_html.clear()
+
     def __delitem__(self, key : str):    
         """
         this is called when del ProcessManager[key] 
@@ -103,11 +230,13 @@ class ProcessManagerClass():
     def _getwithFilter(self, filter_condition):
         """
         Get `.all()` processos querying with sqlalchemy filter 
-        example:
-        getting processes with 'clayers' key in 'dados->iestudo'
-        ProcessManager.getwithFilter( text("dados->'estudo ? 'clayers'"))
+        example (sqlite JSON1):
+        getting processes with 'clayers' key in dados['estudo']
+        ProcessManager._getwithFilter(text("json_type(DADOS, '$.estudo.clayers') IS NOT NULL"))
+        For listings use `query` - much faster no `Processo` objects created
         """
         with self.lock:             
+            self.flush() # new `Processo` objects bellow don't see not flushed writes
             with self.session() as session:
                 processes = self.session.query(Processodb).filter(filter_condition).all()   
             list_processes = []
@@ -122,6 +251,7 @@ class ProcessManagerClass():
           for database interactions direct from python no SQL needed
         """
         with self.lock:
+            self.flush() # new `Processo` objects bellow don't see not flushed writes
             with self.session() as session:
                 processes = session.query(Processodb).all()
             list_processes = []
@@ -130,49 +260,104 @@ class ProcessManagerClass():
                 list_processes.append(processo)
             return list_processes 
    
-    def runTask(self, wp, *args, **kwargs):
+    def query(self, fields=('name', 'tipo', 'fase', 'UF', 'ativo', 'prioridade'), 
+            where=None, frame=False):
+        """
+        Fast listing of stored processes - only `fields` are read from the DADOS 
+        JSON column (indexed see `sqlalchemy.dados_fields`), no `Processo` objects
+        or html pages.         
+        * fields : 'name' and dados fields like 'tipo', 'estudo.done' or any dotted path
+        * where : dict of filters {field : value} (see `sqlalchemy.project`) like
+            {'UF' : 'MG', 'fase' : ['Requerimento de Pesquisa', 'Autorização de Pesquisa'], 
+             'prioridade' : ('>=', datetime.datetime(2020, 1, 1))}
+        * frame : return a pandas.DataFrame
+        returns: list of tuples on `fields` order or DataFrame
+        """
+        self.flush() # not flushed writes are not on the database
+        with self.session() as session:
+            rows = project(session, list(fields), where)
+        if frame:
+            import pandas as pd
+            return pd.DataFrame(rows, columns=list(fields))
+        return rows
+
+    def runTask(self, wp, task=SCM_SEARCH.BASICOS, run='runTask', **kwargs):
         """run `runTask` on every process on database    
 
         * wp : wPageNtlm
             must be provided   
+        * task : SCM_SEARCH
+        * run : str 
+            checkpoint name, calling again with the same name resumes an interrupted run
 
-        Any aditional args or keywork args for `runTask` can be passed. 
-        Like dados=Processo.SCM_SEARCH.BASICOS or any tuple (function, args) pair
+        Any aditional keywork args for `bulk.refresh` can be passed (threads, processes etc.). 
+        SCM requests run on a thread pool and html parsing on a process pool.
+        returns: stats dict with processes/min and error counts by exception class
         """    
-        for processodb in progressbar(self.session.query(Processodb).all()):
-            processo = Processo(processodb.name, processodb=processodb, 
-                wpagentlm=wPageNtlm(wp.user, wp.passwd, ssl=True))
-            #must be one independent requests.Session for each process otherwise mess                        
-            processo.runTask(*args, **kwargs)            
+        return bulk.refresh(self, wp, task, run, **kwargs)
+
+    def reparse(self, pages=('basic', 'polygon'), **kwargs):
+        """re-parse stored html pages parsed by an older `parser_version`
+        no SCM requests - see `bulk.reparse` for kwargs (processes, force etc.)
+        returns: stats dict
+        """
+        return bulk.reparse(self, pages, **kwargs)
+
+    def prioridades(self, **kwargs):
+        """'prioridadec' of every stored process from its associations component 
+        in one pass - no SCM requests, see `bulk.prioridades`
+        returns: stats dict
+        """
+        return bulk.prioridades(self, **kwargs)
+
+    def _refresh(self, processo):
+        """
+        `Processo.refresh` now or on a background thread if 
+        `config['scm']['refresh']['background']` (only once per process at a time)
+        """
+        if not config['scm']['refresh']['background']:
+            return processo.refresh()
+        with self.lock:
+            if processo.name in self._refreshing:
+                return
+            self._refreshing.add(processo.name)
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(config['scm']['refresh']['workers'])
+
+        def done(future):
+            self._refreshing.discard(processo.name)
+            if future.exception() is not None:
+                print(f"Background refresh of {processo.name} failed: {future.exception()!r}", file=sys.stderr)
+        self._refresher.submit(processo.refresh).add_done_callback(done)
 
     def GetorCreate(self, processostr, wpagentlm, task=SCM_SEARCH.ALL, verbose=False, run=True):
         """
-        Create a new or get a Processo if it has not expired. 
-        (config['scm']['process_expire'])
+        Create a new or get a Processo. Stored processes with expired data groups 
+        are refreshed conditionally (config['scm']['refresh'] see `Processo.refresh`).
 
         processostr : numero processo format xxx.xxx/ano
         wpage : wPage html webpage scraping class com login e passwd preenchidos
         """
         processostr = pud(processostr).str        
-        # try from database or self
-        processo = self[processostr]                        
-        if processo is not None:
+        with self.lock: # get or create at once - concurrent callers (associados frontiers, bulk) 
+            # try from database or self
+            processo = self[processostr]                        
+            stored = processo is not None
+            if not stored:
+                if verbose: 
+                    print("Processo placing on storage ", processostr, file=sys.stderr)
+                processo = Processo(processostr, wpagentlm, manager=self, verbose=verbose)  # store new guy
+                self._local[processostr] = processo            
+        if stored:
             processo._verbose = verbose
-            processo._wpage = wPageNtlm(wpagentlm.user, wpagentlm.passwd)            
-            if processo.modified + config['scm']['process_expire'] < datetime.datetime.utcnow():         
+            processo._wpage = wpagentlm # credentials only sessions come from `self.pool`
+            if run and processo.expired(): # only what changed is downloaded again
                 if verbose:       
-                    print("Processo placing on storage ", processostr, file=sys.stderr)                
-                del self[processostr] # delete here and on database before adding a new one               
-                processo = Processo(processostr, wpagentlm, manager=self, verbose=verbose) # replace with a newer guy  
-                self._local[processostr] = processo
+                    print("Processo refreshing on storage ", processostr, file=sys.stderr)                
+                self._refresh(processo)
             else:
                 if verbose: 
                     print("Processo getting from storage ", processostr, file=sys.stderr)            
-        else:
-            if verbose: 
-                print("Processo placing on storage ", processostr, file=sys.stderr)
-            processo = Processo(processostr, wpagentlm, manager=self, verbose=verbose)  # store new guy
-            self._local[processostr] = processo            
         if run: # wether run the task, dont run when loading from file/str
             processo.runTask(task)
         return processo
@@ -229,8 +414,8 @@ ProcessManager = ProcessManagerClass()
 Stores web-scrapped and parsed data on local dictionary and Database
 * key : unique `pud.str` process string
 * value : `scm.Processo` object
-Not using any other layer of cache making sqlite3 queries everytime.
-Everytime means: each object property access/modification is a new query by SQL Alchemy ORM standard. 
+Each object property access checks only the VERSION column of its row, 
+the whole row is re-read only when another writer changed it (see `readdb`).
 """
 
 
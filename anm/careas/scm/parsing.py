@@ -1,7 +1,10 @@
 import sys
 from datetime import datetime
 from bs4 import BeautifulSoup
+from lxml.etree import ParserError
 from ....web import htmlscrap
+from ....web import tracing
+from ..config import config
 from .pud import pud
 
 # HTML tags for SCM main page 
@@ -20,20 +23,42 @@ scm_data_tags = { # "data name" ; soup.find fields( "tag", "attributes")
     'ativo'                 : ['span',  { 'id' : 'ctl00_conteudo_lblAtivo'} ]
 }
 
+# version of the parser of each page stored on dados['parser'] when parsed
+# bump it when `scm_data_tags` or `parseDadosBasicos`/`parseDadosPoligonal` change
+# then `ProcessManager.reparse` re-parses the stored pages (no SCM requests)
+parser_version = {'basic' : 1, 'polygon' : 1}
+
 def select_fields(selected_fields):
     """select specific fields to be parsed from `scm_data_tags`"""
     return { key : scm_data_tags[key] for key in selected_fields }  
 
+def _document(page):
+    """lxml document of `page` if `config['scm']['parser']` is 'lxml' and it can parse it"""
+    if config['scm']['parser'] == 'lxml':
+        try:
+            return htmlscrap.lxmlDocument(page)
+        except (ParserError, ValueError): # empty or weird page - BeautifulSoup tries
+            pass
+    return None
+
 def parseNUP(basicos_page):
+    root = _document(basicos_page)
+    if root is not None:
+        return htmlscrap.lxmlText(root.get_element_by_id('ctl00_conteudo_lblNup'))
     soup = BeautifulSoup(basicos_page, "html.parser")
     return soup.select_one('[id=ctl00_conteudo_lblNup]').text   
 
 
+@tracing.traced()
 def parseDadosBasicos(basicos_page, name, verbose, data_tags):    
-    soup = BeautifulSoup(basicos_page, "html.parser")
     if not data_tags:
         data_tags = scm_data_tags
-    dados = htmlscrap.dictDataText(soup, data_tags)
+    root = _document(basicos_page)
+    if root is not None:
+        dados = htmlscrap.lxmlDictDataText(root, data_tags)
+    else:
+        soup = BeautifulSoup(basicos_page, "html.parser")
+        dados = htmlscrap.dictDataText(soup, data_tags)
     if dados['data_protocolo'] == '': # might happen
         dados['data_protocolo'] = dados['prioridade']
         if verbose:
@@ -103,18 +128,25 @@ def parseDadosBasicos(basicos_page, name, verbose, data_tags):
     # parsed copy  
     return dados 
 
+@tracing.traced()
 def parseDadosPoligonal(poligonal_page, verbose):
     polydata = []
-    soup = BeautifulSoup(poligonal_page, "html.parser")
-    htmltables = soup.select("td td table.BordaTabela") #td td table.BordaTabela
+    root = _document(poligonal_page)
+    if root is not None: # same as css select bellow
+        htmltables = root.xpath("//td//td//table[contains(concat(' ', normalize-space(@class), ' '), ' BordaTabela ')]")
+        tableDataText = htmlscrap.lxmlTableDataText
+    else:
+        soup = BeautifulSoup(poligonal_page, "html.parser")
+        htmltables = soup.select("td td table.BordaTabela") #td td table.BordaTabela
+        tableDataText = htmlscrap.tableDataText
     # table[id*="TextualPoligonalView"] finds the coordinates
     try: # need to cover multiple poligons etc..
         if htmltables: # at least 1 polygon = 2 tables (1. memo coordenadas and 2. memo pa info)            
             htmltables = [htmltables[i:i+2] for i in range(0,len(htmltables),2)]            
             for painfo, memorial in htmltables:
-                painfo = htmlscrap.tableDataText(painfo) # memo - pa info
+                painfo = tableDataText(painfo) # memo - pa info
                 painfo = painfo[0:5] # 5 first rows: informações pa
-                memorial = htmlscrap.tableDataText(memorial) # coordenadas                                
+                memorial = tableDataText(memorial) # coordenadas                                
                 polydata.append(
                         {'area'     : float(painfo[0][1].replace(',', '.')), 
                             'datum'     : painfo[0][3],
@@ -134,6 +166,17 @@ def parseDadosPoligonal(poligonal_page, verbose):
     return {'polygon' : polydata} 
 
 
+def fingerprint(dados):
+    """
+    what changes on the basic page when something happens to a process:
+    number of eventos, last evento and associados names
+    """
+    eventos = dados.get('eventos') or []
+    associados = dados.get('associados') or {}
+    return (len(eventos), list(eventos[1]) if len(eventos) > 1 else None, 
+            sorted(associados.get('dict') or {}))
+
+
 def getMissingTagsBasicos(dados):
     missing = []
     if dados['UF'] == "":
@@ -1,25 +1,30 @@
 import sys, copy, pathlib  
+from datetime import datetime
+from collections.abc import Mapping, Sequence
 import enum
-import queue
-from functools import cmp_to_key
+from concurrent.futures import ThreadPoolExecutor
 from threading import RLock, Lock
 from functools import wraps
 from typing import Literal
 
 from ....web.htmlscrap import wPageNtlm
+from ....web import tracing
 from ....web.io import (
     writeHTML,
-    fetchSimpleHTMLStr
+    fetchSimpleHTMLStr,
+    inlineImages
     )
 
 from . import requests 
 from ..config import config
-from .pud import pud, cmpPud
+from .pud import pud, oldestPud
 from .parsing import (
     parseDadosBasicos,
     parseDadosPoligonal,
     scm_data_tags,
-    parseNUP,    
+    parser_version,
+    fingerprint,
+    parseNUP,
     getMissingTagsBasicos
 )
 
@@ -29,7 +34,14 @@ from .ancestry import (
     is_tree    
 )
 
-from .sqlalchemy import Processodb, object_session
+from .sqlalchemy import (
+    Processodb, 
+    object_session, 
+    isfresh,
+    dados_key,
+    dados_haskey,
+    legacy_page
+    )
 
 default_run_state = lambda: copy.deepcopy({ 'run' : 
     { 'basic': False, 'associados': False, 'ancestry': False, 'polygon': False } })
@@ -46,45 +58,84 @@ class SCM_SEARCH(enum.Flag):
     ALL = BASICOS | ASSOCIADOS | PRIORIDADE | POLIGONAL
 
 
+def merge_parsed(dados, newdados):
+    """
+    update `dados` with freshly parsed `newdados` keeping the associados graph 
+    (not on the page) if the associations didn't change otherwise it must be expanded again
+    returns: True if the associations changed (or are new)
+    """
+    associados = dados.get('associados')
+    dados.update(newdados)
+    if associados and 'associados' in newdados:
+        if set(associados['dict']) == set(newdados['associados']['dict']):
+            dados['associados']['graph'] = associados['graph']
+            return False
+        else:
+            dados['run']['associados'] = False
+    return True
+
+def _attach(session, processodb):
+    """
+    Attach `processodb` to `session` and refresh it only if its VERSION changed
+    (another writer) - otherwise the in memory state is served as is.
+    """
+    obj_session = object_session(processodb)
+    # object might be on another session from another thread
+    if obj_session is None or obj_session != session:                
+        if obj_session is not None: # uggly but simpler
+            # in the future try something simpler like one single session?
+            # since two or more thread session cannot the same object
+            obj_session.expunge(processodb)
+        session.add(processodb)
+    if not isfresh(session, processodb):
+        with tracing.span('session.refresh'):
+            session.refresh(processodb)
+
 def updatedb(method: callable) -> callable: 
     """
     Decorator that refreshes the object at the beginning of the wrapped method and
     updates the database after the wrapped method is executed.
-    `refresh` re-add it to the session if it is not already attached to the session.
+    `refresh` only happens if the database VERSION of the object changed.
     Session is opened and closed at the end of method call.
     Used for methods that update the database.
+    Uses self._dblock so threads don't share the object on different sessions.
     """    
     @wraps(method) # preserves method name, docstring, etc
     def wrapper(self, *args, **kwargs):
-        with self._manager.session() as session:
-            if object_session(self.db) is None:
-                session.add(self.db)
-            session.refresh(self.db)
-            result = method(self, *args, **kwargs)
-            session.commit()            
+        with tracing.span('updatedb', self.name):
+            with tracing.span('dblock.wait'):
+                self._dblock.acquire()
+            try:
+                with self._manager.session() as session:
+                    _attach(session, self.db)
+                    result = method(self, *args, **kwargs)
+                    with tracing.span('session.commit'):
+                        session.commit() # expires the object - next read loads what was written
+            finally:
+                self._dblock.release()
         return result
     return wrapper
 
 def readdb(method: callable) -> callable:
     """
     Decorator that refreshes-updates the sqlalchemy object at the begging.
-    `refresh` re-add it to the session if it is not already attached to the session.
+    `refresh` only happens if the database VERSION of the object changed, 
+    otherwise reads are served from memory.
     Session is opened and closed at the end of method call.
     Used for methods that only read the database.
+    Uses self._dblock so threads don't share the object on different sessions.
     """    
     @wraps(method)
     def wrapper(self, *args, **kwargs):
-        with self._manager.session() as session:
-            obj_session = object_session(self.db)
-            # object might be on another session from another thread
-            if obj_session is None or obj_session != session:                
-                if obj_session is not None: # uggly but simpler
-                    # in the future try something simpler like one single session?
-                    # since two or more thread session cannot the same object
-                    obj_session.expunge(self.db)
-                session.add(self.db)
-            session.refresh(self.db)
-            result = method(self, *args, **kwargs)       
+        with tracing.span('readdb', self.name):
+            with tracing.span('dblock.wait'):
+                self._dblock.acquire()
+            try:
+                with self._manager.session() as session:
+                    _attach(session, self.db)
+                    result = method(self, *args, **kwargs)       
+            finally:
+                self._dblock.release()
         return result 
     return wrapper
 
@@ -96,13 +147,74 @@ def threadsafe(function: callable) -> callable:
     Uses self.lock field"""  
     @wraps(function)  
     def wrapper(self, *args, **kwargs):            
-        if not self.lock.acquire(timeout=60.*2):
+        with tracing.span('lock.wait', self.name):
+            acquired = self.lock.acquire(timeout=60.*2)
+        if not acquired:
             raise TimeoutError(f"Wait time-out in function {function.__name__} for process { self.name }")
-        result = function(self, *args, **kwargs)            
-        self.lock.release() # make it free
-        return result 
+        try:
+            return function(self, *args, **kwargs)            
+        finally:
+            self.lock.release() # make it free 
     return wrapper
 
+class DadosView(Mapping):
+    """
+    Zero-copy read-only view of a `dados` dict. Nested dicts and lists are also views.
+    Use `Processo.dados` to get a copy to edit and `Processo.update` to save it.
+    """
+    __slots__ = ('_data',)
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return readonly(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"DadosView({self._data!r})"
+
+    def copy(self):
+        """deep copy as a plain (editable) dict"""
+        return copy.deepcopy(self._data)
+
+class ListView(Sequence):
+    """Zero-copy read-only view of a list inside `dados` see `DadosView`"""
+    __slots__ = ('_data',)
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ListView(self._data[index])
+        return readonly(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        return list(self) == (list(other) if isinstance(other, (ListView, list)) else other)
+
+    def __repr__(self):
+        return f"ListView({self._data!r})"
+
+    def copy(self):
+        """deep copy as a plain (editable) list"""
+        return copy.deepcopy(self._data)
+
+def readonly(value):
+    """wrap dict and list values on read-only views others are immutable"""
+    if isinstance(value, dict):
+        return DadosView(value)
+    if isinstance(value, list):
+        return ListView(value)
+    return value
+
+
 class Processo():     
     """
     Class representing a mining process (Processo).
@@ -115,14 +227,16 @@ class Processo():
         number (int): The process number.
         year (int): The year of the process.
         _isdisp (bool): Indicates if the process is related to availability (starts with 3xx.xxx/xxx).
-        _wpage (wPageNtlm): An instance of the wPageNtlm class for web scraping.
+        _wpage (wPageNtlm): Credentials (user, passwd, ssl) used to borrow an authenticated 
+            session from the manager `wPageNtlmPool` for web scraping.
         db (Processodb): The SQLAlchemy object representing the database row for this process.
         lock (RLock): A reentrant lock for thread-safe access to the object.
 
     Note:
         The `dados` attribute, which contains the process data, is stored as a single JSON column in the SQLite database.
-        To retrieve the data, use `self.dados` (a deep copy is returned to avoid reference changes).
-        To update the data, first modify the dictionary obtained from `self.dados`, then call `self.update(modified_dict)`.
+        To read the data, use `self.view` or `self[key]` (zero-copy read-only views `DadosView`).
+        To edit the data, use `self.dados` (a deep copy is returned to avoid reference changes).
+        Then modify the dictionary obtained from `self.dados` and call `self.update(modified_dict)`.
         This will update the entire `dados` column in the database with the modified dictionary.
         
     Update Effect:
@@ -135,57 +249,61 @@ class Processo():
         self.pud = pud(processostr)
         self.name = self.pud.str # will/MUST never change
         self._manager = manager
-        with manager.session() as session:                        
-            if processodb is None:
+        if processodb is None: # new row
+            with manager.session() as session:                        
                 self.db = Processodb(self.name)
                 self.db.dados.update(default_run_state())
-            else:
-                self.db = processodb     
-            session.add(self.db)   
-            session.commit()                
+                session.add(self.db)   
+                session.commit()                
+        else: # already stored - attached on first access (see `readdb`)
+            self.db = processodb
         self.number, self.year = self.pud.numberyear        
         self._isdisp = True if str(self.number)[0] == 3 else False # if starts 3xx.xxx/xxx disponibilidade  
-        if wpagentlm: 
-            self._wpage = wPageNtlm(wpagentlm.user, wpagentlm.passwd)
+        # only credentials - sessions are borrowed from `manager.pool` on requests
         # might be None in case loading from JSON, html etc...        
+        self._wpage = wpagentlm
         self._verbose = verbose                             
         self.lock = RLock()
+        self._dblock = RLock() # only for database session access see `readdb`
+        # not flushed writes see `ProcessManager.writebehind` 
+        self._pending = {} 
+        self._pending_html = {}
     
     def delete(self):
         """
         Use this to delete the object from the database.
         Then you can del the object.
         """
+        self._manager._discard(self) # not flushed writes are gone
         with self._manager.session() as session:
             session.delete(self.db)
             session.commit()
 
     @property
-    @readdb    
     def basic_html(self):
-        return self.db.basic_html
+        return self._get_html('basic')
 
     @property
-    @readdb
     def polygon_html(self):
-        return self.db.polygon_html    
+        return self._get_html('polygon')
     
     @threadsafe
-    @updatedb
     def _set_html(self, page: Literal['basic', 'polygon'], value):        
         "html page setter"
-        if page == 'basic':
-            self.db.basic_html = value
-        elif page == 'polygon':
-            self.db.polygon_html = value        
+        if self._manager.writingbehind:
+            self._stage(html={page : value})
+        else:
+            self._write(html={page : value})
 
     @readdb
     def _get_html(self, page: Literal['basic', 'polygon']):
-        "html page getter"
-        if page == 'basic':
-            return self.db.basic_html
-        elif page == 'polygon':
-            return self.db.polygon_html
+        "html page getter - not flushed writes first"
+        if page in self._pending_html:
+            return self._pending_html[page]
+        html = self.db.basic_html if page == 'basic' else self.db.polygon_html
+        if not html and self._manager._legacypages: # not migrated yet (see `ProcessManager.migrate_pages`)
+            html = legacy_page(object_session(self.db), self.db, page)
+        return html
     
     @property
     @readdb
@@ -195,16 +313,42 @@ class Processo():
     @property
     @readdb
     def dados(self):
-        return copy.deepcopy(self.db.dados) # avoid reference change tracking    
+        """copy of dados for editing - see `update`"""
+        dados = copy.deepcopy(self.db.dados) # avoid reference change tracking    
+        dados.update(copy.deepcopy(self._pending)) # not flushed writes 
+        return dados
+
+    @property
+    @readdb
+    def view(self):
+        """zero-copy read-only view of dados - see `DadosView`"""
+        if self._pending: # not flushed writes 
+            return DadosView({**self.db.dados, **self._pending})
+        return DadosView(self.db.dados)
     
     def __getitem__(self, key):        
-        return self.dados[key]
+        """
+        zero-copy read-only dados[key] from memory if the row is current 
+        otherwise only `key` is read from the JSON column
+        """
+        with self._dblock, self._manager.session() as session:
+            if key in self._pending:
+                return readonly(self._pending[key])
+            if isfresh(session, self.db):
+                return readonly(self.db.dados[key])
+            return readonly(dados_key(session, self.db, key))
 
     def __contains__(self, item):
-        return item in self.dados  # Check if item is in content
-
+        """Check if item is in dados without decoding it"""
+        with self._dblock, self._manager.session() as session:
+            if item in self._pending:
+                return True
+            if isfresh(session, self.db):
+                return item in self.db.dados
+            return dados_haskey(session, self.db, item)
+
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     @threadsafe
-    @updatedb
     def update(self, _dict):
         """        
         Read with self.dados first then update the dict,
@@ -213,13 +357,43 @@ class Processo():
         There's only ONE column DADOS (JSON) on the DB.
         No matter if you modify only one key the ENTIRE dictionary 
         will ALWAYS be updated on the database.
+        Inside `ProcessManager.writebehind` updates are merged in memory 
+        and written latter on a batched transaction.
         """
-        self.db.dados.update(_dict)
+        if self._manager.writingbehind:
+            self._stage(dados=_dict)
+        else:
+            self._write(dados=_dict)
+
+    @updatedb
+    def _write(self, dados=None, html=None):
+        """write on database now"""
+        if dados:
+            self.db.dados.update(dados)
+        for page, value in (html or {}).items():
+            setattr(self.db, page+'_html', value)
+
+    def _stage(self, dados=None, html=None):
+        """merge writes in memory until `ProcessManager.flush`"""
+        with self._dblock:
+            if dados:
+                self._pending.update(dados)
+            if html:
+                self._pending_html.update(html)
+        self._manager._dirty(self) # might flush - must not hold _dblock
+
+    def _flushpending(self, session):
+        """apply merged writes on `self.db` attached to `session` - must hold _dblock"""
+        _attach(session, self.db)
+        self.db.dados.update(self._pending)
+        for page, value in self._pending_html.items():
+            setattr(self.db, page+'_html', value)
 
     @readdb
     def __repr__(self):
         return self.db.__repr__()
    
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def runTask(self, task=SCM_SEARCH.BASICOS, wpage=None):
         """Run task from enum SCM_SEARCH desired data."""
         run = self['run']
@@ -235,6 +409,47 @@ class Processo():
             if SCM_SEARCH.PRIORIDADE in task and not run['ancestry']:
                 self._ancestry()
 
+    def expired(self):
+        """
+        data groups ('basic', 'polygon', 'associados') already run older than 
+        their `config['scm']['refresh']['ttl']` - dados['fetched'] times
+        processes stored before that use the row modified time
+        """
+        fetched = self['fetched'] if 'fetched' in self else {}
+        run, modified, now = self['run'], self.modified, datetime.utcnow()
+        return [ group for group, ttl in config['scm']['refresh']['ttl'].items()
+            if run[group] and fetched.get(group, modified) + ttl < now ]
+
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
+    @threadsafe
+    def refresh(self, groups=None):
+        """
+        Conditional refresh of expired data `groups` (default `expired()`).
+        Only the basic page is downloaded again. Polygon and associados graph 
+        are downloaded and expanded again only if the basic page `fingerprint` 
+        changed, otherwise their time is renewed. Nothing else on dados is lost.
+        returns: True if the basic page changed
+        """
+        groups = self.expired() if groups is None else groups
+        if not groups:
+            return False
+        with self._manager.writebehind():
+            before = fingerprint(self.view)
+            self._dadosScmGet('basic', redownload=True)
+            changed = fingerprint(self.view) != before
+            if not changed: 
+                dados = self.dados
+                for group in groups:
+                    dados['fetched'][group] = dados['fetched']['basic']
+                self.update(dados)
+        if changed:
+            if 'polygon' in groups:
+                self._dadosScmGet('polygon', redownload=True)
+            if 'associados' in groups:
+                self._expandAssociados()
+        return changed
+
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     @threadsafe
     def _expandAssociados(self, ass_ignore=''):
         """
@@ -244,10 +459,14 @@ class Processo():
 
         'associados' must be in self.db.dados dict to build anscestors and sons
 
-        The search is done using a ThreadPool for all 'associados'.
-        That cascades searches for each 'associado' also using a ThreadPool. 
+        The search is done level by level (BFS frontiers) and each frontier is 
+        fetched concurrently by a ThreadPool capped by `config['scm']['associados_workers']`.
+        Edges are only added after the frontier is fetched in the same order a 
+        FIFO queue would add them, so the graph is the same as a sequential search.
         To make it outward only (avoiding circular reference) 
-        the source of the search is always passed to be ignored on the next search.
+        visited processes are never added again.
+        Only processes missing or expired are downloaded and there is no walk at all 
+        if the saved graph of its component is still current (see `_savedComponent`).
 
         """
 
@@ -258,50 +477,48 @@ class Processo():
             print("expandAssociados - getting associados: ", self.name,
             ' - ass_ignore: ', ass_ignore, file=sys.stderr)
 
-        G = pGraph()
+        G = self._savedComponent() # nothing changed - no walk
+        reused = G is not None
+        if not reused:
+            G = pGraph()
         if self._verbose:
             self.graph = G # for debugging 
         visited = set() 
-        # outward expand the graph using a queue instead of threads
+        # outward expand the graph by frontiers instead of recursive threads
         # MUCH simpler and safer to control what's happening and avoid deadlocks
-        # slower but async is the next step
         # doesn't assume the graph is a tree or whatever else
-        process_queue = queue.Queue()
-        process_queue.put(self.name)
-        while not process_queue.empty():
-            process_name = process_queue.get()
-            if process_name in visited:
-                continue
-            visited.add(process_name)                   
-            # this here can be made async from gemini answer
-            # turn from G = pGraph() .. a function
-            # TODO:  Run synchronous web scraping in a thread
-            # await asyncio.to_thread(self._manager.GetorCreate, process_name, ...)  #
-            process =  self._manager.GetorCreate(process_name, 
-                self._wpage, SCM_SEARCH.BASICOS, self._verbose) 
-            associados = process['associados']['dict']
-            for associado, edge_data in associados.items(): 
-                if associado not in visited:
-                    process_queue.put(associado)
-                    # add node source -> target and  edge (arrow ->) attributes dict
-                    G.add_edge(process_name, associado, **edge_data)               
-                    if self._verbose:
-                        print(f"Adding edge {process_name}->{associado} "
-                              f"at graph at {process_name} for debugging", file=sys.stderr)
-                        
-        # Run the asynchronous graph construction
-        # asyncio.run(build_graph_async(initial_process_name))
+        fetch = self._fetchAssociado
+        frontier = [] if reused else [self.name]
+        with ThreadPoolExecutor(max_workers=config['scm']['associados_workers']) as executor:
+            while frontier:
+                # unique names not visited yet keeping frontier order
+                names = list(dict.fromkeys(name for name in frontier if name not in visited))
+                processes = dict(zip(names, executor.map(fetch, names)))
+                next_frontier = []
+                for process_name in frontier: # same order a FIFO queue would pop
+                    if process_name in visited:
+                        continue
+                    visited.add(process_name)
+                    associados = processes[process_name]['associados']['dict']
+                    for associado, edge_data in associados.items(): 
+                        if associado not in visited:
+                            next_frontier.append(associado)
+                            # add node source -> target and  edge (arrow ->) attributes dict
+                            G.add_edge(process_name, associado, **edge_data)               
+                            if self._verbose:
+                                print(f"Adding edge {process_name}->{associado} "
+                                      f"at graph at {process_name} for debugging", file=sys.stderr)
+                frontier = next_frontier
 
+        dados = self.dados
         if G.nodes():
             if is_tree(G): # a tree graph expected well behaved
                 # graph due (cessões parciais, disponibilidade ... )
                 G = toChronology(G) # oriented by chronology is save                   
                 # sort everything only by name for now... todo in future check also 
                 # data_assoc if an exception of comparision happens
-                nodes = sorted(list(G.nodes), key=cmp_to_key(cmpPud))
-                if nodes:
-                    oldest = nodes[0]  
-                    dados = self.dados
+                oldest = oldestPud(G.nodes)
+                if oldest:
                     dados['prioridadec'] = self._manager[oldest]['prioridade']        
             else: # this likely a crazy, cyclic graph or worse
                 # processos associados a multiplos agrupamentos que deveriam ter sido desconectados
@@ -315,17 +532,58 @@ class Processo():
                 #             attrs[key] = value.isoformat()  # Convert to ISO 8601 format
                 # nx.write_gexf(p.graph, 'cyclic_graph.gexf') 
         
-            # graph is ready need to DB-save-it on ALL processes on its nodes
-            for name in G.nodes:
-                proc = self._manager[name]
-                proc_dados = proc.dados
-                proc_dados['associados']['graph'] = G.toList()
-                proc.update(proc_dados)
+            if not reused: # graph is ready - saved once for ALL processes on its nodes (see `associadosGraph`)
+                self._manager.graphs.save(G.toList())
+                self._manager.components.reset(list(G.nodes))
 
-        dados = self.dados
         dados['run']['associados'] = True        
+        dados.setdefault('fetched', {})['associados'] = datetime.utcnow()
         self.update(dados)
 
+    def _fetchAssociado(self, name):
+        """
+        `_expandAssociados` frontier fetch - basic page of `name` if missing or expired.
+        Never a full `refresh` (it could expand associados again and wait on the lock
+        of this process held by the expansion) and never this process itself.
+        """
+        if name == self.name:
+            return self
+        processo = self._manager.GetorCreate(name, self._wpage, verbose=self._verbose, run=False)
+        if not processo['run']['basic']:
+            processo.runTask(SCM_SEARCH.BASICOS)
+        elif 'basic' in processo.expired():
+            processo.refresh(['basic'])
+        return processo
+
+    def _savedComponent(self):
+        """
+        saved associations graph of this process if still current or None. 
+        Current when its processes are the same of the associations index 
+        (`ProcessManager.components`), no associations changed on pages parsed 
+        after it was saved and all are stored with basic pages not expired.
+        """
+        saved, names = self._manager.graphs.saved(self.name)
+        if saved is None:
+            return None
+        members, changed = self._manager.components.members(self.name)
+        if set(members) != set(names) or (changed is not None and changed > saved):
+            return None
+        for name in names:
+            processo = self._manager[name]
+            if processo is None or not processo['run']['basic'] or 'basic' in processo.expired():
+                return None
+        return self.associadosGraph()
+
+    def associadosGraph(self):
+        """
+        graph `pGraph` of this process associations (its connected component) - 
+        from the graphs store or dados['associados']['graph'] if stored before it
+        """
+        edges = self._manager.graphs.edges(self.name)
+        if not edges and 'associados' in self:
+            edges = self['associados']['graph']
+        return pGraph(list(edges) if edges else None)
+
     @threadsafe
     def _ancestry(self):
         """
@@ -335,28 +593,35 @@ class Processo():
         if not self['run']['basic']:
             self._dadosScmGet('basic')        
         
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     def _pageRequest(self, name : Literal['basic', 'polygon']):
         """python requests page and get response unicode str decoded"""
         if not isinstance(self._wpage, wPageNtlm):
             raise Exception('Invalid `wPage` instance!')
-        # str unicode page
-        try:
-            html, url = requests.pageRequest(name, self.name, self._wpage, False)        
-        except requests.RequestsSCMException as e:            
-            dados = self.dados
-            dados['status'] = {'error' : str(e)}
-            self.update(dados)                        
-            raise e 
-        else:
-            dados = self.dados
-            dados['status'] = 'ok'
-            self.update(dados)                        
-        if name == 'basic':
-            self._set_html('basic', html) # I don't need images here
-        else: # polygon images will be embedded as base64 strings hence perfectly displayable
-            self._set_html('polygon', fetchSimpleHTMLStr(url, html=html, 
-                session=self._wpage.session, verbose=self._verbose))
-
+        # warm authenticated session borrowed from the pool - only this thread uses it
+        with self._manager.pool.borrow(self._wpage.user, self._wpage.passwd, self._wpage.ssl) as wpage:
+            # str unicode page
+            try:
+                html, url = requests.pageRequest(name, self.name, wpage)
+            except requests.RequestsSCMException as e:            
+                dados = self.dados
+                dados['status'] = {'error' : str(e)}
+                self.update(dados)                        
+                raise e 
+            else:
+                dados = self.dados
+                dados['status'] = 'ok'
+                self.update(dados)                        
+            if name == 'basic':
+                self._set_html('basic', html) # I don't need images here
+            else: # polygon images stored once on `ProcessManager.images` and referenced 
+                # or embedded as base64 strings - see `salvaPageScmHtml` for a displayable page
+                store = self._manager.images if config['scm']['images']['store'] else None
+                self._set_html('polygon', fetchSimpleHTMLStr(url, html=html, 
+                    session=wpage.session, verbose=self._verbose, 
+                    store=store, workers=config['scm']['images']['workers']))
+
+    @tracing.traced(process=lambda self, *args, **kwargs: self.name)
     @threadsafe
     def _dadosScmGet(self, 
         page_key : Literal['basic', 'polygon'],
@@ -365,21 +630,32 @@ class Processo():
         """
         download or redownload the dados scm basic html or polygon page or
         use the existing one stored at `self._pages` if `redownload` False
+        status, html and dados writes go to the database on a single transaction
         """
-        dados = self.dados
-        if not dados['run'][page_key] or redownload:            
-            if redownload or not self._get_html(page_key): # download get with python.requests page html response
-                self._pageRequest(page_key)
-            if self._get_html(page_key): # if sucessful get html
-                if self._verbose:
-                    print(f"_dadosScmGet - parsing {page_key} for {self.name}", file=sys.stderr)
-                if page_key == 'basic':
-                    newdados = parseDadosBasicos(self.basic_html, self.name, self._verbose, data_tags) 
-                elif page_key == 'polygon':
-                    newdados = parseDadosPoligonal(self.polygon_html, self._verbose)
-                dados.update(newdados)           
-                dados['run'][page_key] = True
-                self.update(dados)  
+        with self._manager.writebehind():
+            dados = self.dados
+            if not dados['run'][page_key] or redownload:            
+                if redownload or not self._get_html(page_key): # download get with python.requests page html response
+                    self._pageRequest(page_key)
+                if self._get_html(page_key): # if sucessful get html
+                    if self._verbose:
+                        print(f"_dadosScmGet - parsing {page_key} for {self.name}", file=sys.stderr)
+                    if page_key == 'basic':
+                        newdados = parseDadosBasicos(self.basic_html, self.name, self._verbose, data_tags) 
+                    elif page_key == 'polygon':
+                        newdados = parseDadosPoligonal(self.polygon_html, self._verbose)
+                    self._mergeParsed(dados, newdados)
+                    dados['run'][page_key] = True
+                    if not data_tags: # partial parsing is not a version
+                        dados.setdefault('parser', {})[page_key] = parser_version[page_key]
+                    dados.setdefault('fetched', {})[page_key] = datetime.utcnow()
+                    self.update(dados)
+
+    def _mergeParsed(self, dados, newdados):
+        """`merge_parsed` then update the associations index `ProcessManager.components`"""
+        changed = merge_parsed(dados, newdados)
+        if 'associados' in newdados:
+            self._manager.components.update(self.name, newdados['associados']['dict'], changed)
 
     @threadsafe
     def _dadosBasicosFillMissing(self):
@@ -415,8 +691,8 @@ class Processo():
             return 
         if not self._get_html(pagename) or overwrite:
             self._pageRequest(pagename)                     
-        # save the already fetched html as single file
-        writeHTML(str(path), self._get_html(pagename)  )   
+        # save the already fetched html as single file - images embedded
+        writeHTML(str(path), inlineImages(self._get_html(pagename), self._manager.images))   
 
 
 
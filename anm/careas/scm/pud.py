@@ -1,43 +1,87 @@
 import re 
+import numpy as np
+from functools import lru_cache, partial
 
 class NotProcessNumber(Exception):
     """
     Raised when a string is not a valid process number
     """
 
+cache_size = 2**16 # maximum number of `pud` instances and parsed strings kept by `pud` interning
+cache_strlen = 32 # only strings up to this size are cached - like '48403.832.537/2016-09' not whole texts
+
 class pud():
     """
     Class to handle process unique identification numbers like 847/1945, 
     02.537/1938, 832537-2016, 48403.832.537/2016-09, 832.537/2016-09 or 
     any other variation also including mixing unexpected separators
 
+    Instances are interned and immutable: equivalent inputs give the same 
+    instance (bounded cache), hashable so usable as dict keys or on sets.
+    Ordering uses the precomputed `key` (year, number) - no `cmp_to_key` needed
+    `sorted(names, key=lambda name: pud(name).key)`.
+
     Note inequality comparison is not fully support for processes 
-    300 like 300.xxx/yyyy due its nature.
+    300 like 300.xxx/yyyy due its nature: 300's are ordered by year then number
+    like the others, a 300 and a not 300 of the same year are ordered by number
+    but that is ambiguous (see `sortPud` strict).
     """
     # reversed pattern - the only way that effectly works for anything
     # since year is the more striking characteristic to match first 
     # [1-2]\d{3} years from 1900-2999 - reversed pattern
     # separators are any non digit except \n -> [^\d\n] simple \D isn't enough
     # Negative lookbehind to ensure that no digit comes before year \d{3}[1-2] -> (?<!\d)
-    rpattern = '(?<!\d)(\d{3}[1-2])[^\d\n](\d{1,3})[^\d\n]*(\d{0,3})'
+    rpattern = r'(?<!\d)(\d{3}[1-2])[^\d\n](\d{1,3})[^\d\n]*(\d{0,3})'
     pattern = re.compile(rpattern)
-    def __init__(self, str_: str = None, yng: list = None):                 
+    __slots__ = ('_g', '_n', '_y', 'std', '_unumber', '_number', '_isdisp', 'key')
+
+    def __new__(cls, str_: str = None, yng: list = None):
         if yng:
-            y, n, g = yng
+            return pud._intern(*yng)
+        elif isinstance(str_, pud):
+            return str_
         elif str_: # use first found only             
-            y, n, g = pud._getAllgroups(str_)[0]
-        else:
-            raise ValueError("str or yng must be provided")
+            return pud._fromstr(str_)
+        raise ValueError("str or yng must be provided")
+
+    @staticmethod
+    def _fromstr(str_: str):
+        if len(str_) > cache_strlen: # texts are parsed but not kept alive by the cache
+            return pud._intern(*pud._getAllgroups(str_)[0])
+        return pud._fromshortstr(str_)
+
+    @staticmethod
+    @lru_cache(maxsize=cache_size)
+    def _fromshortstr(str_: str):
+        return pud._intern(*pud._getAllgroups(str_)[0])
+
+    @staticmethod
+    def _intern(y, n, g):
         g = (3-len(g))*'0'+g # prepend with zeros
         n = (3-len(n))*'0'+n # prepend with zeros
-        self._g = g
-        self._n = n
-        self._y = y
-        self.std = f'{g}.{n}/{y}' # standard number-name anm
-        self._unumber = int(f"{y}{g}{n}")
-        self._number = f"{g}{n}"
+        return pud._create(y, n, g)
+
+    @staticmethod
+    @lru_cache(maxsize=cache_size)
+    def _create(y, n, g):
+        self = object.__new__(pud)
+        setattr = partial(object.__setattr__, self)
+        setattr('_g', g)
+        setattr('_n', n)
+        setattr('_y', y)
+        setattr('std', f'{g}.{n}/{y}') # standard number-name anm
+        setattr('_unumber', int(f"{y}{g}{n}"))
+        setattr('_number', f"{g}{n}")
         # processo descarte 300.xxx/year
-        self._isdisp = True if g == '300' else False 
+        setattr('_isdisp', g == '300')
+        setattr('key', (int(y), int(g+n))) # sort key 
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("pud is immutable")
+
+    def __reduce__(self): # pickle/copy - interned again on load
+        return (pud, (self.std,))
 
     @classmethod
     def _getAllgroups(cls, str_: str):
@@ -69,7 +113,7 @@ class pud():
     @property 
     def str(self):
         """standard name"""
-        return self.__str__()
+        return self.std
 
     @property
     def year(self):
@@ -93,24 +137,25 @@ class pud():
         """is disponibilidade or starts with '300.xxx/yyyy'"""
         return self._isdisp
 
+    def __hash__(self):
+        return hash(self._unumber)
+
     def __eq__(self, other):
-        return other.unumber == self.unumber 
+        if not isinstance(other, pud):
+            return NotImplemented
+        return other._unumber == self._unumber 
 
     def __lt__(self, other): # less than 
-        if not self.isdisp or not other.isdisp:
-            return self.unumber < other.unumber 
-        match (self.isdisp, other.isdisp):
-            case (True, True):
-                if self.year != other.year:
-                    return self.year < other.year
-                # same year
-                return self.number < other.number
-            case (False, True) | (True, False):
-                if self.year != other.year:
-                    return self.year < other.year
-                # same year
-                raise ValueError("can't compare 300 process number with" 
-                    "the same year of other not 300")
+        return self.key < other.key
+
+    def __le__(self, other):
+        return self.key <= other.key
+
+    def __gt__(self, other):
+        return self.key > other.key
+
+    def __ge__(self, other):
+        return self.key >= other.key
 
 
 def test_pnum_getAll():
@@ -138,10 +183,6 @@ def test_newline_plus():
     expected = ['830.817/2024', '831.400/2024', '831.741/2002']
     assert  result == expected
 
-test_pnum_getAll()
-test_pnum_numbers()
-test_pnum_cmp()
-test_newline_plus()
 
 
 # fonte de informação da data de origem do processo 
@@ -166,6 +207,7 @@ def cmpPud(process, other, check=False):
     usage:
         lst = ['02/2005', '03/2005' ...]
         sorted(lst, key=cmp_to_key(careas.scm.cmpPud))
+    prefer `keyPud` or `sortPud` - no `pud` built per comparison
     """
     p = pud(process)
     o = pud(other)
@@ -174,4 +216,89 @@ def cmpPud(process, other, check=False):
     elif p > o:
         return 1
     else:
-        return 0 
\ No newline at end of file
+        return 0 
+
+
+def keyPud(process):
+    """sort key of a process name - sorted(lst, key=keyPud)"""
+    return pud(process).key
+
+def unumbersPud(processes, strict=False):
+    """
+    processes names (or `pud`s) parsed once to a np.int64 array of unumbers (year then number).
+    Same order as `pud` comparison.
+    * strict : raise ValueError if a 300.xxx and another process share a year
+        (what is older can't be told by the number)
+    """
+    puds = [ pud(process) for process in processes ]
+    keys = np.fromiter((p._unumber for p in puds), dtype=np.int64, count=len(puds))
+    if strict:
+        disp = np.fromiter((p._isdisp for p in puds), dtype=bool, count=len(puds))
+        years = keys // 10**6
+        ambiguous = np.intersect1d(years[disp], years[~disp])
+        if ambiguous.size:
+            raise ValueError(f"Can't compare 300.xxx processes with others of same year {ambiguous.tolist()}")
+    return keys
+
+def argsortPud(processes, strict=False):
+    """indexes that sort processes from older to younger (stable)"""
+    return np.argsort(unumbersPud(processes, strict), kind='stable')
+
+def sortPud(processes, strict=False):
+    """processes sorted from older to younger - without `cmp_to_key`"""
+    processes = list(processes)
+    return [ processes[i] for i in argsortPud(processes, strict) ]
+
+def rankPud(processes, strict=False):
+    """rank of each process, 0 is the oldest (ties ranked by position)"""
+    order = argsortPud(processes, strict)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(order.size)
+    return ranks
+
+def oldestPud(processes, strict=False):
+    """oldest process of processes like a component `G.nodes` - None if empty"""
+    processes = list(processes)
+    if not processes:
+        return None
+    return processes[int(np.argmin(unumbersPud(processes, strict)))]
+
+
+# matches never cross a new line so big texts are scanned by chunks of whole lines.
+# Reversing a chunk is cheap - a forward pattern plus reading number and group 
+# backwards in python was measured ~2x slower
+def _scan(text):
+    """(year, group, number) of all processes in `text` in order - `pud.pattern` on the reversed text"""
+    return [ (y[::-1], g[::-1].zfill(3), n[::-1].zfill(3)) for y, n, g in pud.pattern.findall(text[::-1]) ][::-1]
+
+def scanPud(source, chunk=2**20):
+    """
+    Yield (year, group, number) of every process number found on `source` like `pud.getAll`
+    but without building `pud`s. Made for large texts (SEI dumps, pdf texts, listings).
+    * source : str, an iterable of str chunks (like a text file) or a `pathlib.Path` 
+    * chunk : characters read per step of a path
+    """
+    if isinstance(source, str):
+        yield from _scan(source)
+        return
+    if hasattr(source, 'open'): 
+        with source.open(encoding='utf-8', errors='replace') as file:
+            yield from scanPud(iter(partial(file.read, chunk), ''))
+        return
+    carry = '' # last line may continue on next chunk - matches never cross lines
+    for text in source:
+        text = carry + text
+        last = text.rfind('\n') + 1
+        carry = text[last:]
+        yield from _scan(text[:last])
+    yield from _scan(carry)
+
+def scanUnumbers(source, chunk=2**20):
+    """np.int64 array of `unumber`s of all process numbers on `source` (see `scanPud`)"""
+    return np.fromiter(( int(y)*10**6 + int(g+n) for y, g, n in scanPud(source, chunk) ), dtype=np.int64)
+
+
+test_pnum_getAll()
+test_pnum_numbers()
+test_pnum_cmp()
+test_newline_plus()
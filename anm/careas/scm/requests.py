@@ -4,9 +4,13 @@ from ....web import (
     htmlscrap,
     wPageNtlm
     )
+from ....web.resilience import Resilience
+from ....web import tracing
 from requests.exceptions import (
     HTTPError,
-    ReadTimeout
+    RetryError,
+    ReadTimeout,
+    ConnectionError
 )
 from ..config import config
 
@@ -38,62 +42,116 @@ class NotFoundErrorSCM(RequestsSCMException):
     """
     Process not found
     """
+
+
+resilience = Resilience(**config['scm']['resilience'], policies={
+    NotFoundErrorSCM : {'retry' : False}, # SCM answered
+    RequestsSCMException : {'retry' : True}})
+"""retries, backoff and circuit breaker shared by all SCM requests - see `resilience.stats`"""
     
 
-def pageRequest(pagename : Literal['basic', 'polygon'], processopud : str, wpage : wPageNtlm, retry_on_error : int = 2):
-    """   Get & Post na página dados do Processo do Cadastro  Mineiro (SCM)
-        * pagename : str
-            page name to requets from `urls`
-        * processopud:  str
-            process unique name 
-        * wpage: requests.wpage        
-            copied before using, nothing is persisted            
-        
-        returns: 
-            wpage.response.text, url, wpage.session
-    """    
-    # remind: wpage-requests-session is unique for each thread/process
+def _hasform(wpage):
+    """wether the last response of `wpage` has the SCM process lookup form (state can be reused)"""
+    return (hasattr(wpage, 'response') and wpage.response.ok and 
+        wpage.response.url.startswith(scm_processo_main_url) and 
+        'ctl00$conteudo$btnConsultarProcesso' in wpage.response.text)
+
+def _post(wpage, formcontrols, delta, timeout):
+    """
+    Post `formcontrols` on the SCM form with the state of the last response.
+    As an AJAX partial postback if `delta` - only the update panels are transferred.
+    Raises ValueError if the delta response can't be parsed.
+    returns: html of the page or of the update panels
+    """
+    formdata = htmlscrap.formdataPostAspNet(wpage.response.text, formcontrols)
+    if not delta:
+        wpage.post(scm_processo_main_url, data=formdata, timeout=timeout)
+        return wpage.response.text
+    formdata['__ASYNCPOST'] = 'true'
+    wpage.post(scm_processo_main_url, data=formdata, headers=htmlscrap.aspnetdelta_headers,
+            timeout=timeout)
+    html = ''.join(content for type, id, content in htmlscrap.parseAspNetDelta(wpage.response.text)
+        if type == 'updatePanel')
+    if not html:
+        raise ValueError("No update panel on AspNet delta response")
+    return html
+
+def _pageRequest(pagename, processopud, wpage, reuse, delta, timeout, attempt=0):
+    """one attempt of `pageRequest` - raises on any error"""
+    if attempt: # retries from a fresh full page 
+        reuse, delta = False, False
     try:
         if pagename == 'basic':            
-            wpage.get(scm_processo_main_url, timeout=config['scm']['timeout'])     
+            if not (reuse and _hasform(wpage)): # form state from last process lookup
+                wpage.get(scm_processo_main_url, timeout=timeout)     
             formcontrols = {
                 'ctl00$scriptManagerAdmin': 'ctl00$scriptManagerAdmin|ctl00$conteudo$btnConsultarProcesso',
                 'ctl00$conteudo$txtNumeroProcesso': processopud,
                 'ctl00$conteudo$btnConsultarProcesso': 'Consultar',
                 '__VIEWSTATEENCRYPTED': ''}
-            formdata = htmlscrap.formdataPostAspNet(wpage.response.text, formcontrols)        
-            wpage.post(scm_processo_main_url,
-                    data=formdata, timeout=config['scm']['timeout'])
-            if "Processo não encontrado" in wpage.response.text:            
+            html = _post(wpage, formcontrols, delta, timeout)
+            if "Processo não encontrado" in html:            
                 raise NotFoundErrorSCM(f"Processo {processopud} not found! Couldn't download.") 
-            elif ("ctl00_conteudo_gridPessoas" not in wpage.response.text or 
-                    "ctl00_conteudo_gridEventos" not in wpage.response.text): # integrity check of 'gridPessoas'
+            elif ("ctl00_conteudo_gridPessoas" not in html or 
+                    "ctl00_conteudo_gridEventos" not in html): # integrity check of 'gridPessoas'
                 raise BasicosErrorSCM(f"Processo {processopud} download error.")
         elif pagename == 'polygon': # first connection to 'dadosbasicos' above MUST have been made before
             if (not hasattr(wpage, 'response') or 
                 'ctl00$conteudo$btnPoligonal' not in wpage.response.text or 
                 processopud not in wpage.response.text): # must be response to same process
-                pageRequest('basic', processopud, wpage, retry_on_error=retry_on_error) # goto basicos page first
+                _pageRequest('basic', processopud, wpage, reuse, delta, timeout) # goto basicos page first
             formcontrols = {    
                 'ctl00$conteudo$btnPoligonal': 'Poligonal',
                 'ctl00$scriptManagerAdmin': 'ctl00$scriptManagerAdmin|ctl00$conteudo$btnPoligonal'}
-            formdata = htmlscrap.formdataPostAspNet(wpage.response.text, formcontrols)
-            wpage.post(scm_processo_main_url, 
-                    data=formdata, timeout=config['scm']['timeout'])
-            if 'Erro ao mudar a versão para a data selecionada.' in wpage.response.text:
+            html = _post(wpage, formcontrols, delta, timeout)
+            if 'Erro ao mudar a versão para a data selecionada.' in html:
                 raise PoligonalErrorSCM(f"Processo {processopud} failed download poligonal from SCM database.")    
-    except (RequestsSCMException, HTTPError, ReadTimeout) as e:
-        if retry_on_error: 
-            return pageRequest(pagename, processopud, wpage, retry_on_error=retry_on_error-1)
-        elif isinstance(e, RequestsSCMException):
+    except ValueError: # delta response not understood - full page
+        if not delta:
             raise
-        elif isinstance(e, HTTPError):
-            if "Object reference not set to an instance of an object" in wpage.response.text:                
-                raise BasicosErrorSCM(f"Processo {processopud} corrupted on SCM database. Couldn't download.")
-            ## todo implement error check for other specific http errors
-        elif isinstance(e, ReadTimeout):
-            if pagename == 'basic':
-                raise BasicosErrorSCM(f"Processo {processopud} Couldn't download. Timeout error x2.") 
-            elif pagename == 'polygon':
-                raise PoligonalErrorSCM(f"Processo {processopud} Couldn't download. Timeout error x2.") 
-    return wpage.response.text, wpage.response.url
\ No newline at end of file
+        return _pageRequest(pagename, processopud, wpage, reuse, False, timeout, attempt)
+    return html, wpage.response.url
+
+@tracing.traced('pageRequest', process=lambda pagename, processopud, *args, **kwargs: processopud)
+def pageRequest(pagename : Literal['basic', 'polygon'], processopud : str, wpage : wPageNtlm, retry_on_error : int = None,
+        reuse : bool = None, delta : bool = None):
+    """   Get & Post na página dados do Processo do Cadastro  Mineiro (SCM)
+        * pagename : str
+            page name to requets from `urls`
+        * processopud:  str
+            process unique name 
+        * wpage: requests.wpage        
+            copied before using, nothing is persisted            
+            its urllib3 retries are disabled (see `wPage.setRetries`)
+        * retry_on_error : int
+            maximum number of retries default from `config['scm']['resilience']`
+            retries use backoff, budget and circuit breaker shared by all SCM requests
+            (see `resilience`) - `NotFoundErrorSCM` is never retried
+        * reuse : bool 
+            reuse the form state of the last response of `wpage` skipping a GET 
+            default `config['scm']['reuse_viewstate']` - not reused on retries
+        * delta : bool
+            request as AJAX partial postback and return only the update panels html
+            default `config['scm']['ajax_delta']` - full page if the delta can't be 
+            parsed and on retries
+        
+        returns: 
+            html, url
+    """    
+    # remind: wpage-requests-session is unique for each thread/process
+    if reuse is None:
+        reuse = config['scm']['reuse_viewstate']
+    if delta is None:
+        delta = config['scm']['ajax_delta']
+    PageErrorSCM = BasicosErrorSCM if pagename == 'basic' else PoligonalErrorSCM
+    if getattr(wpage, 'nretries', 0): # `resilience` retries - not urllib3
+        wpage.setRetries(0)
+    try:
+        return resilience.call(_pageRequest, pagename, processopud, wpage, reuse, delta,
+            timeout=config['scm']['timeout'], retries=retry_on_error)
+    except HTTPError as e:
+        if e.response is not None and "Object reference not set to an instance of an object" in e.response.text:
+            raise BasicosErrorSCM(f"Processo {processopud} corrupted on SCM database. Couldn't download.") from e
+        raise PageErrorSCM(f"Processo {processopud} Couldn't download. {e}") from e
+    except (ReadTimeout, ConnectionError, RetryError) as e:
+        raise PageErrorSCM(f"Processo {processopud} Couldn't download. {type(e).__name__}.") from e
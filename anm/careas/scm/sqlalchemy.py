@@ -1,18 +1,30 @@
+import re
 import json
 import copy 
-from sqlalchemy.types import TypeDecorator, TEXT
+import zlib
+import base64
+import hashlib
+import threading
+from sqlalchemy.types import TypeDecorator, TEXT, LargeBinary
 from sqlalchemy_json import mutable_json_type
 from sqlalchemy.orm import (
     mapped_column, 
     declarative_base,
+    relationship,
     object_session
     )
 
 from sqlalchemy import (
     Column, Integer, String, Text, Date, DateTime, 
-    JSON     
+    JSON, ForeignKey, inspect, select, text, event, func
     )
 
+from .pud import pud
+from ....web import tracing
+from ....web.io import (
+    ImageStore,
+    image_ref
+    )
 from ....web.json import (
     datetime_to_json,
     json_to_datetime,
@@ -22,22 +34,41 @@ from ....web.json import (
 class JSONdt(TypeDecorator):
     impl = TEXT
     """ custom JSON column in SQLAlchemy to serialize/deserialize datetime.datetime objects"""
+    cache_ok = True
+
     def __init__(self, *args, **kwargs):
         super(JSONdt, self).__init__(*args, **kwargs)
 
     def process_bind_param(self, value, dialect):
         if value is not None:
-            return json.dumps(value, default=datetime_to_json)
+            with tracing.span('json.dumps'):
+                return json.dumps(value, default=datetime_to_json)
         return value
 
     def process_result_value(self, value, dialect):
         if value is not None:
-            return json.loads(value, object_hook=json_to_datetime)
+            with tracing.span('json.loads'):
+                return json.loads(value, object_hook=json_to_datetime)
         return value
 
 # uses sqlalchemy-json package to track changes on nested dict (dict, list) mutated types
 JSONDT = mutable_json_type(dbtype=JSONdt, nested=True)
 
+class ZText(TypeDecorator):
+    impl = LargeBinary
+    """ custom zlib compressed text column in SQLAlchemy - html pages are very redundant"""
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            return zlib.compress(value.encode('utf-8'))
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            return zlib.decompress(value).decode('utf-8')
+        return value
+
 Base = declarative_base()
 
 class Processodb(Base):
@@ -47,21 +78,43 @@ class Processodb(Base):
     name = mapped_column('NAME', String(12), unique=True)  # Unique constraint on the 'name' column    
     dados = mapped_column('DADOS', JSONDT)  # Use JSON type to store the nested dictionary as a JSON string
     # Alchemy will serialize the dict to JSON and the way back I don't need to care about it        
-    basic_html = mapped_column('PAGE_BASIC', Text)  
-    polygon_html = mapped_column('PAGE_POLYGON', Text)  
+    # html pages are big (polygon has base64 images) - they live on another table 
+    # only loaded when `basic_html` or `polygon_html` is read - `session.refresh` doesn't touch them
+    pages = relationship('Pagesdb', uselist=False, lazy='select', 
+        cascade='all, delete-orphan')
     # New column for last modification timestamp (auto updated)
     modified = mapped_column('MODIFIED', DateTime, 
-        default=datetime.utcnow(), onupdate=datetime.utcnow())    
-    version = mapped_column('VERSION', Integer, default=1, nullable=False, 
-        onupdate=lambda ctx: 
-        ctx.current_parameters['VERSION'] + 1 if ctx.current_parameters['VERSION'] is not None else 1)
+        default=datetime.utcnow, onupdate=datetime.utcnow)    
+    # row version incremented by sqlalchemy on every UPDATE (optimistic concurrency)
+    # used to know if an in memory object is still current - see `isfresh`
+    version = mapped_column('VERSION', Integer, nullable=False)
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, name):
         # real data to store in the database - instance variables 
         self.name = name
         self.dados = {}        
-        self.basic_html = ''
-        self.polygon_html = ''        
+        self.pages = Pagesdb()
+
+    @property
+    def basic_html(self):
+        return self.pages.basic_html if self.pages is not None else ''
+
+    @basic_html.setter
+    def basic_html(self, value):
+        if self.pages is None:
+            self.pages = Pagesdb()
+        self.pages.basic_html = value
+
+    @property
+    def polygon_html(self):
+        return self.pages.polygon_html if self.pages is not None else ''
+
+    @polygon_html.setter
+    def polygon_html(self, value):
+        if self.pages is None:
+            self.pages = Pagesdb()
+        self.pages.polygon_html = value
 
     def __repr__(self):
         dados = copy.deepcopy(self.dados)
@@ -82,4 +135,401 @@ class Processodb(Base):
                 keys += f"{key}, "
         return f"{self.name} - modified {self.modified} \n{ keys }"
 
-    
\ No newline at end of file
+
+def isfresh(session, processodb):
+    """
+    True if `processodb` in memory state has the same VERSION of its database row.
+    Only the VERSION column is queried - no need to `session.refresh` the whole row.
+    """
+    state = inspect(processodb)
+    if state.key is None or {'dados', 'version'} & state.unloaded: # expired or never loaded
+        return False
+    version = session.execute(select(Processodb.version).where(
+        Processodb.id == processodb.id)).scalar()
+    return version == processodb.version
+
+
+def _dados_path(key):
+    """sqlite JSON1 path for a top level `key` of DADOS"""
+    return '$."' + key.replace('"', '\\"') + '"'
+
+def dados_key(session, processodb, key):
+    """
+    Read only `key` of DADOS straight from the JSON column (sqlite JSON1) 
+    without loading or decoding the whole document.
+    Raises KeyError if `key` is not on DADOS.
+    """
+    jtype, value = session.execute(text("SELECT json_type(DADOS, :path), json_extract(DADOS, :path) "
+        "FROM STORAGE WHERE id = :id"), 
+        {'path' : _dados_path(key), 'id' : inspect(processodb).identity[0]}).one()
+    if jtype is None:
+        raise KeyError(key)
+    if jtype in ('object', 'array'): # json text 
+        return json.loads(value, object_hook=json_to_datetime)
+    if jtype in ('true', 'false'): # sqlite gives 1 or 0
+        return jtype == 'true'
+    return value
+
+def dados_haskey(session, processodb, key):
+    """True if `key` is on DADOS JSON column - nothing is decoded"""
+    return session.execute(text("SELECT json_type(DADOS, :path) IS NOT NULL FROM STORAGE WHERE id = :id"), 
+        {'path' : _dados_path(key), 'id' : inspect(processodb).identity[0]}).scalar() == 1
+
+
+# fields of DADOS most used on listings and filters - sqlite JSON1 expression indexes 
+# field : JSON1 path (prioridade is a datetime stored as {'_isoformat' : ...} see `JSONdt`)
+dados_fields = {
+    'tipo'          : '$.tipo',
+    'fase'          : '$.fase',
+    'UF'            : '$.UF',
+    'ativo'         : '$.ativo',
+    'prioridade'    : '$.prioridade._isoformat',
+    'NUP'           : '$.NUP',
+    'estudo.done'   : '$.estudo.done'
+}
+
+def dados_field(field):
+    """
+    sql expression of a DADOS `field` - 'name' is the NAME column.
+    Fields of `dados_fields` use the same expression of their index (needed to use it),
+    any other dotted path like 'estudo.table' works but is not indexed.
+    """
+    if field == 'name':
+        return 'NAME'
+    path = dados_fields.get(field)
+    if path is None:
+        path = '$.' + '.'.join('"' + key.replace('"', '\\"') + '"' for key in field.split('.'))
+    return "json_extract(DADOS, '" + path.replace("'", "''") + "')"
+
+def create_indexes(engine):
+    """create (if missing) indexes on STORAGE for every field of `dados_fields`"""
+    with engine.begin() as conn:
+        for field in dados_fields:
+            name = 'ix_storage_' + field.replace('.', '_')
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON STORAGE ({dados_field(field)})"))
+
+def project(session, fields, where=None):
+    """
+    Light projection query of STORAGE - no ORM objects, html pages or JSON decoding.
+    * fields : list of field names (see `dados_field`)
+    * where : dict of field : value filters (and) where value can be
+        - a value for equality (`None` for missing)
+        - a list for IN 
+        - a tuple (operator, value) like ('>=', datetime(2020, 1, 1)) 
+    returns: list of tuples on `fields` order - prioridade as datetime
+    """
+    conditions, params = [], {}
+    for i, (field, value) in enumerate((where or {}).items()):
+        column, param = dados_field(field), f"p{i}"
+        if isinstance(value, datetime) or (isinstance(value, tuple) and isinstance(value[1], datetime)):
+            value = value.isoformat() if isinstance(value, datetime) else (value[0], value[1].isoformat())
+        if value is None:
+            conditions.append(f"{column} IS NULL")
+        elif isinstance(value, list):
+            names = [ f"{param}_{j}" for j in range(len(value)) ]
+            params.update(zip(names, value))
+            conditions.append(f"{column} IN (" + ', '.join(':'+name for name in names) + ")")
+        elif isinstance(value, tuple):
+            operator, value = value
+            if operator not in ('=', '!=', '<', '<=', '>', '>=', 'LIKE'):
+                raise ValueError(f"Invalid operator {operator}")
+            conditions.append(f"{column} {operator} :{param}")
+            params[param] = value
+        else:
+            conditions.append(f"{column} = :{param}")
+            params[param] = value
+    query = "SELECT " + ', '.join(dados_field(field) for field in fields) + " FROM STORAGE"
+    if conditions:
+        query += " WHERE " + ' AND '.join(conditions)
+    rows = session.execute(text(query), params).all()
+    if 'prioridade' in fields: 
+        i = fields.index('prioridade')
+        rows = [ row[:i] + (datetime.fromisoformat(row[i]) if row[i] else row[i],) + row[i+1:] 
+            for row in rows ]
+    return [ tuple(row) for row in rows ]
+
+
+class Pagesdb(Base):
+    """SCM html pages of a `Processodb` zlib compressed and deferred (loaded only when read)"""
+    __tablename__ = 'PAGES'
+    id = mapped_column('id', Integer, ForeignKey('STORAGE.id'), primary_key=True)
+    basic_html = mapped_column('PAGE_BASIC', ZText, deferred=True)
+    polygon_html = mapped_column('PAGE_POLYGON', ZText, deferred=True)
+
+    def __init__(self):
+        self.basic_html = ''
+        self.polygon_html = ''
+
+
+class Imagesdb(Base):
+    """images of html pages content-addressed by sha256 - each stored once (see `ImageStoredb`)"""
+    __tablename__ = 'IMAGES'
+    hash = mapped_column('HASH', String(64), primary_key=True)
+    data = mapped_column('DATA', LargeBinary)
+
+
+class ImageStoredb(ImageStore):
+    """`web.io.ImageStore` persisted on table IMAGES - own connections, not the processes sessions"""
+    def __init__(self, engine):
+        super().__init__()
+        self._engine = engine
+        self._saved = set() # hashes known to be on the table
+
+    def _load(self, key):
+        with self._engine.connect() as conn:
+            return conn.execute(text("SELECT DATA FROM IMAGES WHERE HASH = :hash"), 
+                {'hash' : key}).scalar()
+
+    def _save(self, key, data):
+        if key in self._saved:
+            return
+        with self._engine.begin() as conn:
+            conn.execute(text("INSERT OR IGNORE INTO IMAGES (HASH, DATA) VALUES (:hash, :data)"), 
+                {'hash' : key, 'data' : data})
+        with self._lock:
+            self._saved.add(key)
+
+
+class Componentdb(Base):
+    """connected component of the associations graph of a process (see `GraphStoredb`)"""
+    __tablename__ = 'COMPONENTS'
+    name = mapped_column('NAME', String(12), primary_key=True)
+    component = mapped_column('COMPONENT', Integer, index=True)
+    saved = mapped_column('SAVED', DateTime)
+
+
+class Edgedb(Base):
+    """association edges of a component - stored once for all its processes"""
+    __tablename__ = 'EDGES'
+    id = mapped_column('id', Integer, primary_key=True, autoincrement=True)
+    component = mapped_column('COMPONENT', Integer, index=True)
+    source = mapped_column('SOURCE', String(12))
+    target = mapped_column('TARGET', String(12))
+    data = mapped_column('DATA', JSONdt) # edge attributes like 'tipo' and 'data-ass'
+
+
+class GraphStoredb:
+    """
+    Associations graphs on tables EDGES and COMPONENTS - own connections, not the processes sessions.
+    A component is written once (one transaction) whatever its number of processes
+    and its id is the `unumber` of its oldest process.
+    """
+    def __init__(self, engine):
+        self._engine = engine
+
+    def save(self, edges):
+        """
+        replace the components of all processes on `edges` [(u, v, data), ...] 
+        by one component of those edges (order kept)
+        returns: component id
+        """
+        saved = datetime.utcnow()
+        nodes = list(dict.fromkeys( name for u, v, _ in edges for name in (u, v) ))
+        component = min( pud(name).unumber for name in nodes )
+        members, links = Componentdb.__table__, Edgedb.__table__
+        with self._engine.begin() as conn:
+            old = select(members.c.COMPONENT).where(members.c.NAME.in_(nodes))
+            # processes of old components not on this one are left without graph
+            conn.execute(links.delete().where(links.c.COMPONENT.in_(old)))
+            conn.execute(members.delete().where(members.c.COMPONENT.in_(old)))
+            conn.execute(members.insert(), [ {'NAME' : name, 'COMPONENT' : component, 'SAVED' : saved} 
+                for name in nodes ])
+            conn.execute(links.insert(), [ {'COMPONENT' : component, 'SOURCE' : u, 'TARGET' : v, 'DATA' : data}
+                for u, v, data in edges ])
+        return component
+
+    def component(self, name):
+        """component id of process `name` or None"""
+        members = Componentdb.__table__
+        with self._engine.connect() as conn:
+            return conn.execute(select(members.c.COMPONENT).where(members.c.NAME == name)).scalar()
+
+    def saved(self, name):
+        """(saved time, [processes names]) of the component of process `name` - (None, []) if none saved"""
+        members = Componentdb.__table__
+        component = select(members.c.COMPONENT).where(members.c.NAME == name).scalar_subquery()
+        with self._engine.connect() as conn:
+            rows = conn.execute(select(members.c.NAME, members.c.SAVED).where(
+                members.c.COMPONENT == component)).all()
+        return (rows[0][1] if rows else None), [ name for name, _ in rows ]
+
+    def edges(self, name):
+        """edges [(u, v, data), ...] of the component of process `name` - empty if none saved"""
+        members, links = Componentdb.__table__, Edgedb.__table__
+        component = select(members.c.COMPONENT).where(members.c.NAME == name).scalar_subquery()
+        with self._engine.connect() as conn:
+            return [ tuple(row) for row in conn.execute(select(links.c.SOURCE, links.c.TARGET, links.c.DATA).where(
+                links.c.COMPONENT == component).order_by(links.c.id)) ]
+
+
+class ComponentIndexdb(Base):
+    """union-find of associations of parsed basic pages (see `ComponentIndex`)"""
+    __tablename__ = 'COMPONENT_INDEX'
+    name = mapped_column('NAME', String(12), primary_key=True)
+    root = mapped_column('ROOT', String(12), index=True)
+    changed = mapped_column('CHANGED', DateTime) # last time its associations changed on a parsed page
+
+
+class ComponentIndex:
+    """
+    Persistent union-find of processes associations updated on every parsed basic page
+    so a component can be known without walking it (SCM requests).
+    Every process row has the ROOT of its set (union relabels the smaller set) 
+    so members are one indexed query. Associations removed are only forgotten 
+    by `reset` after the component is expanded again.
+    """
+    def __init__(self, engine):
+        self._engine = engine
+        self._lock = threading.Lock()
+
+    def update(self, name, associados, changed=True):
+        """
+        union `name` with its `associados` names 
+        * changed : associations of `name` changed (or first parsed) - renew its CHANGED time
+        """
+        index = ComponentIndexdb.__table__
+        names = list(dict.fromkeys([name, *associados]))
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(index.insert().prefix_with('OR IGNORE'), 
+                [ {'NAME' : member, 'ROOT' : member, 'CHANGED' : None} for member in names ])
+            if changed:
+                conn.execute(index.update().where(index.c.NAME == name).values(CHANGED=datetime.utcnow()))
+            for associado in names[1:]:
+                self._union(conn, name, associado)
+
+    def _union(self, conn, a, b):
+        index = ComponentIndexdb.__table__
+        roots = dict(conn.execute(select(index.c.NAME, index.c.ROOT).where(index.c.NAME.in_([a, b]))).all())
+        ra, rb = roots[a], roots[b]
+        if ra == rb:
+            return
+        sizes = dict(conn.execute(select(index.c.ROOT, func.count()).where(
+            index.c.ROOT.in_([ra, rb])).group_by(index.c.ROOT)).all())
+        small, big = (ra, rb) if sizes[ra] < sizes[rb] else (rb, ra)
+        conn.execute(index.update().where(index.c.ROOT == small).values(ROOT=big))
+
+    def members(self, name):
+        """(processes names, last CHANGED time) of the set of `name` - ([], None) if never parsed"""
+        index = ComponentIndexdb.__table__
+        root = select(index.c.ROOT).where(index.c.NAME == name).scalar_subquery()
+        with self._engine.connect() as conn:
+            rows = conn.execute(select(index.c.NAME, index.c.CHANGED).where(index.c.ROOT == root)).all()
+        changed = [ time for _, time in rows if time is not None ]
+        return [ name for name, _ in rows ], (max(changed) if changed else None)
+
+    def reset(self, names):
+        """`names` is a whole component (just expanded) - other processes on their sets become alone"""
+        index = ComponentIndexdb.__table__
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(index.insert().prefix_with('OR IGNORE'), # parsed before the index existed
+                [ {'NAME' : name, 'ROOT' : name, 'CHANGED' : None} for name in names ])
+            roots = select(index.c.ROOT).where(index.c.NAME.in_(names))
+            conn.execute(index.update().where(index.c.ROOT.in_(roots), index.c.NAME.not_in(names)).values(
+                ROOT=index.c.NAME))
+            conn.execute(index.update().where(index.c.NAME.in_(names)).values(ROOT=names[0]))
+
+
+class Checkpointdb(Base):
+    """progress of a bulk refresh run - one row per run and process (see `bulk.refresh`)"""
+    __tablename__ = 'CHECKPOINT'
+    run = mapped_column('RUN', String(64), primary_key=True)
+    name = mapped_column('NAME', String(12), primary_key=True)
+    status = mapped_column('STATUS', String(64)) # 'ok' or the exception class name 
+    time = mapped_column('TIME', DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, run, name, status):
+        self.run = run
+        self.name = name
+        self.status = status
+
+
+def sqlite_pragmas(engine, pragmas):
+    """
+    Set sqlite PRAGMA's on every new connection of `engine` like
+    {'journal_mode' : 'WAL', 'synchronous' : 'NORMAL', 'busy_timeout' : 30000}
+    """
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+
+legacy_columns = {'basic' : 'PAGE_BASIC', 'polygon' : 'PAGE_POLYGON'}
+
+def legacy_pages(engine):
+    """True if STORAGE still has the legacy html pages columns (see `migrate_pages`)"""
+    columns = [ column['name'] for column in inspect(engine).get_columns('STORAGE') ]
+    return 'PAGE_BASIC' in columns
+
+def legacy_page(session, processodb, page):
+    """html `page` ('basic' or 'polygon') of `processodb` from the legacy STORAGE columns"""
+    return session.execute(text(f"SELECT {legacy_columns[page]} FROM STORAGE WHERE id = :id"), 
+        {'id' : inspect(processodb).identity[0]}).scalar() or ''
+
+def migrate_pages(engine, chunk=500, vacuum=False):
+    """
+    Move html pages from legacy STORAGE columns PAGE_BASIC and PAGE_POLYGON 
+    to the compressed PAGES table then drop those columns - can't be undone, 
+    make a copy of the database file before.
+    Creates missing tables. Does nothing if the database is already migrated.
+    * vacuum : give back the space to the file system (slow, needs twice the database size on disk)
+    returns: number of processes migrated
+    """
+    Base.metadata.create_all(engine)
+    if not legacy_pages(engine):
+        return 0
+    pages = Pagesdb.__table__
+    with engine.begin() as conn:
+        ids = conn.execute(text("SELECT id FROM STORAGE WHERE id NOT IN (SELECT id FROM PAGES)")).scalars().all()
+        for i in range(0, len(ids), chunk): # chunks - don't load all pages in memory
+            rows = conn.execute(text("SELECT id, PAGE_BASIC, PAGE_POLYGON FROM STORAGE WHERE id IN "
+                "("+','.join(str(id) for id in ids[i:i+chunk])+")")).all()
+            conn.execute(pages.insert(), [ {'id' : id, 'PAGE_BASIC' : basic or '', 'PAGE_POLYGON' : polygon or ''}
+                for id, basic, polygon in rows ])
+        for column in ['PAGE_BASIC', 'PAGE_POLYGON']: # needs sqlite 3.35+ (python 3.10+)
+            conn.execute(text(f"ALTER TABLE STORAGE DROP COLUMN {column}"))
+    if vacuum:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM")) # give back the space to the file system
+    return len(ids)
+
+
+_base64_src = re.compile(r'src="data:image;base64,([A-Za-z0-9+/=]+)"')
+
+def migrate_images(engine, chunk=500, vacuum=False):
+    """
+    Move base64 images embedded on stored polygon pages to table IMAGES 
+    leaving 'img:<sha256>' references - see `ImageStoredb` and `web.io.inlineImages`.
+    Pages without embedded images are untouched.
+    * vacuum : give back the space to the file system (slow, needs twice the database size on disk)
+    returns: number of pages rewritten
+    """
+    Base.metadata.create_all(engine)
+    pages = Pagesdb.__table__
+    count = 0
+    with engine.begin() as conn:
+        ids = conn.execute(text("SELECT id FROM PAGES WHERE PAGE_POLYGON IS NOT NULL")).scalars().all()
+        for i in range(0, len(ids), chunk): # chunks - don't load all pages in memory
+            rows = conn.execute(select(pages.c.id, pages.c.PAGE_POLYGON).where(
+                pages.c.id.in_(ids[i:i+chunk]))).all()
+            images = {}
+            def reference(match):
+                data = base64.b64decode(match.group(1))
+                key = hashlib.sha256(data).hexdigest()
+                images[key] = data
+                return f'src="{image_ref}{key}"'
+            for id, html in rows:
+                if 'data:image;base64,' not in html:
+                    continue
+                conn.execute(pages.update().where(pages.c.id == id).values(
+                    PAGE_POLYGON=_base64_src.sub(reference, html)))
+                count += 1
+            if images:
+                conn.execute(text("INSERT OR IGNORE INTO IMAGES (HASH, DATA) VALUES (:hash, :data)"),
+                    [ {'hash' : key, 'data' : data} for key, data in images.items() ])
+    if count and vacuum:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM")) # give back the space to the file system
+    return count
@@ -0,0 +1,92 @@
+"""
+run with
+pytest -v test_parsing.py (current folder)
+or
+pytest -v aidbag/anm/careas/scm/test_parsing.py (Projects folder)
+
+golden files: SCM pages on test_pages folder and golden.json with their dados
+parsed by BeautifulSoup "html.parser" - the lxml fast path must give the same.
+Pages stored on the database (config['scm']['process_storage_file']) are also
+compared when it exists.
+"""
+import os
+import json
+import pathlib
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Session
+
+from aidbag.web.json import json_to_datetime
+from aidbag.anm.careas.config import config
+from aidbag.anm.careas.scm import (
+    sqlalchemy as sql,
+    parsing,
+    pud
+    )
+
+pages_path = pathlib.Path(__file__).parent / 'test_pages'
+golden = json.loads((pages_path / 'golden.json').read_text(encoding='utf-8'), object_hook=json_to_datetime)
+
+def parse(filename, page):
+    if 'basicos' in filename:
+        return parsing.parseDadosBasicos(page, pud(filename).str, False, None)
+    return parsing.parseDadosPoligonal(page, False)
+
+@pytest.mark.parametrize("parser", ['bs4', 'lxml'])
+@pytest.mark.parametrize("filename", sorted(golden))
+def test_golden(monkeypatch, parser, filename):
+    monkeypatch.setitem(config['scm'], 'parser', parser)
+    with open(pages_path / filename, encoding='utf-8', newline='') as file: # keep \r\n 
+        page = file.read()
+    assert parse(filename, page) == golden[filename]
+    if 'basicos' in filename:
+        assert parsing.parseNUP(page) == golden[filename]['NUP']
+
+def test_stored_pages(monkeypatch, sample=200):
+    """both parsers give the same on pages stored on the database"""
+    path = config['scm']['process_storage_file'] + '.db'
+    if not os.path.exists(path):
+        pytest.skip("no database of stored processes")
+    engine = create_engine(f"sqlite:///{path}")
+    if not inspect(engine).has_table('PAGES'):
+        pytest.skip("database not migrated")
+    with Session(engine) as session:
+        rows = session.query(sql.Processodb.name, sql.Pagesdb.basic_html, sql.Pagesdb.polygon_html
+            ).join(sql.Processodb.pages).limit(sample).all()
+    engine.dispose()
+    for name, basic, polygon in rows:
+        for filename, page in [('basicos', basic), ('poligonal', polygon)]:
+            if not page:
+                continue
+            results = []
+            for parser in ['bs4', 'lxml']:
+                monkeypatch.setitem(config['scm'], 'parser', parser)
+                try:
+                    results.append(parse(filename + name, page))
+                except Exception as e: # must fail the same way
+                    results.append(type(e))
+            assert results[0] == results[1], f"{filename} page of {name}"
+
+@pytest.mark.parametrize("filename", sorted(golden))
+def test_aspnet_states(filename):
+    """streaming form state extractor same as BeautifulSoup"""
+    from bs4 import BeautifulSoup
+    from aidbag.web import htmlscrap
+    page = (pages_path / filename).read_text(encoding='utf-8')
+    soup = BeautifulSoup(page, features="lxml")
+    expected = { name : soup.find('input', {'name': name})['value'] for name in htmlscrap.aspnetstates
+        if soup.find('input', {'name': name}) is not None }
+    assert htmlscrap.aspNetStates(page) == expected and '__VIEWSTATE' in expected
+
+@pytest.mark.parametrize("filename", sorted( name for name in golden if 'basicos' in name ))
+def test_table_columns(filename):
+    """columnar tables same as rows of `tableDataText`"""
+    from bs4 import BeautifulSoup
+    from aidbag.web import htmlscrap
+    page = (pages_path / filename).read_text(encoding='utf-8')
+    table = BeautifulSoup(page, "html.parser").find('table', {'id' : 'ctl00_conteudo_gridEventos'})
+    rows = htmlscrap.tableDataText(table)
+    assert htmlscrap.tableColumns(table) == { name : [ row[i] for row in rows[1:] ] 
+        for i, name in enumerate(rows[0]) }
+    frame = htmlscrap.tableFrame(str(table), dates=['Data'], datefmt="%d/%m/%Y")
+    assert len(frame) == len(rows) - 1 and str(frame.Data.dtype).startswith('datetime64')
@@ -0,0 +1,340 @@
+"""
+run with
+pytest -v test_processo.py (current folder)
+or
+pytest -v aidbag/anm/careas/scm/test_processo.py (Projects folder)
+
+uses a temporary sqlite database and canned 'associados' no SCM access
+"""
+import pytest
+
+from aidbag.web.htmlscrap import wPageNtlm
+from aidbag.anm.careas.config import config
+from aidbag.anm.careas.scm import (
+    sqlalchemy as sql,
+    parsing,
+    manager,
+    Processo,
+    SCM_SEARCH,
+    default_run_state
+    )
+
+# A - B, A - C, B - D, C - D (cyclic) and E - F disconnected
+associados_graph = {
+    '800.001/2000' : ['800.002/2001', '800.003/2002'],
+    '800.002/2001' : ['800.001/2000', '800.004/2003'],
+    '800.003/2002' : ['800.001/2000', '800.004/2003'],
+    '800.004/2003' : ['800.002/2001', '800.003/2002'],
+    '800.005/2004' : ['800.006/2005'],
+    '800.006/2005' : ['800.005/2004'],
+}
+
+class OfflineManager(manager.ProcessManagerClass):
+    """creates processes with canned dados instead of downloading them"""
+    def GetorCreate(self, processostr, wpagentlm, task=None, verbose=False, run=True):
+        processo = self[processostr]
+        if processo is None:
+            processo = Processo(processostr, manager=self)
+            dados = default_run_state()
+            dados['run']['basic'] = True
+            dados['prioridade'] = '01/01/'+processostr[-4:]
+            dados['associados'] = {'graph' : {}, 'dict' : { name : {'tipo' : 'Cessão'}
+                for name in associados_graph[processostr] }}
+            processo.update(dados)
+            self._local[processostr] = processo
+        return processo
+
+@pytest.fixture
+def pmanager(tmp_path, monkeypatch):
+    monkeypatch.setitem(config['scm'], 'process_storage_file', str(tmp_path / 'ProcessesStored'))
+    pm = OfflineManager()
+    sql.Base.metadata.create_all(pm._engine)
+    yield pm
+    pm._engine.dispose()
+
+@pytest.fixture
+def smanager(tmp_path, monkeypatch):
+    """real `GetorCreate` - basic pages 'downloaded' with canned dados"""
+    def canned(self, page_key, *args, **kwargs):
+        dados = default_run_state()
+        dados['run']['basic'] = True
+        dados['prioridade'] = '01/01/'+self.name[-4:]
+        dados['associados'] = {'graph' : {}, 'dict' : { name : {'tipo' : 'Cessão'}
+            for name in associados_graph.get(self.name, []) }}
+        self.update(dados)
+    monkeypatch.setattr(Processo, '_dadosScmGet', canned)
+    monkeypatch.setitem(config['scm'], 'process_storage_file', str(tmp_path / 'ProcessesStored'))
+    pm = manager.ProcessManagerClass()
+    sql.Base.metadata.create_all(pm._engine)
+    yield pm
+    pm._engine.dispose()
+
+def stored_names(pm):
+    with pm._engine.connect() as conn:
+        return [ name for name, in conn.exec_driver_sql("SELECT NAME FROM STORAGE ORDER BY NAME") ]
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_expand_associados_cyclic(pmanager, monkeypatch, workers):
+    monkeypatch.setitem(config['scm'], 'associados_workers', workers)
+    p = pmanager.GetorCreate('800.001/2000', None)
+    p._expandAssociados()
+    # same edges and order of a sequential FIFO queue search
+    expected = [('800.001/2000', '800.002/2001'), ('800.001/2000', '800.003/2002'),
+                ('800.002/2001', '800.004/2003'), ('800.003/2002', '800.004/2003')]
+    for name in ['800.001/2000', '800.002/2001', '800.003/2002', '800.004/2003']:
+        graph = pmanager[name].associadosGraph()
+        assert [ (u, v) for u, v in graph.edges ] == expected
+        assert pmanager.graphs.component(name) == 2000800001 # oldest unumber
+    assert p['run']['associados']
+    with pmanager._engine.connect() as conn: # edges written once for the component
+        assert conn.execute(sql.text("SELECT COUNT(*) FROM EDGES")).scalar() == 4
+
+def test_expand_associados_tree(pmanager):
+    p = pmanager.GetorCreate('800.006/2005', None)
+    p._expandAssociados()
+    assert p.associadosGraph().toList() == [('800.005/2004', '800.006/2005', {'tipo' : 'Cessão'})] # chronology
+    assert pmanager['800.005/2004'].associadosGraph().toList() == p.associadosGraph().toList()
+    assert p['prioridadec'] == '01/01/2004' # from the oldest
+    p._expandAssociados() # again - component replaced
+    assert len(pmanager.graphs.edges('800.005/2004')) == 1
+    assert '800.001/2000' not in pmanager._local # never visited
+
+def test_expand_associados_shared(smanager, monkeypatch):
+    monkeypatch.setitem(config['scm'], 'associados_workers', 4)
+    p = smanager.GetorCreate('800.001/2000', wPageNtlm.dummy(), task=SCM_SEARCH.BASICOS)
+    p._expandAssociados() # D shared by B and C 
+    assert stored_names(smanager) == ['800.001/2000', '800.002/2001', '800.003/2002', '800.004/2003']
+    assert p['run']['associados']
+
+def test_getorcreate_concurrent(smanager):
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(8) as executor: # like bulk refresh expansions sharing an associado
+        processes = list(executor.map(lambda i: smanager.GetorCreate('800.123/2001', None, run=False), range(8)))
+    assert all( processo is processes[0] for processo in processes )
+    assert stored_names(smanager) == ['800.123/2001']
+
+def test_expand_associados_saved_component(pmanager, monkeypatch):
+    pmanager.GetorCreate('800.001/2000', None)._expandAssociados()
+    fetched = []
+    getorcreate = pmanager.GetorCreate
+    def counting(processostr, *args, **kwargs):
+        fetched.append(processostr)
+        return getorcreate(processostr, *args, **kwargs)
+    monkeypatch.setattr(pmanager, 'GetorCreate', counting)
+    p = pmanager['800.004/2003']
+    p._expandAssociados() # same component nothing changed
+    assert not fetched and p['run']['associados']
+    assert len(p.associadosGraph().edges) == 4
+    # a page of the component parsed with new associations 
+    pmanager.components.update('800.002/2001', ['800.001/2000', '800.004/2003'], changed=True)
+    p._expandAssociados()
+    assert fetched # walked again
+
+def test_prioridades(pmanager):
+    for name in associados_graph:
+        pmanager.GetorCreate(name, None)
+    p = pmanager['800.006/2005']
+    p.view # in memory - must see the batch write
+    stats = pmanager.prioridades()
+    assert stats['components'] == 2 and stats['trees'] == 1 and stats['updated'] == 2
+    assert sorted(stats['not_trees'][0]) == ['800.001/2000', '800.002/2001', '800.003/2002', '800.004/2003']
+    assert p['prioridadec'] == pmanager['800.005/2004']['prioridadec'] == '01/01/2004'
+    assert 'prioridadec' not in pmanager['800.001/2000'] # cyclic
+
+def test_prioridades_one_sided(pmanager, monkeypatch):
+    monkeypatch.setitem(associados_graph, '800.007/2006', ['800.008/2007'])
+    monkeypatch.setitem(associados_graph, '800.008/2007', []) # doesn't list it back
+    for name in associados_graph:
+        pmanager.GetorCreate(name, None)
+    stats = pmanager.prioridades()
+    assert stats['trees'] == 2 and stats['updated'] == 2
+    assert stats['one_sided'] == [['800.007/2006', '800.008/2007']]
+    assert 'prioridadec' not in pmanager['800.008/2007'] and 'prioridadec' not in pmanager['800.007/2006']
+
+def test_readdb_version_cache(pmanager):
+    from sqlalchemy import event, text
+    p = pmanager.GetorCreate('800.006/2005', None)
+    p.view # first read after a write loads the row
+    statements = []
+    event.listen(pmanager._engine, 'before_cursor_execute', 
+        lambda conn, cursor, statement, *args: statements.append(statement))
+    p['run'], 'associados' in p
+    assert not any('DADOS' in statement for statement in statements) # served from memory
+    with pmanager._engine.begin() as conn: # another writer
+        conn.execute(text("UPDATE STORAGE SET DADOS = json_set(DADOS, '$.tipo', 'Lavra'), "
+            "VERSION = VERSION + 1 WHERE NAME = '800.006/2005'"))
+    assert p['tipo'] == 'Lavra'
+    p.view # loads the row changed by the other writer
+    version = p.db.version
+    p.update({'tipo' : 'Pesquisa'})
+    assert p.view['tipo'] == 'Pesquisa' and p.db.version == version + 1
+
+def test_dados_view(pmanager):
+    p = pmanager.GetorCreate('800.001/2000', None)
+    # not current - only the key is read from the JSON column
+    assert p['associados']['dict']['800.002/2001'] == {'tipo' : 'Cessão'}
+    assert 'associados' in p and 'polygon' not in p
+    view = p.view
+    assert view['run'] == p.dados['run'] 
+    with pytest.raises(TypeError):
+        view['run']['basic'] = False
+    dados = view.copy() # explicit copy on write 
+    dados['run']['basic'] = False
+    assert p['run']['basic']
+
+def test_writebehind(pmanager):
+    from sqlalchemy import event
+    a, b = pmanager.GetorCreate('800.005/2004', None), pmanager.GetorCreate('800.006/2005', None)
+    commits = []
+    event.listen(pmanager._engine, 'commit', lambda conn: commits.append(conn))
+    with pmanager.writebehind():
+        a.update({'status' : 'ok'})
+        a._set_html('basic', '<html>a</html>')
+        b.update({'status' : 'ok'})
+        dados = a.dados
+        dados['run']['basic'] = False
+        a.update(dados)
+        assert not commits # nothing written yet 
+        # readers see their own writes
+        assert a['status'] == 'ok' and a.view['status'] == 'ok' and 'status' in b
+        assert a.basic_html == '<html>a</html>' and not a['run']['basic']
+    assert len(commits) == 1 # one batched transaction
+    with pmanager.session() as session: # another reader
+        assert session.query(sql.Processodb).filter_by(name=a.name).one().dados['status'] == 'ok'
+    assert a.basic_html == '<html>a</html>' and not a._pending
+
+def basic_page(name, associado):
+    """minimal SCM basicos page with one associado"""
+    spans = {'DataPrioridade' : '01/01/2000 10:00:00', 'DataProtocolo' : '01/01/2000 10:00:00', 
+        'Area' : '50,00', 'UF' : 'MG', 'Nup' : '48400.800001/2000-00', 'TipoRequerimento' : 'Requerimento de Pesquisa', 
+        'TipoFase' : 'Autorização de Pesquisa', 'Ativo' : 'Sim'}
+    spans = ''.join(f'<span id="ctl00_conteudo_lbl{id}">{value}</span>' for id, value in spans.items())
+    tables = {'ProcessosAssociados' : f'<tr><th>Processo</th></tr><tr><td>{name}</td><td>Fulano</td>'
+                f'<td>Cessão</td><td>01/02/2010</td><td></td><td>{associado}</td><td></td></tr>',
+              'Substancias' : '<tr><th>S</th></tr><tr><td>OURO</td></tr>',
+              'Eventos' : '<tr><th>Evento</th></tr><tr><td>100</td><td>01/01/2000</td></tr>',
+              'Municipios' : '<tr><th>M</th></tr><tr><td>BH</td></tr>'}
+    tables = ''.join(f'<table id="ctl00_conteudo_grid{id}">{rows}</table>' for id, rows in tables.items())
+    return f'<html><body><input name="__VIEWSTATE" value="AAAA"/>{spans}{tables}</body></html>'
+
+def test_reparse(pmanager):
+    p = pmanager.GetorCreate('800.005/2004', None)
+    graph = [['800.005/2004', '800.006/2005', {'tipo' : 'Cessão'}]]
+    dados = p.dados
+    dados['associados']['graph'] = graph
+    p.update(dados)
+    p._set_html('basic', basic_page(p.name, '800.006/2005'))
+    pmanager.GetorCreate('800.006/2005', None) # no page stored - nothing to parse
+    stats = pmanager.reparse(processes=1)
+    assert stats['done'] == 1 and not stats['errors']
+    assert p['UF'] == 'MG' and p['parser']['basic'] == parsing.parser_version['basic']
+    assert p['associados']['graph'] == graph # same associados - graph kept
+    assert pmanager.pool.stats['created'] == 0 # no SCM requests
+    assert pmanager.reparse(processes=1)['done'] == 0 # nothing stale
+    assert pmanager.reparse(processes=1, force=True)['done'] == 1
+
+def test_refresh(pmanager, monkeypatch):
+    import datetime
+    p = pmanager.GetorCreate('800.005/2004', None)
+    p._set_html('basic', basic_page(p.name, '800.006/2005'))
+    pmanager.reparse(processes=1)
+    graph = [['800.005/2004', '800.006/2005', {'tipo' : 'Cessão'}]]
+    dados = p.dados
+    dados['associados']['graph'] = graph
+    dados['run'].update({'polygon' : True, 'associados' : True})
+    old = datetime.datetime(2000, 1, 1)
+    dados['fetched'] = {'basic' : old, 'polygon' : old, 'associados' : old}
+    dados['estudo'] = {'done' : True} # derived data must survive
+    p.update(dados)
+    assert p.expired() == ['basic', 'polygon', 'associados']
+    requests = []
+    page = basic_page(p.name, '800.006/2005')
+    def pageRequest(name):
+        requests.append(name)
+        p._set_html(name, page if name == 'basic' else '')
+    monkeypatch.setattr(p, '_pageRequest', pageRequest)
+    assert not p.refresh() # same page - no polygon request or graph expansion
+    assert requests == ['basic'] and not p.expired()
+    assert p['associados']['graph'] == graph and p['estudo']['done']
+    page = page.replace('800.006/2005', '800.001/2000') # new associado
+    assert p.refresh(['basic', 'polygon', 'associados'])
+    assert requests == ['basic', 'basic', 'polygon'] and p['run']['associados']
+    assert p['estudo']['done']
+
+def test_refresh_expands_associados(tmp_path, monkeypatch):
+    """real `GetorCreate` refreshing a changed basic page expands its associados (no deadlock)"""
+    import datetime, threading
+    monkeypatch.setitem(config['scm'], 'process_storage_file', str(tmp_path / 'ProcessesStored'))
+    pm = manager.ProcessManagerClass()
+    sql.Base.metadata.create_all(pm._engine)
+    pages = {'800.005/2004' : basic_page('800.005/2004', '800.006/2005'), 
+             '800.006/2005' : basic_page('800.006/2005', '800.005/2004')}
+    def pageRequest(self, name):
+        self._set_html(name, pages[self.name] if name == 'basic' else '')
+    monkeypatch.setattr(Processo, '_pageRequest', pageRequest)
+    p = pm.GetorCreate('800.005/2004', None)
+    assert p.associadosGraph().number_of_edges() == 1
+    old = datetime.datetime(2000, 1, 1)
+    for name in ['800.005/2004', '800.006/2005']:
+        dados = pm[name].dados
+        dados['fetched'] = {'basic' : old, 'associados' : old}
+        pm[name].update(dados)
+    # new evento - same associados (the graph is expanded again)
+    pages['800.005/2004'] = pages['800.005/2004'].replace('<tr><td>100</td>', 
+        '<tr><td>200</td><td>01/01/2020</td></tr><tr><td>100</td>')
+    worker = threading.Thread(target=pm.GetorCreate, args=('800.005/2004', None), daemon=True)
+    worker.start()
+    worker.join(30)
+    assert not worker.is_alive() # deadlocked 
+    assert len(p['eventos']) == 3 and p['run']['associados']
+    assert sorted(p.associadosGraph().nodes) == ['800.005/2004', '800.006/2005']
+    assert not p.expired()
+    pm._engine.dispose()
+
+def test_query(pmanager):
+    import datetime
+    from sqlalchemy import text
+    for name in associados_graph:
+        p = pmanager.GetorCreate(name, None)
+        p.update({'UF' : 'MG' if name < '800.004' else 'PA', 'tipo' : 'Requerimento de Pesquisa'})
+    rows = pmanager.query(('name', 'UF', 'prioridade'), where={'UF' : 'MG'})
+    assert sorted(rows) == [('800.001/2000', 'MG', None), ('800.002/2001', 'MG', None), ('800.003/2002', 'MG', None)]
+    p.update({'prioridade' : datetime.datetime(2005, 1, 1), 'estudo' : {'done' : True}})
+    assert pmanager.query(('name', 'prioridade'), where={'prioridade' : ('>', datetime.datetime(2004, 1, 1))}
+        ) == [('800.006/2005', datetime.datetime(2005, 1, 1))]
+    assert pmanager.query(['name'], where={'UF' : ['PA'], 'estudo.done' : True}) == [('800.006/2005',)]
+    assert len(pmanager.query(where={'tipo' : 'Requerimento de Pesquisa'}, frame=True)) == 6
+    with pmanager.session() as session: # sqlite uses the expression index
+        plan = session.execute(text("EXPLAIN QUERY PLAN SELECT NAME FROM STORAGE WHERE " + 
+            sql.dados_field('UF') + " = 'MG'")).all()
+    assert 'ix_storage_UF' in str(plan)
+
+@pytest.fixture
+def tracing():
+    """tracing module - disabled and without spans after the test"""
+    from aidbag.web import tracing
+    yield tracing
+    tracing.disable()
+    tracing.spans.clear()
+
+def test_tracing(pmanager, tracing, tmp_path):
+    import csv
+    p = pmanager.GetorCreate('800.006/2005', None)
+    p.view
+    assert not tracing.spans # disabled no-op
+    tracing.enable()
+    try:
+        dados = p.dados
+        dados['prioridade'] = '01/01/2006'
+        p.update(dados)
+        p.view
+    finally:
+        tracing.disable()
+    costs = tracing.breakdown()
+    for stage in ['Processo.update', 'lock.wait', 'updatedb', 'session.commit', 'json.dumps', 'readdb']:
+        assert ('800.006/2005', stage) in costs # inner spans inherit the process
+    total = sum( span['duration'] for span in tracing.spans if span['parent'] == '' )
+    assert abs(sum( cost['self'] for cost in costs.values() ) - total) < 1e-6
+    tracing.to_csv(tmp_path / 'spans.csv')
+    with open(tmp_path / 'spans.csv') as file:
+        assert len(list(csv.DictReader(file))) == len(tracing.spans)
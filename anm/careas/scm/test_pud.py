@@ -0,0 +1,49 @@
+"""
+run with
+pytest -v test_pud.py (current folder)
+or
+pytest -v aidbag/anm/careas/scm/test_pud.py (Projects folder)
+"""
+import io
+import copy
+import pickle
+import pytest
+
+from aidbag.anm.careas.scm.pud import (
+    pud,
+    keyPud,
+    sortPud,
+    rankPud,
+    oldestPud,
+    scanPud,
+    scanUnumbers
+    )
+
+def test_interned():
+    a, b = pud('830.001/2000'), pud('48403.830.001/2000-09')
+    assert a is b and pud(a) is a and a in {pud('830001-2000')}
+    assert sorted(['830.002/2000', '300.001/2000', '1/2001', '830.001/2000'], key=lambda x: pud(x).key
+        ) == ['300.001/2000', '830.001/2000', '830.002/2000', '1/2001'] 
+    with pytest.raises(AttributeError):
+        a._n = '002'
+    assert a.std == '830.001/2000'
+    assert copy.deepcopy(a) is a and pickle.loads(pickle.dumps(a)) is a
+    cached = pud._fromshortstr.cache_info().currsize
+    assert pud('processo 830.001/2000 ' + 'x'*1000) is a # long texts are not cached
+    assert pud._fromshortstr.cache_info().currsize == cached
+
+def test_sort_keys():
+    names = ['1/2001', '830.002/2000', '48403.830.001/2000-09', '847/1945']
+    assert sortPud(names) == sorted(names, key=keyPud) == ['847/1945', '48403.830.001/2000-09', '830.002/2000', '1/2001']
+    assert rankPud(names).tolist() == [3, 2, 1, 0]
+    assert oldestPud(set(names)) == '847/1945' and oldestPud([]) is None
+    assert sortPud(['300.001/2000', '1/2001'], strict=True) == ['300.001/2000', '1/2001']
+    with pytest.raises(ValueError):
+        sortPud(names + ['300.001/2000'], strict=True)
+
+def test_scan():
+    text = "847/1945,xx2.537/2016\n48054.830817/2024-91\n27203.831741/2002-85 e 1/2001\n"
+    expected = [ (p.year, p._g, p._n) for p in pud.getAll(text) ]
+    assert list(scanPud(text)) == list(scanPud(io.StringIO(text))) == expected
+    assert list(scanPud([text[:30], text[30:33], text[33:]])) == expected
+    assert scanUnumbers(text).tolist() == [ p.unumber for p in pud.getAll(text) ]
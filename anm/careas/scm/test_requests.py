@@ -0,0 +1,248 @@
+"""
+run with
+pytest -v test_requests.py (current folder)
+or
+pytest -v aidbag/anm/careas/scm/test_requests.py (Projects folder)
+
+SCM requests against a fake server - no network
+"""
+import pytest
+import requests as pyrequests
+from urllib.parse import parse_qsl
+
+from aidbag.web.resilience import Resilience, CircuitOpen
+from aidbag.web.transport import Transport
+from aidbag.anm.careas.scm import requests
+
+form = ('<form><input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{state}" />'
+        '<input type="submit" name="ctl00$conteudo$btnConsultarProcesso" value="Consultar" />{grids}</form>')
+grids = '<table id="ctl00_conteudo_gridPessoas"></table><table id="ctl00_conteudo_gridEventos"></table>'
+
+@pytest.fixture(autouse=True)
+def resilience(monkeypatch):
+    """SCM resilience without backoff sleeps"""
+    resilience = Resilience(retries=2, backoff=0., policies=requests.resilience.policies)
+    monkeypatch.setattr(requests, 'resilience', resilience)
+    return resilience
+
+class FakeWPage:
+    """answers GET with a new form state and POST with the process page
+    a state is valid only once (like an expired __VIEWSTATE) if `strict`"""
+    def __init__(self, strict=False):
+        self.calls, self.state, self.strict = [], 0, strict
+
+    def _respond(self, text, status=200):
+        response = pyrequests.Response()
+        response._content, response.encoding = text.encode(), 'utf-8'
+        response.status_code, response.url = status, requests.scm_processo_main_url
+        self.response = response
+        response.raise_for_status()
+        return response
+
+    def get(self, url, **kwargs):
+        self.calls.append('GET')
+        self.state += 1
+        return self._respond(form.format(state=self.state, grids=''))
+
+    def post(self, url, data, **kwargs):
+        self.calls.append('POST')
+        if self.strict and data['__VIEWSTATE'] != str(self.state):
+            return self._respond('Invalid viewstate.', 500)
+        self.state += 1
+        return self._respond(form.format(state=self.state, grids=grids) + data['ctl00$conteudo$txtNumeroProcesso'])
+
+def test_reuse_viewstate():
+    wpage = FakeWPage()
+    for name in ['800.001/2000', '800.002/2001', '800.003/2002']:
+        html, url = requests.pageRequest('basic', name, wpage, reuse=True)
+        assert html.endswith(name)
+    assert wpage.calls == ['GET', 'POST', 'POST', 'POST'] # one GET for all 
+
+def test_reuse_viewstate_refused():
+    wpage = FakeWPage(strict=True)
+    requests.pageRequest('basic', '800.001/2000', wpage, reuse=True)
+    wpage.state += 1 # server forgot the state 
+    html, url = requests.pageRequest('basic', '800.002/2001', wpage, reuse=True)
+    assert html.endswith('800.002/2001')
+    assert wpage.calls == ['GET', 'POST', 'POST', 'GET', 'POST'] # falls back to a GET
+
+class FakeDeltaWPage(FakeWPage):
+    """answers AJAX partial postbacks with a delta response (unless `broken`)"""
+    def __init__(self, broken=False):
+        super().__init__()
+        self.broken = broken
+
+    def post(self, url, data, headers=None, **kwargs):
+        if not headers:
+            return super().post(url, data, **kwargs)
+        self.calls.append('ASYNCPOST')
+        assert data['__ASYNCPOST'] == 'true' and data['__VIEWSTATE'] == str(self.state)
+        self.state += 1
+        if self.broken: # like a proxy answering an error page
+            return self._respond('<html>Erro</html>')
+        panel = grids + data['ctl00$conteudo$txtNumeroProcesso']
+        state = str(self.state)
+        return self._respond(f'{len(panel)}|updatePanel|ctl00_conteudo_UpdatePanel1|{panel}|'
+            f'{len(state)}|hiddenField|__VIEWSTATE|{state}|')
+
+def test_delta():
+    wpage = FakeDeltaWPage()
+    for name in ['800.001/2000', '800.002/2001']:
+        html, url = requests.pageRequest('basic', name, wpage, reuse=False, delta=True)
+        assert html == grids + name # only the update panel 
+    assert wpage.calls == ['GET', 'ASYNCPOST', 'GET', 'ASYNCPOST']
+
+def test_delta_fallback():
+    wpage = FakeDeltaWPage(broken=True)
+    html, url = requests.pageRequest('basic', '800.001/2000', wpage, delta=True)
+    assert html.endswith('800.001/2000') and '<form>' in html # full page
+    assert wpage.calls == ['GET', 'ASYNCPOST', 'GET', 'POST']
+
+def test_not_found_not_retried(resilience):
+    class NotFoundWPage(FakeWPage):
+        def post(self, url, data, **kwargs):
+            self.calls.append('POST')
+            return self._respond('Processo não encontrado')
+    wpage = NotFoundWPage()
+    with pytest.raises(requests.NotFoundErrorSCM):
+        requests.pageRequest('basic', '800.001/2000', wpage)
+    assert wpage.calls == ['GET', 'POST'] and resilience.stats['retries'] == 0
+
+def test_timeout_retried_longer(resilience):
+    timeouts = []
+    class SlowWPage(FakeWPage):
+        def get(self, url, timeout, **kwargs):
+            timeouts.append(timeout)
+            if len(timeouts) < 3:
+                raise pyrequests.exceptions.ReadTimeout()
+            return super().get(url)
+    html, url = requests.pageRequest('basic', '800.001/2000', SlowWPage())
+    assert timeouts == [40, 80, 160] and resilience.stats['retries'] == 2
+
+def test_circuit_breaker():
+    import time
+    resilience = Resilience(retries=0, backoff=0., window=4, error_rate=0.5, cooldown=0.2)
+    def fail(timeout, attempt):
+        raise pyrequests.exceptions.ConnectionError()
+    for i in range(4):
+        with pytest.raises(pyrequests.exceptions.ConnectionError):
+            resilience.call(fail)
+    assert resilience.stats['trips'] == 1 
+    start = time.monotonic() # all callers pause until the cooldown ends
+    assert resilience.call(lambda timeout, attempt: 'ok') == 'ok'
+    assert time.monotonic() - start >= 0.15 and resilience.stats['waited'] >= 0.15
+
+def test_halfopen_single_probe():
+    import time
+    import threading
+    resilience = Resilience(retries=0, backoff=0., window=2, error_rate=0.5, cooldown=0.1, probe_timeout=5.)
+    def fail(timeout, attempt):
+        raise pyrequests.exceptions.ConnectionError()
+    for i in range(2):
+        with pytest.raises(pyrequests.exceptions.ConnectionError):
+            resilience.call(fail)
+    assert resilience.stats['trips'] == 1
+    probed, started = threading.Event(), []
+    def probe(timeout, attempt):
+        started.append(probed.is_set()) 
+        if len(started) == 1: # the probe 
+            time.sleep(0.1)
+            probed.set()
+        return 'ok'
+    threads = [ threading.Thread(target=resilience.call, args=(probe,)) for i in range(4) ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.15) # cooldown ended and probe running
+    with pytest.raises(CircuitOpen): # half-open
+        resilience.call(probe, block=False)
+    for thread in threads:
+        thread.join(5)
+    assert started == [False, True, True, True] # waiters went only after the probe
+
+def test_halfopen_nested_call():
+    import time
+    import threading
+    resilience = Resilience(retries=0, backoff=0., window=2, error_rate=0.5, cooldown=0.1)
+    def fail(timeout, attempt):
+        raise pyrequests.exceptions.ConnectionError()
+    for i in range(2):
+        with pytest.raises(pyrequests.exceptions.ConnectionError):
+            resilience.call(fail)
+    time.sleep(0.15) # next call is the probe
+    def outer(timeout, attempt): # like fetch_save_Html calling cancelaUltimo
+        return resilience.call(lambda timeout, attempt: 'inner')
+    results = []
+    thread = threading.Thread(target=lambda: results.append(resilience.call(outer)), daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive() and results == ['inner']
+    assert resilience.call(lambda timeout, attempt: 'ok', block=False) == 'ok' # closed
+
+def test_retry_budget():
+    resilience = Resilience(retries=5, backoff=0., budget=0.5, min_retries=2, window=100)
+    def fail(timeout, attempt):
+        raise pyrequests.exceptions.ConnectionError()
+    with pytest.raises(pyrequests.exceptions.ConnectionError):
+        resilience.call(fail)
+    assert resilience.stats['retries'] == 2 and resilience.stats['budget_exhausted'] == 1
+
+class FakeServer(pyrequests.adapters.BaseAdapter):
+    """requests adapter answering like `FakeWPage` - a new __VIEWSTATE on every response"""
+    def __init__(self):
+        super().__init__()
+        self.state = 0
+
+    def send(self, request, **kwargs):
+        self.state += 1
+        text = form.format(state=self.state, grids='')
+        if request.method == 'POST':
+            fields = dict(parse_qsl(request.body))
+            text = form.format(state=self.state, grids=grids) + fields['ctl00$conteudo$txtNumeroProcesso']
+        response = pyrequests.Response()
+        response._content, response.encoding = text.encode(), 'utf-8'
+        response.status_code, response.url, response.request = 200, request.url, request
+        return response
+
+def test_record_replay(tmp_path):
+    from aidbag.web.htmlscrap import wPage
+    path = str(tmp_path / 'scm.json.gz')
+    wpage = wPage()
+    wpage.session.mount('https://', FakeServer())
+    recorder = Transport(path, mode='record')
+    recorder.mount(wpage)
+    recorded = [ requests.pageRequest('basic', name, wpage) for name in ['800.001/2000', '800.002/2001'] ]
+    recorder.save()
+    replay = Transport(path, latency=0.01) # no server
+    assert [ requests.pageRequest('basic', name, replay.mount(wPage())) 
+        for name in ['800.001/2000', '800.002/2001'] ] == recorded  # __VIEWSTATE not on the key
+    assert replay.stats['replayed'] == 4 and replay.stats['missing'] == 0
+    with pytest.raises(requests.BasicosErrorSCM): 
+        requests.pageRequest('basic', '800.003/2003', replay.mount(wPage())) # not recorded
+    failing = Transport(path, error_rate=1., errors=(500,))
+    with pytest.raises(requests.BasicosErrorSCM):
+        requests.pageRequest('basic', '800.001/2000', failing.mount(wPage()))
+    assert failing.stats['injected'] == 3 # retried twice
+
+def test_no_urllib3_retries():
+    from aidbag.web.htmlscrap import wPage
+    class ErrorServer(pyrequests.adapters.HTTPAdapter):
+        """counts requests reaching the server - always 503"""
+        def __init__(self):
+            super().__init__()
+            self.sent = 0
+        def send(self, request, **kwargs):
+            self.sent += 1
+            response = pyrequests.Response()
+            response._content, response.status_code, response.url = b'', 503, request.url
+            response.request = request
+            return response
+    wpage = wPage(nretries=10)
+    server = ErrorServer()
+    wpage.session.mount('https://', server)
+    wpage.setRetries(10)
+    assert server.max_retries.total == 10
+    with pytest.raises(requests.BasicosErrorSCM):
+        requests.pageRequest('basic', '800.001/2000', wpage)
+    assert wpage.nretries == 0 and server.max_retries.total == 0
+    assert server.sent == 3 # retried twice by `resilience` only
+    assert requests.resilience.retryable(pyrequests.exceptions.RetryError())
@@ -63,4 +63,82 @@ def test_dados(session):
     assert p.dados['xxx']['x'] == 'z'
     # p = session.query(sql.Processodb).filter_by(name=pname).first()
     # session.delete(p)
-    # session.commit()
\ No newline at end of file
+    # session.commit()
+
+def test_polygon_html_deferred(session):
+    pname = generate_random_name(7)
+    p = sql.Processodb(pname)
+    p.polygon_html = '<img src="data:image;base64,AAAA">'*100
+    session.add(p)
+    session.commit()
+    session.refresh(p) # must not load html pages
+    assert 'pages' not in p.__dict__
+    assert p.polygon_html == '<img src="data:image;base64,AAAA">'*100
+
+
+def test_migrate_pages(tmp_path):
+    from sqlalchemy import text
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn: # legacy STORAGE with html pages inline
+        conn.execute(text("CREATE TABLE STORAGE (id INTEGER PRIMARY KEY, NAME VARCHAR(12) UNIQUE, "
+            "DADOS TEXT, PAGE_BASIC TEXT, PAGE_POLYGON TEXT, MODIFIED DATETIME, VERSION INTEGER NOT NULL)"))
+        conn.execute(text("INSERT INTO STORAGE VALUES (1, '800.001/2000', '{}', 'basic page', "
+            "'polygon page', '2024-01-01 00:00:00', 1)"))
+    sql.Base.metadata.create_all(engine)
+    assert sql.legacy_pages(engine)
+    with Session(engine) as session: # readable before migrating
+        p = session.query(sql.Processodb).filter_by(name='800.001/2000').first()
+        assert p.basic_html == ''
+        assert sql.legacy_page(session, p, 'basic') == 'basic page'
+        assert sql.legacy_page(session, p, 'polygon') == 'polygon page'
+    assert sql.migrate_pages(engine) == 1
+    assert not sql.legacy_pages(engine)
+    assert sql.migrate_pages(engine) == 0 # already migrated
+    with Session(engine) as session:
+        p = session.query(sql.Processodb).filter_by(name='800.001/2000').first()
+        assert p.basic_html == 'basic page'
+        assert p.polygon_html == 'polygon page'
+    engine.dispose()
+
+
+class FakeSession:
+    """requests.Session like - every image is the same spacer"""
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        return type('Response', (), {'content' : b'GIF89a spacer'})
+
+def test_image_store(tmp_path):
+    from aidbag.web.io import fetchSimpleHTMLStr, inlineImages
+    engine = create_engine(f"sqlite:///{tmp_path / 'images.db'}")
+    sql.Base.metadata.create_all(engine)
+    store = sql.ImageStoredb(engine)
+    session = FakeSession()
+    page = '<html><img src="/img/spacer.gif"><img src="/img/spacer.gif"><img src="/img/icon.gif"></html>'
+    html = fetchSimpleHTMLStr('http://scm/page.aspx', session=session, html=page, store=store)
+    html = fetchSimpleHTMLStr('http://scm/page.aspx', session=session, html=page, store=store)
+    assert sorted(session.urls) == ['http://scm/img/icon.gif', 'http://scm/img/spacer.gif'] # once each
+    assert 'base64' not in html and html.count('src="img:') == 3
+    embedded = fetchSimpleHTMLStr('http://scm/page.aspx', session=session, html=page)
+    assert inlineImages(html, sql.ImageStoredb(engine)) == embedded # other store same table
+    engine.dispose()
+
+def test_migrate_images(tmp_path):
+    from aidbag.web.io import inlineImages
+    engine = create_engine(f"sqlite:///{tmp_path / 'images.db'}")
+    html = '<img src="data:image;base64,R0lGODlh">'*100
+    with Session(engine) as session:
+        sql.Base.metadata.create_all(engine)
+        p = sql.Processodb('800.001/2000')
+        p.polygon_html = html
+        session.add(p)
+        session.commit()
+    assert sql.migrate_images(engine) == 1
+    assert sql.migrate_images(engine) == 0 # nothing embedded anymore
+    with Session(engine) as session:
+        p = session.query(sql.Processodb).filter_by(name='800.001/2000').first()
+        assert 'base64' not in p.polygon_html
+        assert inlineImages(p.polygon_html, sql.ImageStoredb(engine)) == html
+    engine.dispose()
@@ -62,7 +62,6 @@ def currentProcessGet(path=None, sort='name', clear=True):
         if not cur_path.is_dir():
             continue
         try:
-            pud(str(cur_path))
             ProcessPathStorage.update({ pud(str(cur_path)).str : cur_path.absolute()})      
         except NotProcessNumber:
             continue 
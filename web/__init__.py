@@ -1,7 +1,17 @@
 from .htmlscrap import (
     wPage,
     wPageNtlm,
+    wPageNtlmPool,
     formdataPostAspNet,
+    aspNetStates,
+    parseAspNetDelta,
     tableDataText,
-    dictDataText
+    dictDataText,
+    lxmlDocument,
+    lxmlTableDataText,
+    lxmlDictDataText,
+    lxmlTableColumns,
+    tableColumns,
+    columnsFrame,
+    tableFrame
 )
\ No newline at end of file
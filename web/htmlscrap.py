@@ -1,10 +1,17 @@
 #html web-scraping
 from requests_ntlm import HttpNtlmAuth
 import os
+import re
+import html as htmllib
+import time
+import threading
 import requests
+from contextlib import contextmanager
 from urllib3.util.retry import Retry
 from requests import adapters
 from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 from .io import (
     saveSimpleHTMLFolder, 
     saveSimpleHTML
@@ -28,7 +35,6 @@ from urllib3.exceptions import InsecureRequestWarning
 
 class wPage: # html  webpage scraping with soup and requests
     def __init__(self, nretries=10, ssl=True): # requests session
-        self.nretries = nretries    
         self.ssl = ssl 
         self.session = requests.Session()
         if not ssl: # disable ssl verification certificates
@@ -38,12 +44,27 @@ class wPage: # html  webpage scraping with soup and requests
             # not allowing it to verify=False
             # Suppress only the single warning from urllib3 needed.
             requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)        
-        retries = Retry(total=nretries,
+        # https://stackoverflow.com/a/35504626/1207193
+        self.session.mount('http://', adapters.HTTPAdapter())
+        self.session.mount('https://', adapters.HTTPAdapter()) 
+        self.setRetries(nretries)
+
+    def setRetries(self, nretries):
+        """
+        urllib3 retries of connection and 5xx errors on the session adapters (also 
+        the ones wrapped by a recording `web.transport.Transport`).
+        Use 0 when calls are wrapped by a `web.resilience.Resilience` - retries would multiply.
+        """
+        retries = Retry(0, read=False) # requests default - no retries
+        if nretries:
+            retries = Retry(total=nretries,
                         backoff_factor=0.1, # will sleep for [0.1s, 0.2s, 0.4s, ...] between retries
                         status_forcelist=[ 500, 502, 503, 504 ])
-        # https://stackoverflow.com/a/35504626/1207193
-        self.session.mount('http://', adapters.HTTPAdapter(max_retries=retries))
-        self.session.mount('https://', adapters.HTTPAdapter(max_retries=retries)) 
+        for adapter in self.session.adapters.values():
+            adapter = getattr(adapter, 'adapter', adapter) 
+            if isinstance(adapter, adapters.HTTPAdapter):
+                adapter.max_retries = retries
+        self.nretries = nretries
 
     # testing with 
     # wp = wPage()
@@ -110,24 +131,164 @@ class wPageNtlm(wPage): # overwrites original class for ntlm authentication
     __copy__ = copy # Now works with copy.copy too
 
 
+class wPageNtlmPool:
+    """
+    Pool of authenticated `wPageNtlm` keyed by credentials (user, passwd, ssl).
+    A borrowed wPage keeps its requests.Session and so its keep-alive (already 
+    NTLM authenticated) connections, avoiding a new handshake on every request.
+    One wPage is only used by one thread at a time (borrow - release).
+
+    * maxsize : int
+        maximum number of idle wPage's kept for each credential.
+        Borrowing more than that is allowed, extra ones are closed on release.
+    * idle_timeout : float
+        seconds after which an idle wPage is evicted (session closed)
+    * transport : web.transport.Transport
+        mounted on every new wPage (record/replay) - `clear` to drop older ones
+
+    Usage:
+    with pool.borrow(user, passwd) as wpage:
+        wpage.get(url)
+    """
+    def __init__(self, maxsize=8, idle_timeout=5*60., transport=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.transport = transport
+        self._idle = {} # key : [ (wpage, last time released) ... ] last is the warmest
+        self._lock = threading.Lock()
+        self.stats = {'created' : 0, 'reused' : 0, 'evicted' : 0}
+
+    def _evict(self, now):
+        """close idle wPage's that exceeded `idle_timeout` - must hold the lock"""
+        for key, idles in self._idle.items():
+            alive = []
+            for wpage, last in idles:
+                if now - last > self.idle_timeout:
+                    wpage.session.close()
+                    self.stats['evicted'] += 1
+                else:
+                    alive.append((wpage, last))
+            self._idle[key] = alive
+
+    def acquire(self, user, passwd, ssl=True):
+        """borrow a warm `wPageNtlm` for those credentials or create a new one"""
+        key = (user, passwd, ssl)
+        with self._lock:
+            self._evict(time.monotonic())
+            idles = self._idle.get(key)
+            if idles: # LIFO - same thread gets back the same session
+                self.stats['reused'] += 1
+                return idles.pop()[0]
+            self.stats['created'] += 1
+        wpage = wPageNtlm(user, passwd, ssl=ssl)
+        if self.transport is not None:
+            self.transport.mount(wpage)
+        return wpage
+
+    def release(self, wpage):
+        """give back a `wPageNtlm` borrowed by `acquire`"""
+        key = (wpage.user, wpage.passwd, wpage.ssl)
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            idles = self._idle.setdefault(key, [])
+            if len(idles) < self.maxsize:
+                idles.append((wpage, now))
+                return
+            self.stats['evicted'] += 1
+        wpage.session.close()
+
+    @contextmanager
+    def borrow(self, user, passwd, ssl=True):
+        """context manager for `acquire` and `release`"""
+        wpage = self.acquire(user, passwd, ssl)
+        try:
+            yield wpage
+        finally:
+            self.release(wpage)
+
+    @property
+    def handshakes_saved(self):
+        """number of times a warm wPage was reused instead of a new one"""
+        return self.stats['reused']
+
+    def clear(self):
+        """close all idle wPage's"""
+        with self._lock:
+            for idles in self._idle.values():
+                for wpage, _ in idles:
+                    wpage.session.close()
+            self._idle.clear()
+
+
+aspnetstates = ['__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION', '__EVENTTARGET',
+                '__EVENTARGUMENT', '__VIEWSTATEENCRYPTED' ]
+
+_input_tag = re.compile(r'<input\b[^>]*>', re.IGNORECASE)
+_tag_attribute = re.compile(r'''([^\s"'>/=]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''')
+
+def aspNetStates(html, names=aspnetstates):
+    """
+    AspNet states (hidden <input> values) of a html page without building a DOM.
+    Only <input> tags are scanned (regex) - much faster than parsing the whole page.
+    Stops when all `names` were found. First input of each name wins like `soup.find`.
+    returns: dict {name : value} of states found
+    """
+    names, states = set(names), {}
+    for tag in _input_tag.finditer(html):
+        attributes = { match[1].lower() : match[2] if match[2] is not None else 
+            match[3] if match[3] is not None else match[4] 
+            for match in _tag_attribute.finditer(tag[0]) }
+        name = attributes.get('name')
+        if name in names and name not in states:
+            states[name] = htmllib.unescape(attributes.get('value', ''))
+            if len(states) == len(names):
+                break
+    return states
+
+# headers of an AspNet AJAX partial postback (UpdatePanel) - also needs '__ASYNCPOST' : 'true' on formdata
+aspnetdelta_headers = {'X-MicrosoftAjax' : 'Delta=true', 'X-Requested-With' : 'XMLHttpRequest'}
+
+def parseAspNetDelta(text):
+    """
+    Parse an AspNet AJAX partial postback response (delta format) 
+    made of records `length|type|id|content|` where length is of content.
+    Raises ValueError if `text` isn't a delta or it is an 'error' or 'pageRedirect' record.
+    returns: list of records (type, id, content) like
+        [('updatePanel', 'ctl00_conteudo_UpdatePanel1', '<div>...</div>'), 
+         ('hiddenField', '__VIEWSTATE', '/wEPDwUK...') ...]
+    """
+    records, start = [], 0
+    while start < len(text):
+        end = text.index('|', start) # ValueError if not found
+        length = int(text[start:end])
+        type_end = text.index('|', end+1)
+        id_end = text.index('|', type_end+1)
+        content = text[id_end+1:id_end+1+length]
+        start = id_end+2+length
+        if len(content) != length or text[start-1:start] != '|':
+            raise ValueError("Not an AspNet delta response")
+        type, id = text[end+1:type_end], text[type_end+1:id_end]
+        if type in ('error', 'pageRedirect'):
+            raise ValueError(f"AspNet delta {type} {id} {content}")
+        records.append((type, id, content))
+    return records
+
 def formdataPostAspNet(html, formcontrols):
     """
     Creates a formdata dict based on dict of formcontrols to make a post request
     to an AspNet html page. Use the previous html text to extract the AspNet
-    states of the page.
+    states of the page (see `aspNetStates`) or of a partial postback delta 
+    response (see `parseAspNetDelta`).
 
     response : from page GET request
     formcontrols : dict from webpage with values assigned
     """
-    # get the aspnet form data neeed with bsoup
-    soup = BeautifulSoup(html, features="lxml")
-    aspnetstates = ['__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION', '__EVENTTARGET',
-                    '__EVENTARGUMENT', '__VIEWSTATEENCRYPTED' ];
-    formdata = {}
-    for aspnetstate in aspnetstates: # search for existing aspnet states and get its values when existent
-        result = soup.find('input', {'name': aspnetstate})
-        if not (result is None):
-            formdata.update({aspnetstate : result['value']})
+    try: # AJAX partial postback response - states on hiddenField records
+        formdata = { id : content for type, id, content in parseAspNetDelta(html)
+            if type == 'hiddenField' and id in aspnetstates }
+    except ValueError: # full page
+        formdata = aspNetStates(html)
 
     # include aditional form controls params
     formdata.update(formcontrols)
@@ -187,3 +348,113 @@ def dictDataText(soup, data_tags, strip=True):
                     result = result.strip()
             dados.update({data : result})
     return dados
+
+
+#### HTML PARSING DATA - lxml fast path
+# same results of BeautifulSoup "html.parser" functions above (tested on SCM pages)
+# but only the needed elements are looked at and libxml2 does the parsing 
+
+_CR = '\ue000' # carriage return placeholder - libxml2 normalizes \r\n to \n bs4 doesn't
+
+def lxmlDocument(html):
+    """
+    lxml.html document of `html` str for `lxmlDictDataText` and `lxmlTableDataText`.
+    Carriage returns are kept and script/style text is removed like bs4 `get_text`.
+    Raises lxml.etree.ParserError on an empty document.
+    """
+    parser = lxml.html.HTMLParser(encoding='utf-8')
+    root = lxml.html.document_fromstring(html.replace('\r', _CR).encode('utf-8'), parser=parser)
+    etree.strip_elements(root, 'script', 'style', with_tail=False)
+    return root
+
+def lxmlText(element, strip=False):
+    """text of a `lxmlDocument` element like bs4 `.text` or `.get_text(strip=True)`"""
+    if strip:
+        return ''.join(text.replace(_CR, '\r').strip() for text in element.itertext())
+    return ''.join(element.itertext()).replace(_CR, '\r')
+
+def lxmlTableDataText(table):
+    """same as `tableDataText` for a `lxmlDocument` <table> element"""
+    rows = []
+    trs = list(table.iter('tr'))
+    headerow = [lxmlText(th, strip=True) for th in trs[0].iter('th')] # header row
+    if headerow: 
+        rows.append(headerow)
+        trs = trs[1:]
+    for tr in trs: 
+        rows.append([lxmlText(td, strip=True) for td in tr.iter('td')])
+    return rows
+
+def lxmlDictDataText(root, data_tags, strip=True):
+    """
+    Same as `dictDataText` for a `lxmlDocument`. 
+    Tags searched only by 'id' (like SCM pages `data_tags`) are all found in 
+    one pass over the elements having an id instead of one `soup.find` each.
+    """
+    byid = {}
+    for element in root.xpath('//*[@id]'): # document order - first wins like soup.find
+        byid.setdefault((element.tag, element.get('id')), element)
+    dados = {}
+    for data, (tag, attrs) in data_tags.items():
+        if list(attrs) == ['id']:
+            result = byid.get((tag, attrs['id']))
+        else:
+            result = next((element for element in root.iter(tag) 
+                if all(element.get(key) == value for key, value in attrs.items())), None)
+        if result is not None:
+            if tag == 'table': # parse table if table
+                result = lxmlTableDataText(result)
+            else:
+                result = lxmlText(result)
+                if strip: # strip text
+                    result = result.strip()
+            dados.update({data : result})
+    return dados
+
+def lxmlTableColumns(table):
+    """
+    Columnar `lxmlTableDataText` of a `lxmlDocument` <table> element: {header : [values]}
+    First row (<th> or <td>) is the header. Missing cells are ''. No list of rows is built.
+    """
+    trs = table.iter('tr')
+    first = next(trs, None)
+    if first is None:
+        return {}
+    header = ([lxmlText(th, strip=True) for th in first.iter('th')] or 
+              [lxmlText(td, strip=True) for td in first.iter('td')])
+    columns = [ [] for _ in header ]
+    appends = [ column.append for column in columns ]
+    for tr in trs:
+        cells = tr.iter('td')
+        for append in appends:
+            cell = next(cells, None)
+            append(lxmlText(cell, strip=True) if cell is not None else '')
+    return dict(zip(header, columns))
+
+def tableColumns(table):
+    """
+    Columnar `tableDataText` {header : [values]} see `lxmlTableColumns`.
+    `table` is a `lxmlDocument` element, a BeautifulSoup <table> or a html str (first <table>)
+    """
+    if not isinstance(table, etree._Element):
+        root = lxmlDocument(str(table))
+        table = root if root.tag == 'table' else root.find('.//table')
+    return lxmlTableColumns(table)
+
+def columnsFrame(columns, dates=None, ints=None, datefmt="%d/%m/%Y %H:%M:%S"):
+    """
+    pandas DataFrame of `columns` {header : [values]} with typed columns
+    * dates : column names parsed as datetime with `datefmt` (vectorized)
+    * ints : column names converted to int
+    """
+    import pandas as pd
+    frame = pd.DataFrame(columns)
+    for column in dates or []:
+        frame[column] = pd.to_datetime(frame[column], format=datefmt)
+    for column in ints or []:
+        frame[column] = frame[column].astype(int)
+    return frame
+
+def tableFrame(table, dates=None, ints=None, datefmt="%d/%m/%Y %H:%M:%S"):
+    """`tableColumns` as pandas DataFrame see `columnsFrame` - replaces `DataFrame(rows[1:], columns=rows[0])`"""
+    return columnsFrame(tableColumns(table), dates, ints, datefmt)
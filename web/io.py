@@ -5,6 +5,11 @@ from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 import pathlib
 import base64
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import tracing
 
 
 def try_read_html(path):
@@ -73,29 +78,95 @@ def saveSimpleHTMLFolder(url, pagepath='page', session=requests.Session(), html=
     writeHTML(pagepath, soup.prettify('utf-8'))
 
 
-def fetchSimpleHTMLStr(url, session=requests.Session(), html=None, verbose=True):
+# src of images kept on an `ImageStore` 'img:<sha256 hex>' - see `inlineImages`
+image_ref = 'img:'
+_image_ref_src = re.compile(r'src="img:([0-9a-f]{64})"')
+
+
+class ImageStore:
+    """
+    Content-addressed images {sha256 : bytes} - stored once no matter how many pages use them.
+    Remembers the hash of urls already fetched so repeated images (icons, spacers) 
+    are downloaded only once. In memory - subclasses persist overriding `_load` and `_save`.
+    """
+    def __init__(self):
+        self._images = {}
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        return self._images.get(key)
+
+    def _save(self, key, data):
+        with self._lock:
+            self._images[key] = data
+
+    def get(self, key):
+        """image bytes or None"""
+        return self._load(key)
+
+    def put(self, data, url=None):
+        """store image `data` downloaded from `url` returns its hash"""
+        key = hashlib.sha256(data).hexdigest()
+        self._save(key, data)
+        if url:
+            with self._lock:
+                self._urls[url] = key
+        return key
+
+    def known(self, url):
+        """hash of image at `url` if already fetched else None"""
+        return self._urls.get(url)
+
+
+def inlineImages(html, store):
+    """replace `image_ref` srcs of `html` by base64 data of images on `store` (for export or display)"""
+    def inline(match):
+        data = store.get(match.group(1))
+        if data is None: # not on this store keep the reference
+            return match.group(0)
+        return f'src="data:image;base64,{base64.b64encode(data).decode("utf-8")}"'
+    return _image_ref_src.sub(inline, html)
+
+
+@tracing.traced()
+def fetchSimpleHTMLStr(url, session=requests.Session(), html=None, verbose=True, store=None, workers=4):
     """
     Returns a web page html as a string (works fo basic static pages).
-    Encode images as base64 strings!        
+    Encode images as base64 strings! Or if `store` (`ImageStore`) is given
+    images are stored there and srcs are references 'img:<sha256>' (see `inlineImages`).
+    Distinct images are downloaded concurrently by `workers` threads.
     All other resources scrits, links etc will be gone.          
     if `html` is not None - it will be used instead of web request.
     """
     if not html:
         html = session.get(url).content    
     soup = BeautifulSoup(html, 'html.parser')
-    def img_base64(image_url):
-        """download image and encode the image data to base64"""
-        img_data = session.get(image_url).content
-        return base64.b64encode(img_data).decode('utf-8')    
-    # Iterate over each image tag and replace the src attribute with base64 encoded image data
-    for img in soup.find_all('img'):
-        if 'src' in img.attrs:
-            img_src = img['src']
-            if not img_src.startswith('http'):
-                img_src = urljoin(url, img_src)                
-            img['src'] = f'data:image;base64,{img_base64(img_src)}'
+    images = [ img for img in soup.find_all('img') 
+        if 'src' in img.attrs and not img['src'].startswith('data:') ] # already embedded
+    srcs = [ urljoin(url, img['src']) for img in images ]
+    def fetch(image_url):
+        """download image - if `store` its hash"""
+        if store is not None:
+            key = store.known(image_url)
+            if key is None:
+                key = store.put(session.get(image_url).content, image_url)
+            return key
+        return session.get(image_url).content
+    unique = list(dict.fromkeys(srcs))
+    if len(unique) > 1:
+        with ThreadPoolExecutor(min(workers, len(unique))) as pool:
+            fetched = dict(zip(unique, pool.map(fetch, unique)))
+    else:
+        fetched = { src : fetch(src) for src in unique }
+    # replace the src attribute with base64 encoded image data or the store reference
+    for img, src in zip(images, srcs):
+        if store is not None:
+            img['src'] = f'{image_ref}{fetched[src]}'
+        else:
+            img['src'] = f'data:image;base64,{base64.b64encode(fetched[src]).decode("utf-8")}'
     # return html as text - and remove unecessary '\n' I don't care for saving or displaying it
-    return soup.decode('utf-8').replace('\n', '') 
+    return str(soup).replace('\n', '')
     
 
 def saveSimpleHTML(url, pagepath='page', session=requests.Session(), html=None, verbose=True):
@@ -0,0 +1,201 @@
+"""
+Shared retry layer for requests to slow or overloaded servers (SCM, SIGAREAS).
+One `Resilience` per host shared by all threads:
+    * exponential backoff with full jitter between attempts
+    * retry budget - retries only while they are a fraction of the requests
+    * circuit breaker - when the error rate spikes all workers pause
+    * policies by error class - never retry some, longer timeouts for others
+"""
+import time
+import random
+import threading
+from collections import deque
+from requests.exceptions import (
+    HTTPError,
+    RetryError,
+    ReadTimeout,
+    ConnectionError
+    )
+
+# error class : policy - first isinstance match wins (order matters)
+# retry : bool or callable(error) -> bool
+# timeout : factor multiplying the timeout of the next attempt
+default_policies = {
+    ReadTimeout     : {'retry' : True, 'timeout' : 2.},
+    ConnectionError : {'retry' : True},
+    HTTPError       : {'retry' : lambda e: e.response is None or e.response.status_code >= 500},
+    RetryError      : {'retry' : True}, # 5xx after urllib3 retries (see `wPage.setRetries`)
+}
+
+
+class CircuitOpen(Exception):
+    """breaker is open and the call was not allowed to wait"""
+
+
+class Resilience:
+    """
+    Retry, backoff and circuit breaker of requests to one host.
+
+    * retries : int
+        maximum number of retries of one call
+    * backoff, max_backoff : float
+        sleeps random(0, min(max_backoff, backoff*2**attempt)) seconds before retrying
+    * budget, min_retries : float, int
+        every call deposits `budget` retries (up to `min_retries` saved) and every
+        retry takes one - so retries are at most ~`budget` of calls when things go bad
+    * window, error_rate, cooldown : int, float, float
+        breaker trips when `error_rate` of the last `window` attempts failed
+        then every call waits `cooldown` seconds. After it one attempt decides
+        (half-open) while the others wait: success closes, failure trips again.
+    * probe_timeout : float
+        seconds waited for a half-open probe before the next waiter probes instead
+        default `cooldown`
+    * policies : dict
+        {error class : {'retry' : bool or callable, 'timeout' : factor}} checked
+        before `default_policies`. Errors without policy are not retried.
+
+    Usage:
+    scm = Resilience(retries=3)
+    html = scm.call(request, url, timeout=40) # request(url, timeout=..., attempt=...)
+
+    Errors not retried (like a 'not found') don't count as failures - the server answered.
+    """
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30., budget=0.2, min_retries=10,
+            window=20, error_rate=0.5, cooldown=60., probe_timeout=None, policies=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.min_retries = min_retries
+        self.window = window
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.probe_timeout = cooldown if probe_timeout is None else probe_timeout
+        self.policies = dict(policies or {})
+        for cls, policy in default_policies.items():
+            self.policies.setdefault(cls, policy)
+        self._lock = threading.Lock()
+        self._tokens = float(min_retries)
+        self._outcomes = deque(maxlen=window) # True for failure
+        self._opened = None # time the breaker tripped
+        self._probe = None # token of the running half-open probe attempt
+        self._probing = 0. # time it started 
+        self._probed = threading.Condition(self._lock) # probe result or breaker tripped
+        self._local = threading.local() # `probe` token of this thread - its nested calls go through
+        self.stats = {'calls' : 0, 'retries' : 0, 'trips' : 0, 'waited' : 0., 'budget_exhausted' : 0}
+
+    def policy(self, error):
+        """policy of `error` - {'retry' : False} if none"""
+        for cls, policy in self.policies.items():
+            if isinstance(error, cls):
+                return policy
+        return {'retry' : False}
+
+    def retryable(self, error):
+        retry = self.policy(error).get('retry', False)
+        return retry(error) if callable(retry) else retry
+
+    def _sleep(self, seconds):
+        time.sleep(seconds)
+        with self._lock:
+            self.stats['waited'] += seconds
+
+    def _wait_closed(self, block):
+        """
+        wait while the breaker is open or a half-open probe is running.
+        Nested calls made by the probe go through. A probe running longer 
+        than `probe_timeout` is taken over by the next waiter.
+        returns: probe token if this attempt is the half-open probe else None
+        """
+        with self._lock:
+            while True:
+                if getattr(self._local, 'probe', None) is not None:
+                    return None
+                now = time.monotonic()
+                if self._probe is not None: # only the probe goes - wait its result
+                    remaining = self._probing + self.probe_timeout - now
+                elif self._opened is None:
+                    return None
+                else:
+                    remaining = self._opened + self.cooldown - now
+                if remaining <= 0: # half-open - this attempt decides
+                    self._opened, self._probe, self._probing = None, object(), now
+                    return self._probe
+                if not block:
+                    raise CircuitOpen(("circuit half-open, probe running for " if self._probe is not None 
+                        else "circuit open for ") + f"{remaining:.1f} s")
+                self._probed.wait(remaining)
+                self.stats['waited'] += time.monotonic() - now
+
+    def _record(self, failed, probe=None):
+        """record an attempt outcome and trip the breaker if needed"""
+        with self._lock:
+            if probe is not None and probe is self._probe: # not taken over
+                self._probe = None
+                if failed:
+                    self._trip()
+                self._probed.notify_all()
+                return
+            self._outcomes.append(failed)
+            if (len(self._outcomes) == self.window and
+                    sum(self._outcomes) >= self.error_rate*self.window):
+                self._trip()
+
+    def _trip(self):
+        """open the breaker - must hold the lock"""
+        self._opened = time.monotonic()
+        self._outcomes.clear()
+        self.stats['trips'] += 1
+        self._probed.notify_all()
+
+    def _withdraw(self):
+        """take one retry from the budget"""
+        with self._lock:
+            if self._tokens < 1:
+                self.stats['budget_exhausted'] += 1
+                return False
+            self._tokens -= 1
+            self.stats['retries'] += 1
+            return True
+
+    def call(self, function, *args, timeout=None, retries=None, block=True, **kwargs):
+        """
+        Call `function(*args, timeout=timeout, attempt=attempt, **kwargs)`
+        retrying on errors whose policy allows it.
+        `attempt` starts at 0 - functions may do something different on retries.
+        * retries : maximum number of retries default `self.retries`
+        * block : wait while the breaker is open otherwise raise `CircuitOpen`
+        returns: function result or raises its last error
+        """
+        retries = self.retries if retries is None else retries
+        with self._lock:
+            self.stats['calls'] += 1
+            self._tokens = min(self._tokens + self.budget, self.min_retries)
+        attempt = 0
+        while True:
+            probe = self._wait_closed(block)
+            if probe is not None:
+                self._local.probe = probe
+            try:
+                result = function(*args, timeout=timeout, attempt=attempt, **kwargs)
+            except Exception as e:
+                retryable = self.retryable(e)
+                self._record(retryable, probe)
+                if not retryable or attempt >= retries or not self._withdraw():
+                    raise
+                if timeout is not None:
+                    timeout *= self.policy(e).get('timeout', 1.)
+                self._sleep(random.uniform(0, min(self.max_backoff, self.backoff*2**attempt)))
+                attempt += 1
+            except BaseException: # like KeyboardInterrupt - next waiter probes instead
+                with self._lock:
+                    if probe is not None and probe is self._probe:
+                        self._probe, self._opened = None, time.monotonic() - self.cooldown
+                        self._probed.notify_all()
+                raise
+            else:
+                self._record(False, probe)
+                return result
+            finally:
+                if probe is not None:
+                    self._local.probe = None
@@ -0,0 +1,134 @@
+"""
+Tracing spans of hot paths - where the time of a run goes
+(network, parsing, database, JSON, lock waits) per process and per stage.
+Disabled by default: `span` returns a shared no-op context manager and `traced`
+functions call straight through - only a flag check.
+
+Usage:
+from aidbag.web import tracing
+tracing.enable()
+... # GetorCreate, bulk refresh, Interferencia.make etc.
+tracing.breakdown() # {(process, stage) : {'count' : 3, 'total' : 1.2, 'self' : 0.9}}
+tracing.to_csv('spans.csv') # or to_json - one row per span
+tracing.disable()
+
+Spans nest per thread. A span without process inherits it from the enclosing span
+and 'self' time excludes inner spans, so 'self' times of a thread add up to its traced time.
+"""
+import csv
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import nullcontext
+
+enabled = False
+spans = [] # finished spans - dicts with `fields`
+fields = ['process', 'stage', 'parent', 'thread', 'start', 'duration', 'self']
+
+_noop = nullcontext()
+_local = threading.local()
+_start = time.perf_counter()
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class Span:
+    """one timed stage - use `span`"""
+    __slots__ = ('stage', 'process', 'parent', 'start', 'children')
+
+    def __init__(self, stage, process=None):
+        self.stage = stage
+        self.process = process
+
+    def __enter__(self):
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        self.parent = parent.stage if parent else ''
+        if self.process is None:
+            self.process = parent.process if parent else ''
+        self.children = 0.
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += duration
+        spans.append({'process' : self.process, 'stage' : self.stage, 'parent' : self.parent,
+            'thread' : threading.current_thread().name, 'start' : self.start - _start,
+            'duration' : duration, 'self' : duration - self.children})
+        return False
+
+
+def span(stage, process=None):
+    """context manager timing `stage` of `process` (str key, default the enclosing span one)"""
+    if not enabled:
+        return _noop
+    return Span(stage, process)
+
+
+def traced(stage=None, process=None):
+    """
+    decorator timing calls of a function as `stage` (default its qualified name)
+    * process : callable(*args, **kwargs) -> str key of the process like `lambda self: self.name`
+    """
+    def decorator(function):
+        name = stage or function.__qualname__
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(name, process(*args, **kwargs) if process else None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable(clear=True):
+    """start tracing - `clear` drops spans of a previous run"""
+    global enabled, _start
+    if clear:
+        spans.clear()
+        _start = time.perf_counter()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def breakdown(by=('process', 'stage')):
+    """
+    cost of spans grouped by `by` fields like ('stage',) or ('process', 'stage')
+    returns: {(key, ...) : {'count' : int, 'total' : seconds, 'self' : seconds}} slowest 'self' first
+    """
+    groups = {}
+    for record in list(spans):
+        key = tuple( record[field] for field in by )
+        group = groups.setdefault(key, {'count' : 0, 'total' : 0., 'self' : 0.})
+        group['count'] += 1
+        group['total'] += record['duration']
+        group['self'] += record['self']
+    return dict(sorted(groups.items(), key=lambda item: -item[1]['self']))
+
+
+def to_json(path):
+    with open(path, 'w') as file:
+        json.dump(list(spans), file)
+
+
+def to_csv(path):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(list(spans))
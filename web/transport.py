@@ -0,0 +1,190 @@
+"""
+Record/replay transport (requests adapter) for `wPage`/`wPageNtlm` - run and benchmark
+SCM, SIGAREAS and estudos pipelines offline.
+    * record - requests go to the server and request/response pairs are saved to an archive
+    * replay - responses come from the archive with latency and error injection, no network
+
+Usage:
+transport = Transport('scm.json.gz', mode='record')
+transport.mount(wpage) # or ProcessManager.pool.transport = transport
+... # GetorCreate, Interferencia.make etc.
+transport.save()
+
+transport = Transport('scm.json.gz', mode='replay', latency='recorded', error_rate=0.01)
+transport.mount(wpage)
+"""
+import gzip
+import json
+import time
+import base64
+import random
+import threading
+import datetime
+from urllib.parse import parse_qsl
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from requests.exceptions import (
+    ConnectionError,
+    ReadTimeout
+    )
+
+# form fields that change on every request (AspNet states) - not part of the key
+ignored_fields = ['__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION',
+    '__VIEWSTATEENCRYPTED', '__LASTFOCUS']
+
+
+class Transport(BaseAdapter):
+    """
+    requests adapter recording or replaying request/response pairs.
+    Key is method, url and form fields (except `ignored` ones) - a later response
+    for the same key replaces the former. NTLM challenges (401) are not recorded
+    so replayed pages need no authentication.
+
+    * path : str
+        archive file (gzip json) - loaded if it exists
+    * mode : 'record' or 'replay'
+    * latency : float, (min, max), 'recorded' or callable(key) -> seconds
+        replay delay of each response - 'recorded' uses the measured server time
+    * error_rate : float
+        fraction of replayed requests failing with one of `errors`
+    * errors : 'timeout', 'connection' or http status codes like 500
+    * seed : random seed for latency and errors
+    * ignored : form fields not part of the key
+
+    stats = {'recorded', 'replayed', 'missing', 'injected'}
+    """
+    def __init__(self, path, mode='replay', latency=0., error_rate=0.,
+            errors=('timeout', 'connection', 500), seed=None, ignored=ignored_fields):
+        super().__init__()
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Invalid mode {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = errors
+        self.ignored = set(ignored)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.archive = {}
+        self.stats = {'recorded' : 0, 'replayed' : 0, 'missing' : 0, 'injected' : 0}
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                self.archive = json.load(file)
+        except FileNotFoundError:
+            if mode == 'replay':
+                raise
+
+    def mount(self, wpage):
+        """use this transport on `wpage` session (record wraps its adapters for the real requests)"""
+        for prefix in ('http://', 'https://'):
+            adapter = self
+            if self.mode == 'record': # NTLM auth is per connection - keep each session adapter 
+                adapter = _Recorder(self, wpage.session.get_adapter(prefix))
+            wpage.session.mount(prefix, adapter)
+        return wpage
+
+    def key(self, request):
+        """method, url and form fields of a `requests.PreparedRequest` as str"""
+        body = request.body or ''
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', errors='replace')
+        fields = sorted( (name, value) for name, value in parse_qsl(body, keep_blank_values=True)
+            if name not in self.ignored )
+        return json.dumps([request.method, request.url, fields], ensure_ascii=False)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.mode == 'record':
+            raise RuntimeError("Record mode needs `mount`")
+        return self._replay(request, timeout)
+
+    def _record(self, request, response, elapsed):
+        if response.status_code != 401:
+            with self._lock:
+                self.archive[self.key(request)] = {
+                    'status' : response.status_code,
+                    'reason' : response.reason,
+                    'url' : response.url,
+                    'headers' : dict(response.headers),
+                    'content' : base64.b64encode(response.content).decode('ascii'),
+                    'elapsed' : elapsed }
+                self.stats['recorded'] += 1
+
+    def _delay(self, key, recorded):
+        if self.latency == 'recorded':
+            return recorded['elapsed']
+        if callable(self.latency):
+            return self.latency(key)
+        if isinstance(self.latency, (tuple, list)):
+            return self._random.uniform(*self.latency)
+        return self.latency
+
+    def _replay(self, request, timeout):
+        key = self.key(request)
+        recorded = self.archive.get(key)
+        if recorded is None:
+            with self._lock:
+                self.stats['missing'] += 1
+            raise ConnectionError(f"Not recorded {key}", request=request)
+        if isinstance(timeout, tuple): # (connect, read)
+            timeout = timeout[1]
+        delay = self._delay(key, recorded)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise ReadTimeout(f"Replay latency {delay:.1f} s > timeout {timeout} s", request=request)
+        time.sleep(delay)
+        status = recorded['status']
+        with self._lock:
+            error = self.errors and self._random.random() < self.error_rate
+            if error:
+                error = self._random.choice(self.errors)
+                self.stats['injected'] += 1
+            else:
+                self.stats['replayed'] += 1
+        if error == 'timeout':
+            raise ReadTimeout("Injected timeout", request=request)
+        elif error == 'connection':
+            raise ConnectionError("Injected connection error", request=request)
+        elif error:
+            status = error
+        response = Response()
+        response.status_code = status
+        response.reason = recorded['reason'] if status == recorded['status'] else 'Injected error'
+        response.headers = CaseInsensitiveDict(recorded['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = recorded['url']
+        response._content = base64.b64decode(recorded['content'])
+        response._content_consumed = True # there is no raw connection
+        response.elapsed = datetime.timedelta(seconds=delay)
+        response.request = request
+        response.connection = self
+        return response
+
+    def save(self, path=None):
+        """write the archive (record mode)"""
+        with self._lock:
+            with gzip.open(path or self.path, 'wt', encoding='utf-8') as file:
+                json.dump(self.archive, file)
+
+    def close(self):
+        pass
+
+
+class _Recorder(BaseAdapter):
+    """adapter of one session on `Transport` record mode - real requests go to `adapter`"""
+    def __init__(self, transport, adapter):
+        super().__init__()
+        self.transport = transport
+        self.adapter = adapter
+
+    def send(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        response = self.adapter.send(request, *args, **kwargs)
+        self.transport._record(request, response, time.perf_counter() - start)
+        response.connection = self # NTLM handshake legs come back here
+        return response
+
+    def close(self):
+        self.adapter.close()